@@ -0,0 +1,30 @@
+import httpx
+import pytest_asyncio
+
+from assistant.integrations.prometheus import PROMETHEUS_RESPONSE_CACHE
+from assistant.integrations.prometheus.health import PrometheusHealthChecker
+from assistant.logic.tools import PrometheusFunctions
+
+
+@pytest_asyncio.fixture
+async def mock_prometheus_functions():
+    # Builds PrometheusFunctions answered by `handler`, health checks included, and closes them after the test even
+    # when it fails. With `health_checks=False` the checker is stopped right away, so only function calls reach
+    # the handler.
+    created: list[tuple[PrometheusFunctions, PrometheusHealthChecker]] = []
+
+    async def make(handler, *, health_checks: bool = True, **kwargs) -> PrometheusFunctions:
+        transport = httpx.MockTransport(handler)
+        health_checker = PrometheusHealthChecker(base_url="http://localhost", transport=transport)
+        pf = PrometheusFunctions(transport=transport, health_checker=health_checker, **kwargs)
+        created.append((pf, health_checker))
+        if not health_checks:
+            await health_checker.stop()
+        return pf
+
+    PROMETHEUS_RESPONSE_CACHE.clear()
+    yield make
+    for pf, health_checker in created:
+        await pf.aclose()
+        await health_checker.aclose()
+    PROMETHEUS_RESPONSE_CACHE.clear()
@@ -0,0 +1,113 @@
+import functools
+import logging
+import os
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Connections kept open per API server, port forwards and concurrent lookups share them.
+API_CLIENT_POOL_SIZE = 16
+# Cluster versions only change on upgrades.
+VERSION_TTL_SECONDS = 3600
+
+
+def _default_config_file() -> str:
+    # Same lookup as the kubernetes client, KUBECONFIG may list several files.
+    return os.environ.get("KUBECONFIG", "~/.kube/config")
+
+
+class ApiClientRegistry:
+    # One ApiClient (and so one connection pool) per kubeconfig context, shared by every caller. Everything cached is
+    # dropped when one of the kubeconfig files changes on disk, and only then is the kubeconfig parsed again.
+
+    def __init__(self, *, config_file: str | None = None, clock=time.monotonic) -> None:
+        self._config_file = config_file or _default_config_file()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._signature: tuple | None = None
+        self._clients: dict[str | None, object] = {}
+        self._contexts: tuple[list[dict], dict] | None = None
+        self._versions: dict[str | None, tuple[float, str]] = {}
+
+    def _config_paths(self) -> list[str]:
+        return [os.path.expanduser(p) for p in self._config_file.split(os.pathsep) if p]
+
+    def _current_signature(self) -> tuple:
+        signature = []
+        for path in self._config_paths():
+            try:
+                signature.append((path, os.stat(path).st_mtime_ns))
+            except FileNotFoundError:
+                signature.append((path, None))
+        return tuple(signature)
+
+    def _invalidate_if_changed(self) -> None:
+        # Must be called with the lock held
+        signature = self._current_signature()
+        if signature == self._signature:
+            return
+        if self._signature is not None:
+            _logger.info(f"Kubeconfig changed, dropping {len(self._clients)} cached API clients")
+        for api_client in self._clients.values():
+            api_client.close()
+        self._clients.clear()
+        self._contexts = None
+        self._versions.clear()
+        self._signature = signature
+
+    def _new_api_client(self, context: str | None):
+        from kubernetes import client, config
+
+        configuration = client.Configuration()
+        config.load_kube_config(
+            config_file=self._config_file, context=context, client_configuration=configuration, persist_config=False
+        )
+        configuration.connection_pool_maxsize = max(configuration.connection_pool_maxsize, API_CLIENT_POOL_SIZE)
+        return client.ApiClient(configuration)
+
+    def get_api_client(self, context: str | None = None):
+        # `None` is the kubeconfig's current context
+        with self._lock:
+            self._invalidate_if_changed()
+            api_client = self._clients.get(context)
+            if api_client is None:
+                _logger.info(f"Creating Kubernetes API client for context {context or '<current>'}")
+                api_client = self._clients[context] = self._new_api_client(context)
+            return api_client
+
+    def list_contexts(self) -> tuple[list[dict], dict]:
+        from kubernetes import config
+
+        with self._lock:
+            self._invalidate_if_changed()
+            if self._contexts is None:
+                self._contexts = config.list_kube_config_contexts(config_file=self._config_file)
+            return self._contexts
+
+    def get_version(self, context: str | None = None) -> str:
+        from kubernetes import client
+
+        with self._lock:
+            self._invalidate_if_changed()
+            cached = self._versions.get(context)
+            if cached is not None and cached[0] > self._clock():
+                return cached[1]
+        # The API call itself runs without the lock, lookups for other contexts shouldn't wait on it.
+        version_info = client.VersionApi(self.get_api_client(context)).get_code()
+        version = f"{version_info.major}.{version_info.minor}"
+        with self._lock:
+            self._versions[context] = (self._clock() + VERSION_TTL_SECONDS, version)
+        return version
+
+    def close(self) -> None:
+        with self._lock:
+            for api_client in self._clients.values():
+                api_client.close()
+            self._clients.clear()
+            self._signature = None
+
+
+@functools.cache
+def get_api_client_registry() -> ApiClientRegistry:
+    return ApiClientRegistry()
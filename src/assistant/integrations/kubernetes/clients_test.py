@@ -0,0 +1,89 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+import yaml
+from kubernetes import client
+
+from assistant.integrations.kubernetes.clients import ApiClientRegistry
+
+
+def _write_kubeconfig(path, contexts: list[str]) -> None:
+    path.write_text(
+        yaml.safe_dump(
+            {
+                "apiVersion": "v1",
+                "kind": "Config",
+                "current-context": contexts[0],
+                "clusters": [{"name": c, "cluster": {"server": f"https://{c}.example:6443"}} for c in contexts],
+                "users": [{"name": "user", "user": {"token": "token"}}],
+                "contexts": [{"name": c, "context": {"cluster": c, "user": "user"}} for c in contexts],
+            }
+        )
+    )
+
+
+def _touch_later(path) -> None:
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def kubeconfig(tmp_path):
+    path = tmp_path / "config"
+    _write_kubeconfig(path, ["prod", "staging"])
+    return path
+
+
+def test_api_clients_are_shared_per_context(kubeconfig) -> None:
+    registry = ApiClientRegistry(config_file=str(kubeconfig))
+
+    prod = registry.get_api_client("prod")
+    assert registry.get_api_client("prod") is prod
+    assert registry.get_api_client("staging") is not prod
+    assert prod.configuration.host == "https://prod.example:6443"
+    assert prod.configuration.connection_pool_maxsize >= 16
+    registry.close()
+
+
+def test_kubeconfig_is_reloaded_only_when_it_changes(kubeconfig) -> None:
+    registry = ApiClientRegistry(config_file=str(kubeconfig))
+    contexts, current = registry.list_contexts()
+    prod = registry.get_api_client("prod")
+
+    assert registry.list_contexts()[0] is contexts
+    assert [c["name"] for c in contexts] == ["prod", "staging"]
+    assert current["name"] == "prod"
+
+    _write_kubeconfig(kubeconfig, ["prod", "staging", "dev"])
+    _touch_later(kubeconfig)
+
+    assert [c["name"] for c in registry.list_contexts()[0]] == ["prod", "staging", "dev"]
+    assert registry.get_api_client("prod") is not prod
+    registry.close()
+
+
+def test_versions_are_cached(kubeconfig, monkeypatch) -> None:
+    calls = []
+
+    class FakeVersionApi:
+        def __init__(self, api_client) -> None:
+            self._host = api_client.configuration.host
+
+        def get_code(self):
+            calls.append(self._host)
+            return SimpleNamespace(major="1", minor="31")
+
+    monkeypatch.setattr(client, "VersionApi", FakeVersionApi)
+    now = [0.0]
+    registry = ApiClientRegistry(config_file=str(kubeconfig), clock=lambda: now[0])
+
+    assert registry.get_version("prod") == "1.31"
+    assert registry.get_version("prod") == "1.31"
+    assert registry.get_version("staging") == "1.31"
+    assert calls == ["https://prod.example:6443", "https://staging.example:6443"]
+
+    now[0] += 7200
+    registry.get_version("prod")
+    assert len(calls) == 3
+    registry.close()
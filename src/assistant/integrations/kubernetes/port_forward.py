@@ -1,98 +1,321 @@
+import asyncio
+import itertools
 import logging
-import threading
-import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Protocol, Self
 
-from kubernetes import client, config
-from kubernetes.stream import portforward
+from .clients import get_api_client_registry
 
 _logger = logging.getLogger(__name__)
 
+POD_REFRESH_INTERVAL_SECONDS = 10
+# Backoff between pod list refreshes while the API keeps failing
+MAX_REFRESH_BACKOFF_SECONDS = 60
+_PIPE_BUFFER_SIZE = 64 * 1024
 
-def run_pf():
-    logging.basicConfig(level=logging.INFO)
-    kfp = KubernetesServicePortForwarder(
-        service_name="kps-prometheus",
-        namespace="observability",
-        context="debug-us-west-2",
-        service_port=9090,
-    )
-    kfp._execute_port_forward()
-    return kfp
 
+@dataclass(frozen=True)
+class PodTarget:
+    name: str
+    namespace: str
+    port: int
 
-class KubernetesServicePortForwarder:
-    def __init__(self, *, service_name, service_port, namespace, context):
-        config.load_kube_config(context=context)
-        self._service_name = service_name
-        self._service_port = service_port
-        self._namespace = namespace
 
-        self._process = None
-        self._thread = None
-        self._local_port = None
-        self._corev1_api = client.CoreV1Api(client.ApiClient())
+class KubernetesPodAPI(Protocol):
+    # The two things the forwarder needs from Kubernetes, a local fake implements them in the tests.
 
-    def _get_pod(self):
-        service = self._corev1_api.read_namespaced_service(name=self._service_name, namespace=self._namespace)
-        selector = service.spec.selector
-        if not selector:
-            _logger.error(f"Service {self._service_name} has no selector. Cannot determine pods.")
-            return None
+    async def get_ready_pods(self, *, namespace: str, service_name: str, service_port: int) -> list[PodTarget]: ...
 
-        label_selector = ",".join([f"{k}={v}" for k, v in selector.items()])
+    async def open_connection(self, target: PodTarget) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]: ...
+
+
+def _is_pod_ready(pod) -> bool:
+    if pod.metadata.deletion_timestamp is not None or pod.status.phase != "Running":
+        return False
+    return any(c.type == "Ready" and c.status == "True" for c in pod.status.conditions or [])
 
-        pod_list = self._corev1_api.list_namespaced_pod(namespace=self._namespace, label_selector=label_selector)
 
-        if not pod_list.items:
-            _logger.error(
-                f"No pods found for service {self._service_name} in namespace {self._namespace} with selector {selector}",
+def _resolve_target_port(service, service_port: int, pod) -> int:
+    spec_port = next((p for p in service.spec.ports or [] if p.port == service_port), None)
+    if spec_port is None or spec_port.target_port is None:
+        return service_port
+    if isinstance(spec_port.target_port, int):
+        return spec_port.target_port
+    # A named target port, look it up in the pod's containers
+    for container in pod.spec.containers:
+        for container_port in container.ports or []:
+            if container_port.name == spec_port.target_port:
+                return container_port.container_port
+    return service_port
+
+
+class KubernetesClientPodAPI:
+    # Backed by the official client, whose calls are blocking, so they run in a thread.
+
+    def __init__(self, *, context: str | None = None) -> None:
+        # Imported here rather than at module level, the kubernetes client is slow to import
+        from kubernetes import client
+
+        self._corev1_api = client.CoreV1Api(get_api_client_registry().get_api_client(context))
+
+    def _get_ready_pods(self, namespace: str, service_name: str, service_port: int) -> list[PodTarget]:
+        service = self._corev1_api.read_namespaced_service(name=service_name, namespace=namespace)
+        selector = service.spec.selector
+        if not selector:
+            _logger.error(f"Service {service_name} has no selector. Cannot determine pods.")
+            return []
+        label_selector = ",".join([f"{k}={v}" for k, v in selector.items()])
+        pod_list = self._corev1_api.list_namespaced_pod(namespace=namespace, label_selector=label_selector)
+        return [
+            PodTarget(
+                name=pod.metadata.name,
+                namespace=namespace,
+                port=_resolve_target_port(service, service_port, pod),
             )
-            return None
+            for pod in pod_list.items
+            if _is_pod_ready(pod)
+        ]
 
-        return pod_list.items[0]
+    async def get_ready_pods(self, *, namespace: str, service_name: str, service_port: int) -> list[PodTarget]:
+        return await asyncio.to_thread(self._get_ready_pods, namespace, service_name, service_port)
 
-    def _execute_port_forward(self):
-        pod = self._get_pod()
-        if not pod:
-            return
+    def _portforward(self, target: PodTarget):
+        from kubernetes.stream import portforward
 
-        pod_name = pod.metadata.name
-        _logger.info(f"Forwarding port to pod: {pod_name}")
-        resp = portforward(
+        return portforward(
             self._corev1_api.connect_get_namespaced_pod_portforward,
-            name=pod_name,
-            namespace=self._namespace,
-            ports=str(self._service_port),
-            async_req=True,
+            name=target.name,
+            namespace=target.namespace,
+            ports=str(target.port),
         )
-        self._process = resp
-        self._local_port = resp.ports[0]["localPort"]
-        _logger.info(f"Port-forwarding established on local port: {self.local_port}")
 
-        while self._process.is_open():
-            time.sleep(1)
+    async def open_connection(self, target: PodTarget) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        forward = await asyncio.to_thread(self._portforward, target)
+        # PortForward hands out one end of a socketpair wrapped in a thin proxy, asyncio needs the socket itself.
+        # Its proxy thread exits once this socket is closed.
+        sock = forward.socket(target.port)._socket
+        return await asyncio.open_connection(sock=sock)
+
+
+@dataclass
+class PortForwardStats:
+    active_connections: int = 0
+    total_connections: int = 0
+    failed_connections: int = 0
+    upstream_errors: int = 0
+    bytes_to_pods: int = 0
+    bytes_from_pods: int = 0
+    pod_refreshes: int = 0
+    pod_set_changes: int = 0
+    connections_per_pod: Counter = field(default_factory=Counter)
+
+    def as_dict(self) -> dict:
+        return {
+            "active_connections": self.active_connections,
+            "total_connections": self.total_connections,
+            "failed_connections": self.failed_connections,
+            "upstream_errors": self.upstream_errors,
+            "bytes_to_pods": self.bytes_to_pods,
+            "bytes_from_pods": self.bytes_from_pods,
+            "pod_refreshes": self.pod_refreshes,
+            "pod_set_changes": self.pod_set_changes,
+            "connections_per_pod": dict(self.connections_per_pod),
+        }
+
+
+class KubernetesServicePortForwarder:
+    # Listens on a local port that stays the same for the forwarder's lifetime. Each local connection is forwarded to
+    # one of the service's ready pods, picked round-robin. The pod list is refreshed in the background, and right away
+    # when a pod can't be reached, so pods that are lost or rolled stop getting connections.
+
+    def __init__(
+        self,
+        *,
+        service_name: str,
+        service_port: int,
+        namespace: str,
+        context: str | None = None,
+        local_port: int = 0,
+        pod_api: KubernetesPodAPI | None = None,
+        refresh_interval: float = POD_REFRESH_INTERVAL_SECONDS,
+    ) -> None:
+        self._service_name = service_name
+        self._service_port = service_port
+        self._namespace = namespace
+        self._requested_local_port = local_port
+        self._pod_api = pod_api or KubernetesClientPodAPI(context=context)
+        self._refresh_interval = refresh_interval
+
+        self._pods: list[PodTarget] = []
+        # Pods that refused a connection since the last refresh
+        self._unreachable: set[PodTarget] = set()
+        self._round_robin = itertools.count()
+        self._refresh_requested = asyncio.Event()
+        self._server: asyncio.Server | None = None
+        self._refresh_task: asyncio.Task | None = None
+        self._connection_tasks: set[asyncio.Task] = set()
+        self.stats = PortForwardStats()
 
-        _logger.info("Port-forwarding process finished.")
+    @property
+    def local_port(self) -> int | None:
+        if self._server is None:
+            return None
+        return self._server.sockets[0].getsockname()[1]
 
-    # ... (start, stop, get_local_port methods remain the same)
+    def get_local_port(self) -> int | None:
+        return self.local_port
 
-    def start(self) -> None:
-        if self._thread is not None and self._thread.is_alive():
+    @property
+    def pods(self) -> list[PodTarget]:
+        return list(self._pods)
+
+    async def start(self) -> None:
+        if self._server is not None:
             _logger.warning("Port-forwarding is already running.")
             return
+        await self.refresh_pods()
+        self._server = await asyncio.start_server(self._handle_client, "127.0.0.1", self._requested_local_port)
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        _logger.info(
+            f"Forwarding localhost:{self.local_port} to {self._namespace}/{self._service_name}:{self._service_port}",
+        )
+
+    async def stop(self) -> None:
+        if self._server is None:
+            _logger.info("Port-forwarding is not running.")
+            return
+        self._server.close()
+        self._refresh_task.cancel()
+        for task in list(self._connection_tasks):
+            task.cancel()
+        await asyncio.gather(self._refresh_task, *self._connection_tasks, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+        self._refresh_task = None
+        _logger.info("Port-forwarding stopped.")
+
+    async def __aenter__(self) -> Self:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_exc) -> None:
+        await self.stop()
 
-        self._thread = threading.Thread(target=self._execute_port_forward)
-        self._thread.daemon = True
-        self._thread.start()
+    async def refresh_pods(self) -> None:
+        pods = await self._pod_api.get_ready_pods(
+            namespace=self._namespace, service_name=self._service_name, service_port=self._service_port
+        )
+        self.stats.pod_refreshes += 1
+        if set(pods) != set(self._pods):
+            self.stats.pod_set_changes += 1
+            _logger.info(f"Ready pods for {self._service_name}: {[p.name for p in pods]}")
+        if not pods:
+            _logger.warning(f"No ready pods found for service {self._service_name} in namespace {self._namespace}")
+        self._pods = pods
+        self._unreachable.clear()
+
+    async def _refresh_loop(self) -> None:
+        backoff = self._refresh_interval
+        while True:
+            try:
+                async with asyncio.timeout(backoff):
+                    await self._refresh_requested.wait()
+            except TimeoutError:
+                pass
+            self._refresh_requested.clear()
+            try:
+                await self.refresh_pods()
+                backoff = self._refresh_interval
+            except Exception:
+                _logger.exception(f"Failed to refresh the pods of {self._service_name}")
+                backoff = min(backoff * 2, MAX_REFRESH_BACKOFF_SECONDS)
+
+    def _candidate_pods(self) -> list[PodTarget]:
+        pods = [p for p in self._pods if p not in self._unreachable]
+        if not pods:
+            return []
+        start = next(self._round_robin) % len(pods)
+        return pods[start:] + pods[:start]
+
+    async def _connect_upstream(self) -> tuple[PodTarget, asyncio.StreamReader, asyncio.StreamWriter] | None:
+        if not self._pods:
+            # Nothing known yet (or the service was empty), look again before giving up on this connection
+            try:
+                await self.refresh_pods()
+            except Exception:
+                _logger.exception(f"Failed to refresh the pods of {self._service_name}")
+                return None
+        for pod in self._candidate_pods():
+            try:
+                reader, writer = await self._pod_api.open_connection(pod)
+            except Exception as err:
+                _logger.warning(f"Failed to connect to pod {pod.name}: {err}")
+                self.stats.upstream_errors += 1
+                self._unreachable.add(pod)
+                self._refresh_requested.set()
+                continue
+            return pod, reader, writer
+        return None
 
-    def stop(self) -> None:
-        if self._process and self._process.is_open():
-            self._process.close()
-            self._process = None
-            self._local_port = None
-            _logger.info("Port-forwarding stopped.")
+    async def _handle_client(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connection_tasks.add(task)
+        self.stats.total_connections += 1
+        self.stats.active_connections += 1
+        try:
+            upstream = await self._connect_upstream()
+            if upstream is None:
+                self.stats.failed_connections += 1
+                _logger.error(f"No reachable pod for service {self._service_name}, dropping the connection")
+                return
+            pod, pod_reader, pod_writer = upstream
+            self.stats.connections_per_pod[pod.name] += 1
+            try:
+                await asyncio.gather(
+                    self._pipe(client_reader, pod_writer, to_pod=True),
+                    self._pipe(pod_reader, client_writer, to_pod=False),
+                )
+            finally:
+                pod_writer.close()
+        finally:
+            self.stats.active_connections -= 1
+            client_writer.close()
+            self._connection_tasks.discard(task)
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, *, to_pod: bool) -> None:
+        try:
+            while data := await reader.read(_PIPE_BUFFER_SIZE):
+                writer.write(data)
+                await writer.drain()
+                if to_pod:
+                    self.stats.bytes_to_pods += len(data)
+                else:
+                    self.stats.bytes_from_pods += len(data)
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError) as err:
+            # A pod going away mid-connection ends it, the client is expected to reconnect
+            _logger.debug(f"Forwarded connection closed: {err}")
+            writer.close()
         else:
-            _logger.info("Port-forwarding is not running.")
+            if not writer.can_write_eof():
+                writer.close()
 
-    def get_local_port(self):
-        return self.local_port
+
+async def _run_pf() -> None:
+    async with KubernetesServicePortForwarder(
+        service_name="kps-prometheus",
+        namespace="observability",
+        context="debug-us-west-2",
+        service_port=9090,
+        local_port=9095,
+    ) as kfp:
+        while True:
+            await asyncio.sleep(30)
+            _logger.info(f"Port-forward stats: {kfp.stats.as_dict()}")
+
+
+def run_pf() -> None:
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_pf())
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from assistant.integrations.kubernetes.port_forward import KubernetesServicePortForwarder, PodTarget
+
+
+class FakePodAPI:
+    # Each "pod" is a local TCP server that answers every request with its name.
+
+    def __init__(self) -> None:
+        self.ready: dict[str, PodTarget] = {}
+        self._servers: dict[str, asyncio.Server] = {}
+
+    async def add_pod(self, name: str) -> None:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            while data := await reader.readline():
+                writer.write(f"{name}:{data.decode()}".encode())
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        self._servers[name] = server
+        self.ready[name] = PodTarget(name=name, namespace="observability", port=server.sockets[0].getsockname()[1])
+
+    async def kill_pod(self, name: str, *, keep_listed: bool = False) -> None:
+        server = self._servers.pop(name)
+        server.close()
+        await server.wait_closed()
+        if not keep_listed:
+            del self.ready[name]
+
+    async def close(self) -> None:
+        for name in list(self._servers):
+            await self.kill_pod(name)
+
+    async def get_ready_pods(self, *, namespace: str, service_name: str, service_port: int) -> list[PodTarget]:
+        return list(self.ready.values())
+
+    async def open_connection(self, target: PodTarget) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        return await asyncio.open_connection("127.0.0.1", target.port)
+
+
+@pytest_asyncio.fixture
+async def pod_api():
+    api = FakePodAPI()
+    yield api
+    await api.close()
+
+
+def _forwarder(pod_api: FakePodAPI, **kwargs) -> KubernetesServicePortForwarder:
+    return KubernetesServicePortForwarder(
+        service_name="kps-prometheus", service_port=9090, namespace="observability", pod_api=pod_api, **kwargs
+    )
+
+
+async def _request(port: int, line: str = "ping") -> str:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{line}\n".encode())
+    await writer.drain()
+    response = await reader.readline()
+    writer.close()
+    await writer.wait_closed()
+    return response.decode().strip()
+
+
+@pytest.mark.asyncio
+async def test_connections_are_spread_across_ready_pods(pod_api) -> None:
+    for name in ("prometheus-0", "prometheus-1", "prometheus-2"):
+        await pod_api.add_pod(name)
+
+    async with _forwarder(pod_api) as forwarder:
+        responses = [await _request(forwarder.get_local_port()) for _ in range(6)]
+
+    assert sorted(responses) == sorted(f"prometheus-{i}:ping" for i in range(3) for _ in range(2))
+    assert forwarder.stats.connections_per_pod == {f"prometheus-{i}": 2 for i in range(3)}
+    assert forwarder.stats.total_connections == 6
+    assert forwarder.stats.active_connections == 0
+    assert forwarder.stats.bytes_to_pods == 6 * len("ping\n")
+
+
+@pytest.mark.asyncio
+async def test_unreachable_pods_are_skipped(pod_api) -> None:
+    await pod_api.add_pod("prometheus-0")
+    await pod_api.add_pod("prometheus-1")
+
+    async with _forwarder(pod_api, refresh_interval=3600) as forwarder:
+        # Still listed as ready, e.g. the pod died between two refreshes
+        await pod_api.kill_pod("prometheus-0", keep_listed=True)
+        responses = {await _request(forwarder.get_local_port()) for _ in range(4)}
+
+    assert responses == {"prometheus-1:ping"}
+    assert forwarder.stats.upstream_errors >= 1
+    assert forwarder.stats.failed_connections == 0
+
+
+@pytest.mark.asyncio
+async def test_rolled_pods_are_picked_up_on_the_same_local_port(pod_api) -> None:
+    await pod_api.add_pod("prometheus-0")
+
+    async with _forwarder(pod_api, refresh_interval=0.05) as forwarder:
+        local_port = forwarder.get_local_port()
+        assert await _request(local_port) == "prometheus-0:ping"
+
+        await pod_api.kill_pod("prometheus-0")
+        await pod_api.add_pod("prometheus-1")
+        await asyncio.sleep(0.2)
+
+        assert await _request(local_port) == "prometheus-1:ping"
+        assert forwarder.get_local_port() == local_port
+
+    assert forwarder.stats.pod_set_changes == 2
+    assert forwarder.get_local_port() is None
+
+
+@pytest.mark.asyncio
+async def test_connection_is_dropped_when_no_pod_is_ready(pod_api) -> None:
+    async with _forwarder(pod_api) as forwarder:
+        reader, writer = await asyncio.open_connection("127.0.0.1", forwarder.get_local_port())
+        assert await reader.read() == b""
+        writer.close()
+
+    assert forwarder.stats.failed_connections == 1
@@ -1,4 +1,18 @@
 # This file makes the src directory a Python package
+from .cache import PROMETHEUS_RESPONSE_CACHE, ResponseCache
+from .catalog import MetricCatalog, MetricInfo
 from .client import PrometheusClient
+from .rules import AlertRule, AlertRulesIndex
+from .singleflight import PROMETHEUS_SINGLE_FLIGHT, SingleFlight
 
-__all__ = ["PrometheusClient"]
+__all__ = [
+    "PROMETHEUS_RESPONSE_CACHE",
+    "PROMETHEUS_SINGLE_FLIGHT",
+    "AlertRule",
+    "AlertRulesIndex",
+    "MetricCatalog",
+    "MetricInfo",
+    "PrometheusClient",
+    "ResponseCache",
+    "SingleFlight",
+]
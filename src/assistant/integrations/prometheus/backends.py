@@ -0,0 +1,149 @@
+import asyncio
+import functools
+import logging
+import os
+import re
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from assistant.integrations.kubernetes.port_forward import KubernetesServicePortForwarder
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND_NAME = "default"
+DEFAULT_BACKEND_URL = "http://localhost:9095"
+# e.g. "prod=http://prometheus.prod:9090,staging=k8s://staging-ctx/observability/kps-prometheus:9090"
+BACKENDS_ENV_VAR = "ASSISTANT_PROMETHEUS_BACKENDS"
+# How often a port forward that failed is tried again, as new sessions start
+FORWARD_RETRY_INTERVAL_SECONDS = 30
+_K8S_TARGET_RE = re.compile(r"k8s://(?P<context>[^/]*)/(?P<namespace>[^/]+)/(?P<service>[^/:]+):(?P<port>\d+)")
+
+
+@dataclass(frozen=True)
+class BackendSpec:
+    name: str
+    # Either a URL, or a Kubernetes service reached through a port forward
+    url: str | None = None
+    context: str | None = None
+    namespace: str | None = None
+    service_name: str | None = None
+    service_port: int | None = None
+
+    @classmethod
+    def parse(cls, name: str, target: str) -> "BackendSpec":
+        if not target.startswith("k8s://"):
+            return cls(name=name, url=target.rstrip("/"))
+        match = _K8S_TARGET_RE.fullmatch(target)
+        if match is None:
+            raise ValueError(
+                f"Invalid Prometheus backend {name}={target}, expected k8s://<context>/<namespace>/<service>:<port>"
+            )
+        return cls(
+            name=name,
+            context=match["context"] or None,
+            namespace=match["namespace"],
+            service_name=match["service"],
+            service_port=int(match["port"]),
+        )
+
+
+def parse_backends(spec: str) -> list[BackendSpec]:
+    backends = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, target = item.partition("=")
+        if not sep or not name or not target:
+            raise ValueError(f"Invalid Prometheus backend {item!r}, expected <name>=<url or k8s target>")
+        backends.append(BackendSpec.parse(name.strip(), target.strip()))
+    if len({b.name for b in backends}) != len(backends):
+        raise ValueError(f"Duplicate Prometheus backend names in {spec!r}")
+    return backends
+
+
+class BackendRegistry:
+    # The Prometheus instances the assistant can query, by name. URLs are usable right away, Kubernetes services once
+    # start() has opened their port forwards. The first backend is the one queries go to when they don't name any.
+    # Backends whose port forward failed stay registered as unavailable, retry_unavailable() tries them again.
+
+    def __init__(
+        self,
+        specs: list[BackendSpec],
+        *,
+        retry_interval: float = FORWARD_RETRY_INTERVAL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._specs = specs
+        self._retry_interval = retry_interval
+        self._clock = clock
+        self._urls: dict[str, str] = {s.name: s.url for s in specs if s.url is not None}
+        self._forwarders: dict[str, KubernetesServicePortForwarder] = {}
+        # name -> why the backend can't be reached, and when its port forward was last tried
+        self._errors: dict[str, str] = {}
+        self._attempted_at: dict[str, float] = {}
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def backends(self) -> dict[str, str]:
+        # name -> base URL, in configuration order
+        return {s.name: self._urls[s.name] for s in self._specs if s.name in self._urls}
+
+    @property
+    def unavailable(self) -> dict[str, str]:
+        # name -> reason, for the backends that can't be queried (yet)
+        return {
+            s.name: self._errors.get(s.name, "Port forward not started")
+            for s in self._specs
+            if s.name not in self._urls
+        }
+
+    async def _start_forwarder(self, spec: BackendSpec) -> None:
+        self._attempted_at[spec.name] = self._clock()
+        try:
+            forwarder = KubernetesServicePortForwarder(
+                service_name=spec.service_name,
+                service_port=spec.service_port,
+                namespace=spec.namespace,
+                context=spec.context,
+            )
+            await forwarder.start()
+        except Exception as err:
+            # One unreachable cluster shouldn't keep the others from being used
+            _logger.exception(f"Failed to port-forward to Prometheus backend {spec.name}, it's unavailable for now")
+            self._errors[spec.name] = f"Port forward failed: {type(err).__name__}: {err}"
+            return
+        self._errors.pop(spec.name, None)
+        self._forwarders[spec.name] = forwarder
+        self._urls[spec.name] = f"http://127.0.0.1:{forwarder.local_port}"
+
+    async def _start_pending(self, *, retry_after: float) -> None:
+        async with self._start_lock:
+            now = self._clock()
+            pending = [
+                s
+                for s in self._specs
+                if s.url is None
+                and s.name not in self._forwarders
+                and now - self._attempted_at.get(s.name, -retry_after) >= retry_after
+            ]
+            await asyncio.gather(*(self._start_forwarder(s) for s in pending))
+
+    async def start(self) -> None:
+        await self._start_pending(retry_after=0)
+
+    async def retry_unavailable(self) -> None:
+        # Lazily, e.g. as a session starts: at most once per retry interval per backend
+        await self._start_pending(retry_after=self._retry_interval)
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(f.stop() for f in self._forwarders.values()))
+        for name in self._forwarders:
+            del self._urls[name]
+        self._forwarders.clear()
+        self._attempted_at.clear()
+
+
+@functools.cache
+def get_backend_registry() -> BackendRegistry:
+    spec = os.environ.get(BACKENDS_ENV_VAR, "")
+    specs = parse_backends(spec) if spec else [BackendSpec(name=DEFAULT_BACKEND_NAME, url=DEFAULT_BACKEND_URL)]
+    return BackendRegistry(specs)
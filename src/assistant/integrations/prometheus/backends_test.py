@@ -0,0 +1,69 @@
+import pytest
+
+from assistant.integrations.prometheus.backends import BackendRegistry, BackendSpec, parse_backends
+
+
+def test_parse_backends() -> None:
+    backends = parse_backends(
+        "prod=http://prometheus.prod:9090/, staging=k8s://staging/observability/kps-prometheus:9090"
+    )
+
+    assert backends == [
+        BackendSpec(name="prod", url="http://prometheus.prod:9090"),
+        BackendSpec(
+            name="staging",
+            context="staging",
+            namespace="observability",
+            service_name="kps-prometheus",
+            service_port=9090,
+        ),
+    ]
+    assert parse_backends("dev=k8s:///observability/prometheus:9090")[0].context is None
+
+
+@pytest.mark.parametrize(
+    "spec",
+    ["http://prometheus:9090", "prod=", "prod=k8s://ctx/prometheus:9090", "a=http://a,a=http://b"],
+)
+def test_parse_backends_rejects_invalid(spec: str) -> None:
+    with pytest.raises(ValueError, match="Prometheus backend"):
+        parse_backends(spec)
+
+
+@pytest.mark.asyncio
+async def test_registry_keeps_failed_backends_as_unavailable_and_retries_them(monkeypatch) -> None:
+    specs = parse_backends("prod=http://prod:9090,staging=k8s://staging/observability/prometheus:9090")
+    now = [0.0]
+    registry = BackendRegistry(specs, retry_interval=30, clock=lambda: now[0])
+    attempts = []
+
+    async def start(self) -> None:
+        attempts.append(now[0])
+        if len(attempts) == 1:
+            raise ConnectionError("no route to cluster")
+
+    async def stop(self) -> None:
+        pass
+
+    forwarder = "assistant.integrations.prometheus.backends.KubernetesServicePortForwarder"
+    monkeypatch.setattr(f"{forwarder}.__init__", lambda self, **_: None)
+    monkeypatch.setattr(f"{forwarder}.start", start)
+    monkeypatch.setattr(f"{forwarder}.stop", stop)
+    monkeypatch.setattr(f"{forwarder}.local_port", 40000)
+
+    assert registry.backends == {"prod": "http://prod:9090"}
+    await registry.start()
+    assert registry.backends == {"prod": "http://prod:9090"}
+    assert registry.unavailable == {"staging": "Port forward failed: ConnectionError: no route to cluster"}
+
+    # Not retried more than once per interval
+    now[0] = 10
+    await registry.retry_unavailable()
+    assert attempts == [0.0]
+
+    now[0] = 30
+    await registry.retry_unavailable()
+    assert attempts == [0.0, 30]
+    assert registry.backends == {"prod": "http://prod:9090", "staging": "http://127.0.0.1:40000"}
+    assert registry.unavailable == {}
+    await registry.stop()
@@ -0,0 +1,73 @@
+import httpx
+import pytest
+
+from assistant.integrations.prometheus.cache import ResponseCache
+from assistant.integrations.prometheus.client import QUERY_STEP_SECONDS, PrometheusClient
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestResponseCache:
+    def test_hit_and_miss_counters(self) -> None:
+        cache = ResponseCache()
+        assert cache.get("a") is None
+        cache.set("a", 1, ttl=10, size=1)
+        assert cache.get("a") == 1
+        assert cache.stats.as_dict() == {"hits": 1, "misses": 1, "expirations": 0, "evictions": 0}
+
+    def test_ttl_expiration(self) -> None:
+        clock = FakeClock()
+        cache = ResponseCache(clock=clock)
+        cache.set("a", 1, ttl=10, size=1)
+        clock.now += 9
+        assert cache.get("a") == 1
+        clock.now += 1
+        assert cache.get("a") is None
+        assert cache.stats.expirations == 1
+        assert len(cache) == 0
+
+    def test_lru_entries_limit(self) -> None:
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", 1, ttl=10, size=1)
+        cache.set("b", 2, ttl=10, size=1)
+        cache.get("a")
+        cache.set("c", 3, ttl=10, size=1)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.stats.evictions == 1
+
+    def test_bytes_limit(self) -> None:
+        cache = ResponseCache(max_bytes=100)
+        cache.set("a", 1, ttl=10, size=60)
+        cache.set("b", 2, ttl=10, size=60)
+        assert cache.get("a") is None
+        assert cache.total_bytes == 60
+        cache.set("huge", 3, ttl=10, size=101)
+        assert cache.get("huge") is None
+        assert cache.get("b") == 2
+
+
+@pytest.mark.asyncio
+async def test_instant_queries_are_aligned_and_cached() -> None:
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+
+    client = PrometheusClient(
+        base_url="http://prometheus", transport=httpx.MockTransport(handler), cache=ResponseCache()
+    )
+    await client.query(query="up", eval_time=QUERY_STEP_SECONDS * 10 + 1)
+    await client.query(query="up", eval_time=QUERY_STEP_SECONDS * 11 - 1)
+    await client.query(query="up", eval_time=QUERY_STEP_SECONDS * 11)
+    await client.aclose()
+
+    assert [float(r.url.params["time"]) for r in requests] == [QUERY_STEP_SECONDS * 10, QUERY_STEP_SECONDS * 11]
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import re
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+_logger = logging.getLogger(__name__)
+
+# New metrics show up when exporters are deployed, a few minutes of staleness only hides brand new ones.
+CATALOG_TTL_SECONDS = 5 * 60
+DEFAULT_SEARCH_LIMIT = 20
+# Below this similarity a name is not worth showing, e.g. a single shared trigram
+_MIN_TRIGRAM_SIMILARITY = 0.3
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _trigrams(text: str) -> set[str]:
+    # Padded so that short terms and the start of a name get trigrams too
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _words(text: str) -> set[str]:
+    return set(_WORD_RE.findall(text.lower()))
+
+
+@dataclass(frozen=True)
+class MetricInfo:
+    name: str
+    type: str = ""
+    help: str = ""
+    unit: str = ""
+
+    @classmethod
+    def from_metadata(cls, name: str, entries: list[dict]) -> "MetricInfo":
+        # Every target reports its own metadata, the first entry is as good as any.
+        entry = entries[0] if entries else {}
+        return cls(name=name, type=entry.get("type", ""), help=entry.get("help", ""), unit=entry.get("unit", ""))
+
+    def as_dict(self) -> dict:
+        return {k: v for k, v in (("name", self.name), ("type", self.type), ("help", self.help)) if v}
+
+
+class MetricCatalog:
+    # Every metric name Prometheus knows about, with its metadata, searchable by name fragments and help text words.
+    # Trigram and word postings are updated for the names that were added or removed since the last refresh rather
+    # than rebuilt. Once loaded, a stale catalog keeps answering while a refresh runs in the background.
+
+    def __init__(self, *, ttl: float = CATALOG_TTL_SECONDS, clock=time.monotonic) -> None:
+        self._ttl = ttl
+        self._clock = clock
+        self._metrics: dict[str, MetricInfo] = {}
+        self._by_trigram: dict[str, set[str]] = {}
+        self._by_word: dict[str, set[str]] = {}
+        self._expires_at: float | None = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+        self.refreshes = 0
+
+    def _index(self, info: MetricInfo) -> None:
+        for trigram in _trigrams(info.name):
+            self._by_trigram.setdefault(trigram, set()).add(info.name)
+        for word in _words(info.name) | _words(info.help):
+            self._by_word.setdefault(word, set()).add(info.name)
+
+    def _unindex(self, info: MetricInfo) -> None:
+        for trigram in _trigrams(info.name):
+            names = self._by_trigram[trigram]
+            names.discard(info.name)
+            if not names:
+                del self._by_trigram[trigram]
+        for word in _words(info.name) | _words(info.help):
+            names = self._by_word[word]
+            names.discard(info.name)
+            if not names:
+                del self._by_word[word]
+
+    def update(self, names: list[str], metadata: dict[str, list[dict]]) -> None:
+        metrics = {name: MetricInfo.from_metadata(name, metadata.get(name, [])) for name in names}
+        changed = [info for name, info in metrics.items() if self._metrics.get(name) != info]
+        removed = [info for name, info in self._metrics.items() if name not in metrics]
+        for info in removed + [self._metrics[info.name] for info in changed if info.name in self._metrics]:
+            self._unindex(info)
+        for info in changed:
+            self._index(info)
+        if changed or removed:
+            _logger.info(f"Metric catalog: {len(changed)} added or changed, {len(removed)} removed")
+        self._metrics = metrics
+        self._expires_at = self._clock() + self._ttl
+        self.refreshes += 1
+
+    async def _refresh(self, fetch: Callable[[], Awaitable[tuple[list[str], dict]]]) -> None:
+        async with self._lock:
+            if self._is_fresh():
+                return
+            self.update(*await fetch())
+
+    async def _refresh_in_background(self, fetch: Callable[[], Awaitable[tuple[list[str], dict]]]) -> None:
+        try:
+            await self._refresh(fetch)
+        except Exception:
+            _logger.warning("Failed to refresh the metric catalog, using the previous one", exc_info=True)
+        finally:
+            self._refresh_task = None
+
+    def _is_fresh(self) -> bool:
+        return self._expires_at is not None and self._clock() < self._expires_at
+
+    async def ensure_fresh(self, fetch: Callable[[], Awaitable[tuple[list[str], dict]]]) -> None:
+        if self._is_fresh():
+            return
+        if self._expires_at is None:
+            # Nothing to answer from yet, the first caller has to wait
+            await self._refresh(fetch)
+        elif self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_in_background(fetch))
+
+    def _score(self, name: str, terms: list[str]) -> float:
+        info = self._metrics[name]
+        name_words = _words(name)
+        help_words = _words(info.help)
+        score = 0.0
+        for term in terms:
+            if term == name:
+                score += 3
+            elif name.startswith(term):
+                score += 2
+            elif term in name_words:
+                score += 1.5
+            elif term in name:
+                score += 1
+            else:
+                term_trigrams = _trigrams(term)
+                similarity = len(term_trigrams & _trigrams(name)) / len(term_trigrams)
+                if similarity >= _MIN_TRIGRAM_SIMILARITY:
+                    score += similarity
+            if term in help_words:
+                score += 0.5
+        return score
+
+    def search(self, query: str, *, limit: int = DEFAULT_SEARCH_LIMIT) -> list[MetricInfo]:
+        # Terms are matched against the name (exact, prefix, word, substring, then trigram similarity for typos) and
+        # the help text words. Names matching more terms rank first, then shorter names.
+        terms = query.lower().replace(",", " ").split()
+        candidates: set[str] = set()
+        for term in terms:
+            for trigram in _trigrams(term):
+                candidates |= self._by_trigram.get(trigram, set())
+            candidates |= self._by_word.get(term, set())
+        scored = [(score, name) for name in candidates if (score := self._score(name, terms)) > 0]
+        scored.sort(key=lambda sn: (-sn[0], len(sn[1]), sn[1]))
+        return [self._metrics[name] for _, name in scored[:limit]]
+
+    def __len__(self) -> int:
+        return len(self._metrics)
+
+
+_catalogs: dict[str, MetricCatalog] = {}
+
+
+def get_metric_catalog(base_url: str) -> MetricCatalog:
+    # Shared by every client of the same Prometheus, i.e. across chat sessions
+    if base_url not in _catalogs:
+        _catalogs[base_url] = MetricCatalog()
+    return _catalogs[base_url]
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+from assistant.integrations.prometheus.catalog import MetricCatalog
+from assistant.integrations.prometheus.client import PrometheusClient
+
+_METADATA = {
+    "http_requests_total": [{"type": "counter", "help": "Total number of HTTP requests", "unit": ""}],
+    "http_request_duration_seconds": [{"type": "histogram", "help": "HTTP request latency", "unit": ""}],
+    "node_cpu_seconds_total": [{"type": "counter", "help": "Seconds the CPUs spent in each mode", "unit": ""}],
+    "aws_applicationelb_httpcode_elb_5_xx_count_sum": [{"type": "gauge", "help": "ELB 5XX responses", "unit": ""}],
+}
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeCatalogAPI:
+    def __init__(self) -> None:
+        self.names = [*_METADATA, "up"]
+        self.requests: list[httpx.Request] = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        await asyncio.sleep(0.01)
+        data = self.names if request.url.path.endswith("/values") else _METADATA
+        return httpx.Response(200, json={"status": "success", "data": data})
+
+
+def _names(results: list) -> list[str]:
+    return [r.name if not isinstance(r, dict) else r["name"] for r in results]
+
+
+def _catalog() -> MetricCatalog:
+    catalog = MetricCatalog()
+    catalog.update([*_METADATA, "up"], _METADATA)
+    return catalog
+
+
+def test_search_ranks_prefix_and_word_matches() -> None:
+    catalog = _catalog()
+
+    results = _names(catalog.search("http request"))
+    assert set(results[:2]) == {"http_requests_total", "http_request_duration_seconds"}
+    assert "node_cpu_seconds_total" not in results
+    assert _names(catalog.search("up")) == ["up"]
+    assert _names(catalog.search("elb 5xx"))[0] == "aws_applicationelb_httpcode_elb_5_xx_count_sum"
+
+
+def test_search_tolerates_typos_and_help_words() -> None:
+    catalog = _catalog()
+
+    assert _names(catalog.search("latency"))[0] == "http_request_duration_seconds"
+    assert _names(catalog.search("node_cpu_secnds"))[0] == "node_cpu_seconds_total"
+    assert catalog.search("zzzz") == []
+
+
+def test_update_adds_and_removes_names() -> None:
+    catalog = _catalog()
+
+    catalog.update(["up", "kube_pod_info"], {"kube_pod_info": [{"type": "gauge", "help": "Pod information"}]})
+
+    assert len(catalog) == 2
+    assert catalog.search("http") == []
+    assert _names(catalog.search("pod")) == ["kube_pod_info"]
+    assert "http" not in catalog._by_word
+
+
+@pytest.mark.asyncio
+async def test_stale_catalog_is_refreshed_in_the_background() -> None:
+    api = FakeCatalogAPI()
+    clock = FakeClock()
+    catalog = MetricCatalog(ttl=60, clock=clock)
+    client = PrometheusClient(base_url="http://prometheus", transport=httpx.MockTransport(api.handler), catalog=catalog)
+
+    results = await asyncio.gather(*(client.search_metrics(query="requests") for _ in range(5)))
+
+    assert all(_names(r)[0] == "http_requests_total" for r in results)
+    assert len(api.requests) == 2
+    assert results[0][0] == {"name": "http_requests_total", "type": "counter", "help": "Total number of HTTP requests"}
+
+    api.names.append("grpc_requests_total")
+    clock.now += 61
+    # Answered from the previous catalog, the new name shows up once the background refresh is done
+    assert "grpc_requests_total" not in _names(await client.search_metrics(query="requests"))
+    await asyncio.sleep(0.05)
+    assert "grpc_requests_total" in _names(await client.search_metrics(query="requests"))
+    assert catalog.refreshes == 2
+    await client.aclose()
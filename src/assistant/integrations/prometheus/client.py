@@ -1,51 +1,162 @@
+import asyncio
+import math
+import re
+import time
+
 import httpx
 
+from .cache import PROMETHEUS_RESPONSE_CACHE, ResponseCache
+from .catalog import DEFAULT_SEARCH_LIMIT, MetricCatalog, get_metric_catalog
+from .rules import AlertRulesIndex, get_rules_index
+from .singleflight import PROMETHEUS_SINGLE_FLIGHT, SingleFlight
+
+# Metadata and label names change when exporters are deployed, not between scrapes.
+METADATA_TTL_SECONDS = 10 * 60
+LABELS_TTL_SECONDS = 5 * 60
+# Instant query evaluation times are aligned to this step (about one scrape interval),
+# so repeated queries within the same step share the same evaluation time and cache entry.
+QUERY_STEP_SECONDS = 15
+# Callers bound whole calls with their own timeouts, these catch a connection or a read that hangs.
+HTTP_TIMEOUT = httpx.Timeout(30, connect=5)
+# Range queries are capped to about this many points per series, the step is picked accordingly.
+MAX_RANGE_POINTS = 250
+# Steps a range query can use, the smallest is about one scrape interval.
+RANGE_STEPS_SECONDS = (15, 30, 60, 120, 300, 600, 900, 1800, 3600, 2 * 3600, 6 * 3600, 12 * 3600, 24 * 3600)
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "y": 365 * 86400}
+_DURATION_RE = re.compile(r"(\d+)(ms|s|m|h|d|w|y)")
+
+
+def align_to_step(timestamp: float, step: float = QUERY_STEP_SECONDS) -> float:
+    return math.floor(timestamp / step) * step
+
+
+def range_bounds(duration: float, step: float, now: float | None = None) -> tuple[float, float]:
+    # (start, end) of a range query over the last `duration`. `end` is aligned like instant query times, so the last
+    # point is at most QUERY_STEP_SECONDS old whatever the step, and `start` is a whole number of steps before it, so
+    # Prometheus evaluates at `end` itself.
+    end = align_to_step(time.time() if now is None else now)
+    return end - math.ceil(duration / step) * step, end
+
+
+def parse_duration(duration: str) -> float:
+    # Prometheus duration syntax, e.g. "90s", "1h30m", "7d"
+    # https://prometheus.io/docs/prometheus/latest/querying/basics/#float-literals-and-time-durations
+    parts = _DURATION_RE.findall(duration)
+    if not parts or "".join(n + unit for n, unit in parts) != duration:
+        raise ValueError(f"Invalid duration {duration!r}, expected e.g. 30m, 6h or 1h30m")
+    return sum(int(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def choose_step(duration: float, max_points: int = MAX_RANGE_POINTS) -> int:
+    return next((step for step in RANGE_STEPS_SECONDS if duration / step <= max_points), RANGE_STEPS_SECONDS[-1])
+
 
 class PrometheusClient:
-    def __init__(self, *, base_url: str) -> None:
-        self._client = httpx.Client(base_url=base_url)
+    def __init__(
+        self,
+        *,
+        base_url: str,
+        transport: httpx.AsyncBaseTransport | None = None,
+        cache: ResponseCache | None = PROMETHEUS_RESPONSE_CACHE,
+        rules_index: AlertRulesIndex | None = None,
+        catalog: MetricCatalog | None = None,
+        single_flight: SingleFlight | None = PROMETHEUS_SINGLE_FLIGHT,
+    ) -> None:
+        self._client = httpx.AsyncClient(base_url=base_url, transport=transport, timeout=HTTP_TIMEOUT)
+        self._cache = cache
+        self._single_flight = single_flight
+        self._rules_index = rules_index if rules_index is not None else get_rules_index(base_url)
+        self._catalog = catalog if catalog is not None else get_metric_catalog(base_url)
 
-    def get_alerts(self) -> list[dict]:
-        # https://prometheus.io/docs/prometheus/latest/querying/api/#alerts
-        response = self._client.get("/api/v1/alerts")
+    async def _get(self, path: str, *, params: dict | None = None, ttl: float | None = None):
+        cache_key = (str(self._client.base_url), path, tuple(sorted((params or {}).items())))
+        if ttl is not None and self._cache is not None:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+        if self._single_flight is None:
+            return await self._fetch(path, params=params, ttl=ttl, cache_key=cache_key)
+        return await self._single_flight.do(
+            cache_key, lambda: self._fetch(path, params=params, ttl=ttl, cache_key=cache_key), path=path
+        )
+
+    async def _fetch(self, path: str, *, params: dict | None, ttl: float | None, cache_key: tuple):
+        response = await self._client.get(path, params=params)
         response.raise_for_status()
-        return response.json()["data"]["alerts"]
+        payload = response.json()
+        if ttl is not None and self._cache is not None:
+            self._cache.set(cache_key, payload, ttl=ttl, size=len(response.content))
+        return payload
 
-    def get_alert_query(self, *, alert: dict) -> list[dict]:
+    async def get_alerts(self) -> list[dict]:
+        # https://prometheus.io/docs/prometheus/latest/querying/api/#alerts
+        payload = await self._get("/api/v1/alerts")
+        return payload["data"]["alerts"]
+
+    async def _get_alerting_rule_groups(self) -> list[dict]:
         # https://prometheus.io/docs/prometheus/latest/querying/api/#rules
-        alertname = alert["labels"]["alertname"]
+        # All alerting rules in one request; exclude_alerts drops the active alerts of each rule (Prometheus >= 2.49,
+        # ignored by older versions).
+        payload = await self._get("/api/v1/rules", params={"type": "alert", "exclude_alerts": "true"})
+        return payload["data"]["groups"]
 
-        response = self._client.get("/api/v1/rules", params={"type": "alert", "rule_name[]": alertname})
-        response.raise_for_status()
-        groups = response.json()["data"]["groups"]
-        if not groups:
+    async def get_alert_queries(self, *, alerts: list[dict]) -> list[str | None]:
+        # The query of the rule behind each alert, in order, None for alerts with no matching rule
+        await self._rules_index.ensure_fresh(self._get_alerting_rule_groups)
+        rules = [self._rules_index.find_rule(alert) for alert in alerts]
+        return [rule.query if rule is not None else None for rule in rules]
+
+    async def get_alert_query(self, *, alert: dict) -> str:
+        (query,) = await self.get_alert_queries(alerts=[alert])
+        if query is None:
             # TODO: App specific error
-            raise ValueError(f"No rules found for alert {alertname}")
-        alert_rule = groups[0]["rules"][0]
-        return alert_rule["query"]
+            raise ValueError(f"No rules found for alert {alert['labels']['alertname']}")
+        return query
 
-    def query(self, *, query: str) -> list[dict]:
-        response = self._client.get("/api/v1/query", params={"query": query})
-        response.raise_for_status()
-        return response.json()
+    async def query(self, *, query: str, eval_time: float | None = None) -> list[dict]:
+        # https://prometheus.io/docs/prometheus/latest/querying/api/#instant-queries
+        eval_time = align_to_step(time.time() if eval_time is None else eval_time)
+        return await self._get("/api/v1/query", params={"query": query, "time": eval_time}, ttl=QUERY_STEP_SECONDS)
+
+    async def query_range(self, *, query: str, start: float, end: float, step: float) -> dict:
+        # https://prometheus.io/docs/prometheus/latest/querying/api/#range-queries
+        # With range_bounds() times, the same range asked again within QUERY_STEP_SECONDS is served from the cache.
+        # Cached no longer than that even for coarse steps, so the last point doesn't go stale.
+        params = {"query": query, "start": start, "end": end, "step": step}
+        return await self._get("/api/v1/query_range", params=params, ttl=min(step, QUERY_STEP_SECONDS))
 
-    def get_metric_labels(self, *, metric_name: str) -> list[str]:
+    async def get_metric_labels(self, *, metric_name: str) -> list[str]:
         # https://prometheus.io/docs/prometheus/latest/querying/api/#getting-label-names
-        response = self._client.get("/api/v1/labels", params={"match[]": metric_name})
-        response.raise_for_status()
-        return response.json()["data"]
+        payload = await self._get("/api/v1/labels", params={"match[]": metric_name}, ttl=LABELS_TTL_SECONDS)
+        return payload["data"]
 
-    def get_metric_label_values(self, *, metric_name: str, label_name: str) -> list[str]:
+    async def get_metric_label_values(self, *, metric_name: str, label_name: str) -> list[str]:
         # https://prometheus.io/docs/prometheus/latest/querying/api/#querying-label-values
-        response = self._client.get(f"/api/v1/label/{label_name}/values", params={"match[]": metric_name})
-        response.raise_for_status()
-        return response.json()["data"]
+        payload = await self._get(
+            f"/api/v1/label/{label_name}/values", params={"match[]": metric_name}, ttl=LABELS_TTL_SECONDS
+        )
+        return payload["data"]
 
-    def get_metric_metadata(self, *, metric_name: str) -> dict:
+    async def get_metric_metadata(self, *, metric_name: str) -> dict:
         # https://prometheus.io/docs/prometheus/latest/querying/api/#querying-metric-metadata
-        response = self._client.get("/api/v1/metadata", params={"metric": metric_name})
-        response.raise_for_status()
-        return response.json()["data"]
+        payload = await self._get("/api/v1/metadata", params={"metric": metric_name}, ttl=METADATA_TTL_SECONDS)
+        return payload["data"]
+
+    async def _get_metric_catalog(self) -> tuple[list[str], dict]:
+        # https://prometheus.io/docs/prometheus/latest/querying/api/#querying-label-values
+        # The catalog decides when to refresh, so these bypass the response cache.
+        names, metadata = await asyncio.gather(
+            self._get("/api/v1/label/__name__/values"), self._get("/api/v1/metadata")
+        )
+        return names["data"], metadata["data"]
+
+    async def search_metrics(self, *, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+        await self._catalog.ensure_fresh(self._get_metric_catalog)
+        return [info.as_dict() for info in self._catalog.search(query, limit=limit)]
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
 
     def __str__(self) -> str:
         return f"Prometheus {self._client.base_url}"
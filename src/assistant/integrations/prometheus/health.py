@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from enum import Enum
+
+import httpx
+
+from .client import PrometheusClient
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CHECK_INTERVAL_SECONDS = 10
+DEFAULT_CHECK_TIMEOUT_SECONDS = 5
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT_SECONDS = 30
+
+
+class PrometheusUnavailableError(Exception):
+    pass
+
+
+def is_unavailability_error(err: Exception) -> bool:
+    if isinstance(err, httpx.HTTPStatusError):
+        return err.response.status_code >= 500
+    return isinstance(err, (httpx.TransportError, TimeoutError))
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        *,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+            self._state = CircuitState.HALF_OPEN
+        return self._state
+
+    def allow_request(self) -> bool:
+        # Half-open lets requests through as probes; the first result decides whether the circuit closes again.
+        return self.state != CircuitState.OPEN
+
+    def record_success(self) -> None:
+        if self._state != CircuitState.CLOSED:
+            _logger.info("Prometheus circuit closed")
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == CircuitState.HALF_OPEN or self._failures >= self._failure_threshold:
+            if self._state != CircuitState.OPEN:
+                _logger.warning(f"Prometheus circuit opened after {self._failures} failures")
+            self._state = CircuitState.OPEN
+            self._opened_at = self._clock()
+
+
+class PrometheusHealthChecker:
+    def __init__(
+        self,
+        *,
+        base_url: str,
+        interval: float = DEFAULT_CHECK_INTERVAL_SECONDS,
+        timeout: float = DEFAULT_CHECK_TIMEOUT_SECONDS,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        # Probes must reach Prometheus, so this client never uses the response cache nor joins other requests.
+        self._client = PrometheusClient(base_url=base_url, transport=transport, cache=None, single_flight=None)
+        self._interval = interval
+        self._timeout = timeout
+        self._task: asyncio.Task | None = None
+        self.breaker = CircuitBreaker()
+        self.last_error: str | None = None
+        self.last_checked_at: float | None = None
+
+    @property
+    def is_healthy(self) -> bool:
+        return self.last_checked_at is not None and self.last_error is None
+
+    async def check_once(self) -> bool:
+        try:
+            # Not wait_for(), which on 3.11 can swallow stop()'s cancellation when the probe completes at the same time
+            async with asyncio.timeout(self._timeout):
+                await self._client.query(query="up")
+        except (httpx.HTTPError, TimeoutError) as err:
+            self.last_error = repr(err)
+            self.breaker.record_failure()
+            _logger.warning(f"Prometheus health check failed: {err!r}")
+        else:
+            self.last_error = None
+            self.breaker.record_success()
+        self.last_checked_at = time.time()
+        return self.last_error is None
+
+    async def _run(self) -> None:
+        while True:
+            await self.check_once()
+            await asyncio.sleep(self._interval)
+
+    def ensure_started(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop yet (e.g. at import time); the first caller running inside the loop starts the checker.
+            return
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def aclose(self) -> None:
+        await self.stop()
+        await self._client.aclose()
+
+
+_health_checkers: dict[str, PrometheusHealthChecker] = {}
+
+
+def get_health_checker(base_url: str) -> PrometheusHealthChecker:
+    if base_url not in _health_checkers:
+        _health_checkers[base_url] = PrometheusHealthChecker(base_url=base_url)
+    return _health_checkers[base_url]
+
+
+async def close_health_checkers() -> None:
+    # Stops every shared checker and closes its client. Later get_health_checker() calls start from fresh ones.
+    checkers = list(_health_checkers.values())
+    _health_checkers.clear()
+    await asyncio.gather(*(checker.aclose() for checker in checkers))
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+_logger = logging.getLogger(__name__)
+
+# Alerting rules change on deploys, a minute of staleness is fine when diagnosing alerts.
+RULES_TTL_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class AlertRule:
+    name: str
+    query: str
+    group: str
+    file: str
+    duration: float = 0
+    labels: tuple[tuple[str, str], ...] = ()
+    annotations: tuple[tuple[str, str], ...] = field(default=(), compare=False)
+
+    @classmethod
+    def from_api(cls, rule: dict, group: dict) -> "AlertRule":
+        return cls(
+            name=rule["name"],
+            query=rule["query"],
+            group=group["name"],
+            file=group.get("file", ""),
+            duration=rule.get("duration", 0),
+            labels=tuple(sorted((rule.get("labels") or {}).items())),
+            annotations=tuple(sorted((rule.get("annotations") or {}).items())),
+        )
+
+    def matches(self, alert_labels: dict) -> bool:
+        # Static rule labels are copied onto every alert the rule fires
+        return all(alert_labels.get(k) == v for k, v in self.labels)
+
+
+class AlertRulesIndex:
+    # alertname -> alerting rules, built from a single /api/v1/rules response. Rules are grouped by (file, group) and
+    # a refresh only rebuilds the name map when a group was added, removed or had its rules changed.
+
+    def __init__(self, *, ttl: float = RULES_TTL_SECONDS, clock=time.monotonic) -> None:
+        self._ttl = ttl
+        self._clock = clock
+        self._groups: dict[tuple[str, str], tuple[AlertRule, ...]] = {}
+        self._by_name: dict[str, list[AlertRule]] = {}
+        self._expires_at: float | None = None
+        self._lock = asyncio.Lock()
+        self.refreshes = 0
+        self.rebuilds = 0
+
+    def _is_fresh(self) -> bool:
+        return self._expires_at is not None and self._clock() < self._expires_at
+
+    def update(self, groups: list[dict]) -> None:
+        new_groups = {
+            (group.get("file", ""), group["name"]): tuple(
+                AlertRule.from_api(rule, group) for rule in group.get("rules", []) if rule.get("type") == "alerting"
+            )
+            for group in groups
+        }
+        self.refreshes += 1
+        self._expires_at = self._clock() + self._ttl
+        if new_groups == self._groups:
+            return
+        changed = {
+            key for key in new_groups.keys() | self._groups.keys() if new_groups.get(key) != self._groups.get(key)
+        }
+        _logger.info(f"Alerting rules changed in {len(changed)} groups, rebuilding the index")
+        self._groups = new_groups
+        by_name: dict[str, list[AlertRule]] = {}
+        for rules in new_groups.values():
+            for rule in rules:
+                by_name.setdefault(rule.name, []).append(rule)
+        self._by_name = by_name
+        self.rebuilds += 1
+
+    async def ensure_fresh(self, fetch_groups: Callable[[], Awaitable[list[dict]]]) -> None:
+        if self._is_fresh():
+            return
+        # Concurrent callers wait for the same fetch instead of sending their own
+        async with self._lock:
+            if self._is_fresh():
+                return
+            try:
+                self.update(await fetch_groups())
+            except Exception:
+                if self._expires_at is None:
+                    raise
+                # Keep serving the last known rules, and retry on the next lookup
+                _logger.warning("Failed to refresh alerting rules, using the previous ones", exc_info=True)
+
+    def get_rules(self, alertname: str) -> list[AlertRule]:
+        return list(self._by_name.get(alertname, ()))
+
+    def find_rule(self, alert: dict) -> AlertRule | None:
+        labels = alert.get("labels", {})
+        candidates = self._by_name.get(labels.get("alertname"), [])
+        if len(candidates) > 1:
+            # The same alertname in several groups, e.g. one per environment or severity: the rule's labels tell
+            # which one fired this alert. The most specific match wins.
+            matching = [r for r in candidates if r.matches(labels)]
+            if matching:
+                return max(matching, key=lambda r: len(r.labels))
+        return candidates[0] if candidates else None
+
+    def __len__(self) -> int:
+        return sum(len(rules) for rules in self._groups.values())
+
+
+_indexes: dict[str, AlertRulesIndex] = {}
+
+
+def get_rules_index(base_url: str) -> AlertRulesIndex:
+    # Shared by every client of the same Prometheus, i.e. across chat sessions
+    if base_url not in _indexes:
+        _indexes[base_url] = AlertRulesIndex()
+    return _indexes[base_url]
@@ -0,0 +1,144 @@
+import asyncio
+
+import httpx
+import pytest
+
+from assistant.integrations.prometheus.client import PrometheusClient
+from assistant.integrations.prometheus.rules import AlertRulesIndex
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _rule(name: str, query: str, **labels) -> dict:
+    return {"type": "alerting", "name": name, "query": query, "duration": 300, "labels": labels}
+
+
+def _groups(*, api_errors_query: str = "rate(api_errors_total[5m]) > 1") -> list[dict]:
+    return [
+        {
+            "name": "api",
+            "file": "api.yaml",
+            "rules": [
+                _rule("HighErrorRate", api_errors_query, team="api"),
+                {"type": "recording", "name": "job:requests:rate5m", "query": "sum by (job) (rate(requests[5m]))"},
+            ],
+        },
+        {
+            "name": "web",
+            "file": "web.yaml",
+            "rules": [
+                _rule("HighErrorRate", "rate(web_errors_total[5m]) > 1", team="web"),
+                _rule("HighErrorRate", "rate(web_errors_total[5m]) > 10", team="web", severity="critical"),
+            ],
+        },
+        {"name": "node", "file": "node.yaml", "rules": [_rule("NodeDown", "up{job='node'} == 0")]},
+    ]
+
+
+class FakeRulesAPI:
+    def __init__(self) -> None:
+        self.groups = _groups()
+        self.requests: list[httpx.Request] = []
+        self.fail = False
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        await asyncio.sleep(0.01)
+        if self.fail:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"status": "success", "data": {"groups": self.groups}})
+
+
+def _alert(alertname: str, **labels) -> dict:
+    return {"labels": {"alertname": alertname, **labels}, "state": "firing"}
+
+
+@pytest.fixture
+def rules_api() -> FakeRulesAPI:
+    return FakeRulesAPI()
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def client(rules_api, clock) -> PrometheusClient:
+    return PrometheusClient(
+        base_url="http://localhost",
+        transport=httpx.MockTransport(rules_api.handler),
+        cache=None,
+        rules_index=AlertRulesIndex(ttl=60, clock=clock),
+    )
+
+
+@pytest.mark.asyncio
+async def test_alert_storm_needs_a_single_rules_request(client, rules_api) -> None:
+    alerts = [_alert("NodeDown", instance=f"10.0.0.{i}") for i in range(200)]
+    alerts += [
+        _alert("HighErrorRate", team="api", instance="a"),
+        _alert("HighErrorRate", team="web", instance="b"),
+        _alert("HighErrorRate", team="web", severity="critical", instance="c"),
+        _alert("Unknown"),
+    ]
+
+    queries = await client.get_alert_queries(alerts=alerts)
+
+    assert len(rules_api.requests) == 1
+    assert rules_api.requests[0].url.params["type"] == "alert"
+    assert queries[:200] == ["up{job='node'} == 0"] * 200
+    assert queries[200:] == [
+        "rate(api_errors_total[5m]) > 1",
+        "rate(web_errors_total[5m]) > 1",
+        "rate(web_errors_total[5m]) > 10",
+        None,
+    ]
+    assert await client.get_alert_query(alert=alerts[0]) == "up{job='node'} == 0"
+    with pytest.raises(ValueError, match="No rules found for alert Unknown"):
+        await client.get_alert_query(alert=_alert("Unknown"))
+    assert len(rules_api.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_share_one_fetch(client, rules_api) -> None:
+    results = await asyncio.gather(*(client.get_alert_query(alert=_alert("NodeDown")) for _ in range(20)))
+
+    assert set(results) == {"up{job='node'} == 0"}
+    assert len(rules_api.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_rebuilds_only_when_rules_change(client, rules_api, clock) -> None:
+    index = client._rules_index
+    await client.get_alert_queries(alerts=[_alert("NodeDown")])
+
+    clock.now += 61
+    await client.get_alert_queries(alerts=[_alert("NodeDown")])
+    assert (index.refreshes, index.rebuilds) == (2, 1)
+
+    rules_api.groups = _groups(api_errors_query="rate(api_errors_total[5m]) > 5")
+    clock.now += 61
+    (query,) = await client.get_alert_queries(alerts=[_alert("HighErrorRate", team="api")])
+    assert query == "rate(api_errors_total[5m]) > 5"
+    assert (index.refreshes, index.rebuilds) == (3, 2)
+    assert len(index) == 4
+
+
+@pytest.mark.asyncio
+async def test_previous_rules_are_served_when_a_refresh_fails(client, rules_api, clock) -> None:
+    rules_api.fail = True
+    with pytest.raises(httpx.HTTPStatusError):
+        await client.get_alert_queries(alerts=[_alert("NodeDown")])
+
+    rules_api.fail = False
+    await client.get_alert_queries(alerts=[_alert("NodeDown")])
+    rules_api.fail = True
+    clock.now += 61
+    assert await client.get_alert_queries(alerts=[_alert("NodeDown")]) == ["up{job='node'} == 0"]
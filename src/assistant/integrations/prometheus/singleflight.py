@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import Any
+
+from assistant.telemetry import metrics
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SingleFlightStats:
+    requests: int = 0
+    merged: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {"requests": self.requests, "merged": self.merged}
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one in-flight request and its result (or error). The request runs in
+    # its own task, so a caller being cancelled doesn't cancel it for the others.
+
+    def __init__(self) -> None:
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.stats = SingleFlightStats()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieved here so an error nobody is waiting for anymore isn't logged as "never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], *, path: str = "") -> Any:
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.stats.merged += 1
+            metrics.PROMETHEUS_MERGED_REQUESTS.labels(path).inc()
+            _logger.debug(f"Joining the in-flight request for {key}")
+        else:
+            self.stats.requests += 1
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+
+# Shared by every PrometheusClient in the process, like the response cache: sessions asking the same thing at the same
+# time, e.g. about the alerts of an incident, send a single request.
+PROMETHEUS_SINGLE_FLIGHT = SingleFlight()
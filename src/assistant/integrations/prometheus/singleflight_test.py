@@ -0,0 +1,84 @@
+import asyncio
+
+import httpx
+import pytest
+
+from assistant.integrations.prometheus.client import PrometheusClient
+from assistant.integrations.prometheus.singleflight import SingleFlight
+
+
+class SlowPrometheus:
+    def __init__(self, *, status_code: int = 200) -> None:
+        self.status_code = status_code
+        self.requests: list[httpx.Request] = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(self.status_code, json={"status": "success", "data": [request.url.params["match[]"]]})
+
+
+def _clients(prometheus: SlowPrometheus, single_flight: SingleFlight, count: int) -> list[PrometheusClient]:
+    # Separate clients, as separate sessions would have, sharing one SingleFlight. No cache, so only coalescing helps.
+    return [
+        PrometheusClient(
+            base_url="http://prometheus",
+            transport=httpx.MockTransport(prometheus.handler),
+            cache=None,
+            single_flight=single_flight,
+        )
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_requests_are_merged() -> None:
+    prometheus = SlowPrometheus()
+    single_flight = SingleFlight()
+    clients = _clients(prometheus, single_flight, 10)
+
+    results = await asyncio.gather(*(c.get_metric_labels(metric_name="up") for c in clients))
+    others = await asyncio.gather(*(c.get_metric_labels(metric_name=f"m{i}") for i, c in enumerate(clients[:3])))
+
+    assert results == [["up"]] * 10
+    assert others == [["m0"], ["m1"], ["m2"]]
+    assert len(prometheus.requests) == 4
+    assert single_flight.stats.as_dict() == {"requests": 4, "merged": 9}
+    assert len(single_flight) == 0
+    for client in clients:
+        await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_and_not_remembered() -> None:
+    prometheus = SlowPrometheus(status_code=503)
+    single_flight = SingleFlight()
+    clients = _clients(prometheus, single_flight, 3)
+
+    results = await asyncio.gather(*(c.get_metric_labels(metric_name="up") for c in clients), return_exceptions=True)
+
+    assert all(isinstance(r, httpx.HTTPStatusError) for r in results)
+    prometheus.status_code = 200
+    assert await clients[0].get_metric_labels(metric_name="up") == ["up"]
+    assert len(prometheus.requests) == 2
+    for client in clients:
+        await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_others() -> None:
+    prometheus = SlowPrometheus()
+    single_flight = SingleFlight()
+    first, second = _clients(prometheus, single_flight, 2)
+
+    leader = asyncio.create_task(first.get_metric_labels(metric_name="up"))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(second.get_metric_labels(metric_name="up"))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    assert await follower == ["up"]
+    assert leader.cancelled()
+    assert len(prometheus.requests) == 1
+    await first.aclose()
+    await second.aclose()
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI
+
+_logger = logging.getLogger(__name__)
+
+
+def create_fake_prometheus_app(*, latency: float, series_count: int, metric_names: list[str]) -> FastAPI:
+    # Serves the subset of the Prometheus HTTP API that PrometheusClient uses, with canned data.
+    app = FastAPI()
+
+    def _series(metric_name: str) -> list[dict]:
+        return [
+            {
+                "metric": {"__name__": metric_name, "job": f"job-{i % 10}", "instance": f"10.0.{i // 250}.{i % 250}"},
+                "value": [time.time(), str(random.random() * 100)],
+            }
+            for i in range(series_count)
+        ]
+
+    @app.get("/api/v1/query")
+    async def query(query: str):
+        await asyncio.sleep(latency)
+        metric_name = next((m for m in metric_names if m in query), "up")
+        return {"status": "success", "data": {"resultType": "vector", "result": _series(metric_name)}}
+
+    @app.get("/api/v1/labels")
+    async def labels():
+        await asyncio.sleep(latency)
+        return {"status": "success", "data": ["__name__", "instance", "job"]}
+
+    @app.get("/api/v1/label/{label_name}/values")
+    async def label_values(label_name: str):
+        await asyncio.sleep(latency)
+        if label_name == "__name__":
+            return {"status": "success", "data": metric_names}
+        return {"status": "success", "data": [f"{label_name}-{i}" for i in range(min(series_count, 50))]}
+
+    @app.get("/api/v1/metadata")
+    async def metadata(metric: str | None = None):
+        await asyncio.sleep(latency)
+        names = [metric] if metric else metric_names
+        return {
+            "status": "success",
+            "data": {name: [{"type": "counter", "help": f"Total number of {name}", "unit": ""}] for name in names},
+        }
+
+    return app
+
+
+class FakePrometheusServer:
+    # Runs in its own thread and event loop, so it doesn't compete with the sessions under test for the loop.
+    def __init__(self, *, latency: float, series_count: int, metric_names: list[str], port: int = 0) -> None:
+        app = create_fake_prometheus_app(latency=latency, series_count=series_count, metric_names=metric_names)
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.servers[0].sockets[0].getsockname()[1]
+
+    def start(self) -> None:
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        _logger.info(f"Fake Prometheus listening on port {self.port}")
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join()
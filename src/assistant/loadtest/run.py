@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from assistant.integrations.prometheus.health import get_health_checker
+from assistant.logic.fake_llm import ScriptedCompletion
+from assistant.logic.history import SQLiteHistoryStore
+from assistant.logic.lazy_imports import get_litellm
+from assistant.logic.llm import CURRENT_MODEL, LLMSession
+from assistant.logic.tools import PrometheusFunctions
+
+from .fake_prometheus import FakePrometheusServer
+
+# Drives N concurrent LLMSessions through the real tool loop against a scripted LLM and a stand-in Prometheus.
+# Run with: PYTHONPATH=src python -m assistant.loadtest.run --sessions 50
+
+_logger = logging.getLogger(__name__)
+
+LOOP_LAG_PROBE_INTERVAL = 0.05
+_METRIC_NAMES = [
+    "aws_applicationelb_httpcode_target_4_xx_count_sum",
+    "aws_applicationelb_request_count_sum",
+    "http_requests_total",
+    "node_cpu_seconds_total",
+]
+
+
+@dataclass
+class LoadTestStats:
+    time_to_first_token: list[float] = field(default_factory=list)
+    message_duration: list[float] = field(default_factory=list)
+    tool_round: list[float] = field(default_factory=list)
+    loop_lag: list[float] = field(default_factory=list)
+    errors: int = 0
+
+
+class _SessionDriver:
+    def __init__(self, stats: LoadTestStats) -> None:
+        self._stats = stats
+        self._message_started_at: float | None = None
+
+    def _record_first_token(self) -> None:
+        if self._message_started_at is not None:
+            self._stats.time_to_first_token.append(time.perf_counter() - self._message_started_at)
+            self._message_started_at = None
+
+    async def on_message(self, stream) -> None:
+        async for _ in stream:
+            self._record_first_token()
+
+    async def on_tag_start(self, _tag_name: str, stream) -> None:
+        async for _ in stream:
+            self._record_first_token()
+
+    async def send(self, session: LLMSession, message: str) -> None:
+        self._message_started_at = start = time.perf_counter()
+        try:
+            await session.process_message(incoming_message=message)
+        except Exception:
+            _logger.exception("Session failed to process a message")
+            self._stats.errors += 1
+        self._stats.message_duration.append(time.perf_counter() - start)
+
+
+class _TimedPrometheusFunctions(PrometheusFunctions):
+    def __init__(self, *, stats: LoadTestStats, port: int, response_cache: bool) -> None:
+        if response_cache:
+            super().__init__(port)
+        else:
+            super().__init__(port, cache=None, single_flight=None)
+        self._stats = stats
+
+    async def call_prometheus_functions(self, function_calls: list[dict], *, deadline: float | None = None) -> str:
+        start = time.perf_counter()
+        try:
+            return await super().call_prometheus_functions(function_calls, deadline=deadline)
+        finally:
+            self._stats.tool_round.append(time.perf_counter() - start)
+
+
+async def _monitor_loop_lag(stats: LoadTestStats) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_PROBE_INTERVAL)
+        stats.loop_lag.append(time.perf_counter() - start - LOOP_LAG_PROBE_INTERVAL)
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _percentiles_ms(values: list[float]) -> str:
+    if len(values) < 2:
+        return "n/a"
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return f"p50={q[49] * 1000:8.1f}  p95={q[94] * 1000:8.1f}  p99={q[98] * 1000:8.1f}  max={max(values) * 1000:8.1f}"
+
+
+async def run_load_test(args: argparse.Namespace, prometheus_port: int, history_dir: Path) -> None:
+    stats = LoadTestStats()
+    completion = ScriptedCompletion(
+        metric_names=_METRIC_NAMES,
+        tool_rounds=args.tool_rounds,
+        time_to_first_token=args.ttft_ms / 1000,
+        tokens_per_sec=args.tokens_per_sec,
+        vary_queries=True,
+    )
+    history_store = SQLiteHistoryStore(history_dir / "history.sqlite3")
+    # litellm and its tokenizer load on first use in the tool loop, that shouldn't be measured as loop lag
+    get_litellm().token_counter(model=CURRENT_MODEL, text="warm up")
+    monitor = asyncio.create_task(_monitor_loop_lag(stats))
+
+    rss_before = _rss_bytes()
+    sessions = []
+    for _ in range(args.sessions):
+        driver = _SessionDriver(stats)
+        session = LLMSession(
+            session_id=str(uuid.uuid4()),
+            start_from_recent=False,
+            on_message_start_cb=driver.on_message,
+            on_tag_start_cb=driver.on_tag_start,
+            history_store=history_store,
+            prometheus=_TimedPrometheusFunctions(
+                stats=stats, port=prometheus_port, response_cache=not args.no_response_cache
+            ),
+            completion_fn=completion,
+        )
+        sessions.append((driver, session))
+    rss_after_create = _rss_bytes()
+
+    async def drive(n: int, driver: _SessionDriver, session: LLMSession) -> None:
+        # Messages differ between sessions, so do the scripted queries
+        for i in range(args.messages):
+            metric_name = _METRIC_NAMES[i % len(_METRIC_NAMES)]
+            await driver.send(session, f"session {n} message {i}: define an alert for {metric_name}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(drive(n, driver, session) for n, (driver, session) in enumerate(sessions)))
+    elapsed = time.perf_counter() - start
+    rss_after_run = _rss_bytes()
+
+    monitor.cancel()
+    for _, session in sessions:
+        await session.close()
+    await get_health_checker(f"http://localhost:{prometheus_port}").stop()
+    history_store.close()
+
+    total_messages = args.sessions * args.messages
+    print(  # noqa: T201
+        f"sessions={args.sessions} messages/session={args.messages} tool rounds/message={args.tool_rounds} "
+        f"response cache={'off' if args.no_response_cache else 'on'}"
+    )
+    print(f"wall time               {elapsed:8.2f}s  ({total_messages / elapsed:.1f} messages/s)")  # noqa: T201
+    print(f"errors                  {stats.errors}")  # noqa: T201
+    print(f"time to first token ms  {_percentiles_ms(stats.time_to_first_token)}")  # noqa: T201
+    print(f"message duration ms     {_percentiles_ms(stats.message_duration)}")  # noqa: T201
+    print(f"tool round ms           {_percentiles_ms(stats.tool_round)}")  # noqa: T201
+    print(f"event loop lag ms       {_percentiles_ms(stats.loop_lag)}")  # noqa: T201
+    print(  # noqa: T201
+        f"memory per session      {(rss_after_create - rss_before) / args.sessions / 1024:8.1f} KiB at creation, "
+        f"{(rss_after_run - rss_before) / args.sessions / 1024:8.1f} KiB after the run",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for LLMSession")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=2, help="messages per session")
+    parser.add_argument("--tool-rounds", type=int, default=2, help="<function_calls> rounds per message")
+    parser.add_argument("--ttft-ms", type=float, default=500, help="scripted LLM time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=60, help="scripted LLM streaming rate")
+    parser.add_argument("--prometheus-latency-ms", type=float, default=50)
+    parser.add_argument("--series", type=int, default=200, help="series returned by each stand-in query")
+    parser.add_argument(
+        "--no-response-cache",
+        action="store_true",
+        help="send every Prometheus request, without the shared response cache or in-flight request sharing",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    prometheus = FakePrometheusServer(
+        latency=args.prometheus_latency_ms / 1000, series_count=args.series, metric_names=_METRIC_NAMES
+    )
+    prometheus.start()
+    try:
+        with tempfile.TemporaryDirectory() as history_dir:
+            asyncio.run(run_load_test(args, prometheus.port, Path(history_dir)))
+    finally:
+        prometheus.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+
+from .range_summary import COMPARISONS, decode_series, format_time
+
+# Firing intervals listed per threshold, the most recent first. The counts and totals cover all of them.
+MAX_REPORTED_INTERVALS = 10
+
+
+def to_grid(result: list[dict], *, start: float, step: float, points: int) -> np.ndarray:
+    # series x evaluation times, NaN where a series has no sample. Prometheus evaluates range queries at
+    # start + i * step, a missing sample means the expression returned nothing for that series at that time.
+    grid = np.full((len(result), points), np.nan)
+    for row, series in enumerate(result):
+        timestamps, samples = decode_series(series.get("values", []))
+        idx = np.rint((timestamps - start) / step).astype(np.int64)
+        keep = (idx >= 0) & (idx < points)
+        grid[row, idx[keep]] = samples[keep]
+    return grid
+
+
+def backtest(
+    result: list[dict],
+    *,
+    start: float,
+    step: float,
+    points: int,
+    for_seconds: float,
+    thresholds: list[float] | None = None,
+    comparison: str = ">",
+) -> list[dict]:
+    # Replays an alerting rule over the range query of its expression, like the rule manager evaluating it every
+    # `step`: a series is pending from the first evaluation its condition holds, and firing once it held for
+    # `for_seconds`. Without thresholds the expression is the whole condition (e.g. `rate(x[5m]) > 1`), so any
+    # sample counts as true. All thresholds are evaluated at once on a thresholds x series x times array.
+    grid = to_grid(result, start=start, step=step, points=points)
+    finite = np.isfinite(grid)
+    if thresholds is None:
+        conditions = finite[np.newaxis]
+    else:
+        values = np.asarray(thresholds, dtype=np.float64)[:, np.newaxis, np.newaxis]
+        conditions = COMPARISONS[comparison](grid[np.newaxis], values) & finite[np.newaxis]
+
+    # Runs of consecutive true evaluations, as (threshold, series, first index) and (..., index after the last)
+    edges = np.diff(np.pad(conditions.view(np.int8), ((0, 0), (0, 0), (1, 1))), axis=-1)
+    run_starts = np.argwhere(edges == 1)
+    run_ends = np.argwhere(edges == -1)[:, 2]
+    pending_evaluations = math.ceil(for_seconds / step)
+    fire_starts = run_starts[:, 2] + pending_evaluations
+    fired = fire_starts < run_ends
+    firing_seconds = np.where(fired, (run_ends - fire_starts) * step, 0)
+
+    reports = []
+    for i in range(conditions.shape[0]):
+        runs = np.flatnonzero(run_starts[:, 0] == i)
+        fired_runs = runs[fired[runs]]
+        report = {} if thresholds is None else {"threshold": thresholds[i]}
+        report |= {
+            "would_have_fired": bool(len(fired_runs)),
+            "times_fired": len(fired_runs),
+            "times_pending_without_firing": int(len(runs) - len(fired_runs)),
+            "series_fired": len(np.unique(run_starts[fired_runs, 1])),
+            "total_firing_seconds": float(firing_seconds[fired_runs].sum()),
+            "firing_now": bool(np.any(run_ends[fired_runs] == points)),
+        }
+        recent = fired_runs[np.argsort(fire_starts[fired_runs], kind="stable")[::-1][:MAX_REPORTED_INTERVALS]]
+        report["firing_intervals"] = [
+            {
+                "series": result[run_starts[run, 1]].get("metric", {}),
+                "pending_from": format_time(start + run_starts[run, 2] * step),
+                "firing_from": format_time(start + fire_starts[run] * step),
+                "until": "now" if run_ends[run] == points else format_time(start + run_ends[run] * step),
+            }
+            for run in recent
+        ]
+        reports.append(report)
+    return reports
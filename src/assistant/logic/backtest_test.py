@@ -0,0 +1,69 @@
+import numpy as np
+
+from assistant.logic.backtest import backtest, to_grid
+
+_START = 1700000000
+_STEP = 60
+
+
+def _series(values: list[float | None], **labels) -> dict:
+    # None leaves the sample out, like an expression returning nothing at that time
+    samples = [[_START + i * _STEP, str(v)] for i, v in enumerate(values) if v is not None]
+    return {"metric": labels, "values": samples}
+
+
+def test_grid_marks_missing_samples() -> None:
+    grid = to_grid([_series([1, None, 3])], start=_START, step=_STEP, points=4)
+    np.testing.assert_array_equal(np.isnan(grid), [[False, True, False, True]])
+
+
+def test_for_duration_delays_firing() -> None:
+    result = [_series([0, 5, 5, 5, 0, 5, 5, 0, 5, 5, 5, 5], pod="api-0")]
+
+    [report] = backtest(result, start=_START, step=_STEP, points=12, for_seconds=120, thresholds=[1])
+
+    assert report["threshold"] == 1
+    assert report["would_have_fired"]
+    # Runs of 3, 2 and 4 evaluations: pending for the first 2 of each
+    assert report["times_fired"] == 2
+    assert report["times_pending_without_firing"] == 1
+    assert report["total_firing_seconds"] == 3 * _STEP
+    assert report["firing_now"]
+    assert report["firing_intervals"] == [
+        {
+            "series": {"pod": "api-0"},
+            "pending_from": "2023-11-14T22:21:20Z",
+            "firing_from": "2023-11-14T22:23:20Z",
+            "until": "now",
+        },
+        {
+            "series": {"pod": "api-0"},
+            "pending_from": "2023-11-14T22:14:20Z",
+            "firing_from": "2023-11-14T22:16:20Z",
+            "until": "2023-11-14T22:17:20Z",
+        },
+    ]
+
+
+def test_several_thresholds_and_series() -> None:
+    result = [_series([1, 2, 3, 4], pod="a"), _series([10, 10, None, 10], pod="b")]
+
+    low, high, never = backtest(result, start=_START, step=_STEP, points=4, for_seconds=0, thresholds=[2, 5, 50])
+
+    assert (low["times_fired"], low["series_fired"]) == (3, 2)
+    assert (high["times_fired"], high["series_fired"]) == (2, 1)
+    # The missing sample breaks the run, so b resolves and fires again
+    assert [i["until"] for i in high["firing_intervals"]] == ["now", "2023-11-14T22:15:20Z"]
+    assert not never["would_have_fired"]
+    assert never["firing_intervals"] == []
+
+
+def test_without_thresholds_any_sample_is_true() -> None:
+    result = [_series([None, 1, 1, 1, None])]
+
+    [report] = backtest(result, start=_START, step=_STEP, points=5, for_seconds=60)
+
+    assert "threshold" not in report
+    assert report["times_fired"] == 1
+    assert report["total_firing_seconds"] == 2 * _STEP
+    assert not report["firing_now"]
@@ -0,0 +1,144 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+_logger = logging.getLogger(__name__)
+
+# Opt-in: completions are cached on disk only when a directory is configured.
+CACHE_DIR_ENV_VAR = "ASSISTANT_COMPLETION_CACHE_DIR"
+# Skip cache reads, every completion goes to the model and refreshes its cache entry.
+BYPASS_ENV_VAR = "ASSISTANT_COMPLETION_CACHE_BYPASS"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def completion_cache_key(*, model: str, temperature: float, max_tokens: int, messages: list[dict]) -> str:
+    # Everything that decides the completion, serialized canonically so equal requests hash the same
+    payload = json.dumps(
+        {"model": model, "temperature": temperature, "max_tokens": max_tokens, "messages": messages},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class CompletionCacheStats:
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions}
+
+
+class CompletionCache:
+    # Streamed completions stored as their token lists, one JSON file per key, so a cached completion is replayed
+    # token by token like a live one. Evicts the least recently used files once they take more than `max_bytes`,
+    # recency is the file mtime which is bumped on every hit.
+
+    def __init__(self, directory: Path, *, max_bytes: int = DEFAULT_MAX_BYTES, clock=time.time) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (size, last used), loaded from the directory so the limit holds across restarts
+        self._entries: dict[str, tuple[int, float]] = {}
+        for path in directory.glob("*/*.json"):
+            stat = path.stat()
+            self._entries[path.stem] = (stat.st_size, stat.st_mtime)
+        self._total_bytes = sum(size for size, _ in self._entries.values())
+        self.stats = CompletionCacheStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _path(self, key: str) -> Path:
+        return self._directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> list[str] | None:
+        path = self._path(key)
+        try:
+            tokens = json.loads(path.read_text())["tokens"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            # Missing, or written half way by a process that died
+            self.stats.misses += 1
+            return None
+        now = self._clock()
+        try:
+            os.utime(path, (now, now))
+            size = path.stat().st_size
+        except FileNotFoundError:
+            # Evicted by another process sharing the directory while it was read
+            with self._lock:
+                forgotten = self._entries.pop(key, None)
+                if forgotten is not None:
+                    self._total_bytes -= forgotten[0]
+            self.stats.misses += 1
+            return None
+        with self._lock:
+            if key not in self._entries:
+                # Written by another process sharing the directory
+                self._entries[key] = (size, now)
+                self._total_bytes += size
+            self._entries[key] = (self._entries[key][0], now)
+        self.stats.hits += 1
+        return tokens
+
+    def put(self, key: str, tokens: list[str], *, model: str) -> None:
+        content = json.dumps({"model": model, "created_at": self._clock(), "tokens": tokens}, ensure_ascii=False)
+        size = len(content.encode())
+        if size > self._max_bytes:
+            _logger.debug(f"Not caching completion {key}: {size} bytes is over the cache limit")
+            return
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Written aside then renamed, readers never see a partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(content)
+        tmp_path.replace(path)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[0]
+            self._entries[key] = (size, self._clock())
+            self._total_bytes += size
+            self.stats.writes += 1
+            self._evict()
+
+    def _evict(self) -> None:
+        # Must be called with the lock held
+        if self._total_bytes <= self._max_bytes:
+            return
+        for key, (size, _) in sorted(self._entries.items(), key=lambda entry: entry[1][1]):
+            if self._total_bytes <= self._max_bytes:
+                break
+            self._path(key).unlink(missing_ok=True)
+            del self._entries[key]
+            self._total_bytes -= size
+            self.stats.evictions += 1
+
+
+@functools.cache
+def get_default_completion_cache() -> CompletionCache | None:
+    directory = os.environ.get(CACHE_DIR_ENV_VAR)
+    if not directory:
+        return None
+    _logger.info(f"Caching LLM completions in {directory}")
+    return CompletionCache(Path(directory))
+
+
+def is_completion_cache_bypassed() -> bool:
+    return os.environ.get(BYPASS_ENV_VAR, "").lower() in ("1", "true")
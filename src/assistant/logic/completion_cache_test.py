@@ -0,0 +1,83 @@
+import os
+
+from assistant.logic.completion_cache import CompletionCache, completion_cache_key
+
+_MESSAGES = [{"role": "system", "content": "You are an assistant"}, {"role": "user", "content": "alert on errors"}]
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1700000000.0
+
+    def __call__(self) -> float:
+        self.now += 1
+        return self.now
+
+
+def _key(**overrides) -> str:
+    return completion_cache_key(
+        **{"model": "m", "temperature": 0.2, "max_tokens": 1000, "messages": _MESSAGES} | overrides
+    )
+
+
+def test_key_covers_the_whole_request() -> None:
+    assert _key() == _key(messages=[dict(reversed(m.items())) for m in _MESSAGES])
+    assert (
+        len({_key(), _key(model="other"), _key(temperature=0), _key(max_tokens=10), _key(messages=_MESSAGES[:1])}) == 5
+    )
+
+
+def test_put_and_get_across_instances(tmp_path) -> None:
+    cache = CompletionCache(tmp_path)
+    assert cache.get(_key()) is None
+
+    cache.put(_key(), ["Hello", " world"], model="m")
+
+    assert cache.get(_key()) == ["Hello", " world"]
+    reopened = CompletionCache(tmp_path)
+    assert len(reopened) == 1
+    assert reopened.total_bytes == cache.total_bytes
+    assert reopened.get(_key()) == ["Hello", " world"]
+    assert cache.stats.as_dict() == {"hits": 1, "misses": 1, "writes": 1, "evictions": 0}
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path) -> None:
+    cache = CompletionCache(tmp_path, max_bytes=250, clock=FakeClock())
+    keys = [_key(model=f"m{i}") for i in range(3)]
+    cache.put(keys[0], ["a" * 50], model="m")
+    cache.put(keys[1], ["b" * 50], model="m")
+    cache.get(keys[0])
+
+    cache.put(keys[2], ["c" * 50], model="m")
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == ["a" * 50]
+    assert cache.get(keys[2]) == ["c" * 50]
+    assert cache.total_bytes <= 250
+    assert cache.stats.evictions == 1
+    assert len(list(tmp_path.glob("*/*.json"))) == 2
+
+
+def test_corrupt_entry_is_a_miss(tmp_path) -> None:
+    cache = CompletionCache(tmp_path)
+    cache.put(_key(), ["Hello"], model="m")
+    next(tmp_path.glob("*/*.json")).write_text('{"tokens": ["Hel')
+
+    assert cache.get(_key()) is None
+
+
+def test_entry_evicted_while_read_is_a_miss(tmp_path, monkeypatch) -> None:
+    cache = CompletionCache(tmp_path)
+    cache.put(_key(), ["Hello"], model="m")
+    utime = os.utime
+
+    def evicted_by_another_process(path, *args, **kwargs) -> None:
+        os.unlink(path)
+        utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "utime", evicted_by_another_process)
+
+    assert cache.get(_key()) is None
+    assert len(cache) == 0
+    assert cache.total_bytes == 0
+    assert cache.stats.misses == 1
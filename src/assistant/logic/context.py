@@ -0,0 +1,135 @@
+import functools
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from collections.abc import Callable
+
+from .helpers import extract_tag_content
+from .lazy_imports import get_litellm
+
+_logger = logging.getLogger(__name__)
+
+# Claude 3.5 Sonnet has a 200k window; leave plenty of room for the response and tokenizer differences.
+DEFAULT_CONTEXT_TOKEN_BUDGET = 100_000
+# Role markers and separators the providers add around every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATED_ASSISTANT_MESSAGE_CHARS = 500
+FUNCTION_RESULTS_TAG = "function_results"
+_MAX_SUMMARY_ITEMS = 10
+_TOKEN_COUNT_CACHE_SIZE = 4096
+
+TokenCounter = Callable[[str], int]
+
+
+# (model, content digest) -> token count, least recently used first
+_token_counts: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+
+
+def _count_tokens(model: str, content: str) -> int:
+    # History messages are immutable strings, so each one is tokenized once. Keyed by a digest: holding the contents
+    # (system prompt, function results, ...) would keep them alive long after their sessions end.
+    key = (model, hashlib.blake2b(content.encode(), digest_size=16).digest())
+    count = _token_counts.get(key)
+    if count is not None:
+        _token_counts.move_to_end(key)
+        return count
+    count = get_litellm().token_counter(model=model, text=content)
+    _token_counts[key] = count
+    if len(_token_counts) > _TOKEN_COUNT_CACHE_SIZE:
+        _token_counts.popitem(last=False)
+    return count
+
+
+def is_function_results_message(message: dict) -> bool:
+    return message["role"] == "user" and message["content"].lstrip().startswith(f"<{FUNCTION_RESULTS_TAG}>")
+
+
+def _summarize_result(result) -> str:
+    if isinstance(result, dict) and isinstance(result.get("data"), dict) and "result" in result["data"]:
+        data = result["data"]
+        return f"{data.get('resultType', 'result')} with {len(data['result'])} series"
+    if isinstance(result, list):
+        items = ", ".join(json.dumps(item) for item in result[:_MAX_SUMMARY_ITEMS])
+        more = f" and {len(result) - _MAX_SUMMARY_ITEMS} more" if len(result) > _MAX_SUMMARY_ITEMS else ""
+        return f"list of {len(result)} items: {items}{more}"
+    if isinstance(result, dict):
+        return f"object with keys {sorted(result)[:_MAX_SUMMARY_ITEMS]}"
+    return f"{type(result).__name__} value"
+
+
+def summarize_function_results(content: str) -> str:
+    try:
+        results = json.loads(extract_tag_content(content, FUNCTION_RESULTS_TAG) or "")
+    except json.JSONDecodeError:
+        results = None
+    if isinstance(results, list):
+        summary = "; ".join(f"[{i}] {_summarize_result(result)}" for i, result in enumerate(results))
+    else:
+        summary = "unparsable results"
+    return (
+        f"<{FUNCTION_RESULTS_TAG}>[compacted to fit the context budget: {summary}. "
+        f"Call the functions again if you need the full results.]</{FUNCTION_RESULTS_TAG}>"
+    )
+
+
+class ContextCompactor:
+    def __init__(
+        self,
+        *,
+        model: str,
+        token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+        token_counter: TokenCounter | None = None,
+    ) -> None:
+        self._token_budget = token_budget
+        self._token_counter = token_counter or functools.partial(_count_tokens, model)
+
+    def count_tokens(self, message: dict) -> int:
+        return self._token_counter(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def _get_protected_indices(self, messages: list[dict]) -> set[int]:
+        protected = {i for i, m in enumerate(messages) if m["role"] == "system"}
+        protected |= {i for i, m in enumerate(messages) if m["role"] == "user" and not is_function_results_message(m)}
+        last_results = next(
+            (i for i in reversed(range(len(messages))) if is_function_results_message(messages[i])), None
+        )
+        if last_results is not None:
+            # The latest tool exchange: the assistant message that made the calls, their results and anything after.
+            protected |= set(range(max(last_results - 1, 0), len(messages)))
+        elif messages:
+            protected.add(len(messages) - 1)
+        return protected
+
+    def compact(self, messages: list[dict]) -> list[dict]:
+        token_counts = [self.count_tokens(m) for m in messages]
+        total = original_total = sum(token_counts)
+        if total <= self._token_budget:
+            return messages
+
+        compacted = list(messages)
+        protected = self._get_protected_indices(messages)
+        # Old function results are the bulk of a long tool loop and are the cheapest to lose, so they go first.
+        candidates = [
+            i for i in range(len(messages)) if i not in protected and is_function_results_message(messages[i])
+        ]
+        candidates += [i for i in range(len(messages)) if i not in protected and messages[i]["role"] == "assistant"]
+        for i in candidates:
+            if total <= self._token_budget:
+                break
+            message = messages[i]
+            if is_function_results_message(message):
+                content = summarize_function_results(message["content"])
+            elif len(message["content"]) > TRUNCATED_ASSISTANT_MESSAGE_CHARS:
+                content = message["content"][:TRUNCATED_ASSISTANT_MESSAGE_CHARS] + " [... truncated]"
+            else:
+                continue
+            compacted[i] = {**message, "content": content}
+            new_count = self.count_tokens(compacted[i])
+            total += new_count - token_counts[i]
+            token_counts[i] = new_count
+
+        if total > self._token_budget:
+            _logger.warning(f"Context is still {total} tokens after compaction (budget {self._token_budget})")
+        else:
+            _logger.info(f"Compacted context from {original_total} to {total} tokens")
+        return compacted
@@ -0,0 +1,68 @@
+import json
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from assistant.logic import context
+from assistant.logic.context import MESSAGE_OVERHEAD_TOKENS, ContextCompactor
+
+
+def _function_results(results: list) -> str:
+    return f"<function_results>{json.dumps(results)}</function_results>"
+
+
+def _tool_loop_history(rounds: int) -> list[dict]:
+    messages = [
+        {"role": "system", "content": "system prompt"},
+        {"role": "user", "content": "define an alert for http errors"},
+    ]
+    for i in range(rounds):
+        messages.append({"role": "assistant", "content": f"round {i} <function_calls>[...]</function_calls>"})
+        messages.append({"role": "user", "content": _function_results([[f"label_{i}_{j}" for j in range(200)]])})
+    return messages
+
+
+def test_compact_within_budget_is_a_noop() -> None:
+    messages = _tool_loop_history(rounds=2)
+    compactor = ContextCompactor(model="test", token_budget=1_000_000, token_counter=len)
+    assert compactor.compact(messages) is messages
+
+
+def test_compact_summarizes_old_function_results() -> None:
+    messages = _tool_loop_history(rounds=5)
+    budget = sum(len(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages[:2] + messages[-2:]) + 2000
+    compactor = ContextCompactor(model="test", token_budget=budget, token_counter=len)
+
+    compacted = compactor.compact(messages)
+
+    assert sum(compactor.count_tokens(m) for m in compacted) <= budget
+    assert [m["role"] for m in compacted] == [m["role"] for m in messages]
+    # The system prompt, the user turn and the latest tool exchange are kept word for word
+    assert compacted[:2] == messages[:2]
+    assert compacted[-2:] == messages[-2:]
+    assert "compacted to fit the context budget: [0] list of 200 items" in compacted[3]["content"]
+    # The original history is not modified
+    assert messages == _tool_loop_history(rounds=5)
+
+
+def test_token_counts_are_cached_without_holding_the_contents(monkeypatch) -> None:
+    counted = []
+
+    def token_counter(*, model: str, text: str) -> int:
+        counted.append(text)
+        return len(text)
+
+    monkeypatch.setattr(context, "get_litellm", lambda: SimpleNamespace(token_counter=token_counter))
+    monkeypatch.setattr(context, "_token_counts", OrderedDict())
+    monkeypatch.setattr(context, "_TOKEN_COUNT_CACHE_SIZE", 2)
+    results = _function_results([f"label_{j}" for j in range(1000)])
+
+    assert context._count_tokens("m", results) == len(results)
+    assert context._count_tokens("m", results) == len(results)
+    assert counted == [results]
+    assert not any(isinstance(part, str) and len(part) > 100 for key in context._token_counts for part in key)
+
+    context._count_tokens("m", "one")
+    context._count_tokens("m", "two")
+    assert len(context._token_counts) == 2
+    context._count_tokens("m", results)
+    assert counted == [results, "one", "two", results]
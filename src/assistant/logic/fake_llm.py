@@ -1,7 +1,10 @@
 import asyncio
+import json
 import logging
 import random
+import zlib
 from collections.abc import AsyncGenerator
+from types import SimpleNamespace
 from typing import Callable
 
 from .helpers import StreamTagExtractor
@@ -12,6 +15,20 @@ Stream = AsyncGenerator[str, None]
 StreamCallback = Callable[[Stream], None]
 
 
+def split_response(response: str, *, parts: int | None = None, token_size: int | None = None) -> list[str]:
+    # Either `parts` randomly sized tokens, or fixed `token_size` tokens (deterministic, used by the benchmarks).
+    if token_size is not None:
+        return [response[i : i + token_size] for i in range(0, len(response), token_size)]
+    indices = sorted(random.sample(range(1, len(response)), parts))
+    indices.append(len(response))
+    tokens = []
+    start = 0
+    for idx in indices:
+        tokens.append(response[start:idx])
+        start = idx
+    return tokens
+
+
 def new_fake_llm_session(session_id: str, on_message_start_cb, on_tag_start_cb: StreamCallback):
     _logger.info(f"Creating new Fake LLM session for {session_id}")
     return FakeLLMSession(
@@ -43,10 +60,86 @@ class FakeLLMSession:
         async for chunk in self._tokenize_response(fake_response, parts=4, delay=0.8):
             await self._stream_extractor.handle_token(chunk)
 
-    async def _tokenize_response(self, response: str, parts: int, delay: float) -> Stream:
-        indices = sorted(random.sample(range(1, len(response)), parts))
-        start = 0
-        for idx in indices:
-            await asyncio.sleep(delay)
-            yield response[start:idx]
-            start = idx
+    async def _tokenize_response(
+        self, response: str, parts: int | None, delay: float, token_size: int | None = None
+    ) -> Stream:
+        for token in split_response(response, parts=parts, token_size=token_size):
+            if delay:
+                await asyncio.sleep(delay)
+            yield token
+
+
+def _completion_chunk(content: str | None):
+    # Just the parts of a litellm streaming chunk that LLMSession reads
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+
+
+class ScriptedCompletion:
+    # A stand-in for litellm.acompletion that goes through real <function_calls> rounds with realistic token timing:
+    # it asks for `tool_rounds` batches of Prometheus calls per user message, then answers. With `vary_queries`, the
+    # queries' rate window and offset depend on the user message, so different conversations don't ask Prometheus
+    # the exact same thing (and aren't all answered by the response cache).
+    def __init__(
+        self,
+        *,
+        metric_names: list[str],
+        tool_rounds: int = 2,
+        calls_per_round: int = 3,
+        time_to_first_token: float = 0.5,
+        tokens_per_sec: float = 60.0,
+        chars_per_token: int = 4,
+        vary_queries: bool = False,
+    ) -> None:
+        self._metric_names = metric_names
+        self._vary_queries = vary_queries
+        self._tool_rounds = tool_rounds
+        self._calls_per_round = calls_per_round
+        self._time_to_first_token = time_to_first_token
+        self._token_delay = 1 / tokens_per_sec
+        self._chars_per_token = chars_per_token
+
+    def _function_calls(self, tool_round: int, user_message: str) -> list[dict]:
+        metric = self._metric_names[tool_round % len(self._metric_names)]
+        query = f"sum by (job) (rate({metric}[5m]))"
+        if self._vary_queries:
+            variant = zlib.crc32(user_message.encode())
+            query = f"sum by (job) (rate({metric}[{variant % 10 + 1}m] offset {variant % 3600}s))"
+        calls = [
+            {"name": "get_metric_labels", "arguments": {"metric_name": metric}},
+            {"name": "get_metric_metadata", "arguments": {"metric_name": metric}},
+            {"name": "query", "arguments": {"query": query}},
+        ]
+        return calls[: self._calls_per_round]
+
+    def _script_response(self, messages: list[dict]) -> str:
+        # Count the tool rounds since the last message the user actually typed
+        tool_round = 0
+        user_message = ""
+        for message in reversed(messages):
+            content = message["content"] if isinstance(message["content"], str) else ""
+            if message["role"] != "user":
+                continue
+            if not content.lstrip().startswith("<function_results>"):
+                user_message = content
+                break
+            tool_round += 1
+        if tool_round < self._tool_rounds:
+            return (
+                f"<scratchpad>Round {tool_round}: I need more data about the metrics.</scratchpad>\n"
+                f"<function_calls>{json.dumps(self._function_calls(tool_round, user_message))}</function_calls>"
+            )
+        return (
+            "Based on the data, here is the alerting rule:\n<alerting_rule>\n"
+            "- alert: HighErrorRate\n  expr: sum(rate(errors_total[5m])) / sum(rate(requests_total[5m])) > 0.1\n"
+            "  for: 5m\n</alerting_rule>\nIt fires when more than 10% of the requests fail."
+        )
+
+    async def __call__(self, *, messages: list[dict], **_kwargs):
+        response = self._script_response(messages)
+        return self._stream(response)
+
+    async def _stream(self, response: str):
+        await asyncio.sleep(self._time_to_first_token)
+        for token in split_response(response, token_size=self._chars_per_token):
+            yield _completion_chunk(token)
+            await asyncio.sleep(self._token_delay)
@@ -0,0 +1,60 @@
+# Merges the results of the same function called on several Prometheus backends into one, each series labeled with
+# the backend it came from. Results are expected shaped per backend already (see shaping.py), the merged series are
+# capped to the same per-function limits, so asking every backend doesn't send the model more than asking one.
+
+from .range_summary import cap_summaries
+from .shaping import DEFAULT_LIMITS, FUNCTION_LIMITS, shape_function_result
+
+SOURCE_LABEL = "source"
+
+
+def _label_series(series: list[dict], source: str) -> list[dict]:
+    # Copies, responses may be shared through the Prometheus response cache
+    return [{**s, "metric": {**s.get("metric", {}), SOURCE_LABEL: source}} for s in series]
+
+
+def _is_query_response(result) -> bool:
+    return isinstance(result, dict) and isinstance(result.get("data"), dict) and "result" in result["data"]
+
+
+def _is_range_summary(result) -> bool:
+    return isinstance(result, dict) and result.get("resultType") == "matrix_summary"
+
+
+def _merge_truncation(merged: dict, results: dict[str, dict]) -> None:
+    # What was dropped on each backend, along with what was dropped from the merged series. The note telling the model
+    # how to narrow the query is the same for every backend, so it's kept once.
+    truncations = {source: r["truncated"] for source, r in results.items() if "truncated" in r}
+    if not truncations:
+        return
+    note = next(iter(truncations.values())).get("note")
+    by_source = {source: {k: v for k, v in t.items() if k != "note"} for source, t in truncations.items()}
+    merged["truncated"] = {**merged.get("truncated", {"note": note}), "by_source": by_source}
+
+
+def merge_backend_results(function_name: str, results: dict[str, object], errors: dict[str, str]) -> dict:
+    merged: dict = {}
+    values = list(results.values())
+    if values and all(_is_query_response(r) for r in values):
+        result_types = {r["data"].get("resultType") for r in values}
+        if len(result_types) == 1 and result_types <= {"vector", "matrix"}:
+            series = [s for source, r in results.items() for s in _label_series(r["data"]["result"], source)]
+            response = {"status": "success", "data": {"resultType": result_types.pop(), "result": series}}
+            merged = shape_function_result(function_name, response)
+            _merge_truncation(merged, results)
+    elif values and all(_is_range_summary(r) for r in values):
+        first = values[0]
+        series = [s for source, r in results.items() for s in _label_series(r["series"], source)]
+        limits = FUNCTION_LIMITS.get(function_name, DEFAULT_LIMITS)
+        merged = {
+            **{k: v for k, v in first.items() if k not in ("series", "truncated")},
+            **cap_summaries(series, limits),
+        }
+        _merge_truncation(merged, results)
+    if not merged:
+        # Label lists, metadata, ...: nothing to merge series-wise, so one (shaped) entry per backend
+        merged = {"results": results}
+    merged["sources"] = list(results)
+    if errors:
+        merged["errors"] = errors
+    return merged
@@ -1,10 +1,18 @@
 import asyncio
 import json
 import re
+import time
 from collections.abc import AsyncGenerator
+from dataclasses import dataclass
 from enum import Enum
 from typing import Callable
 
+from assistant.telemetry import metrics, tracing
+
+# Bound once, these are observed for every streamed chunk.
+_MESSAGE_QUEUE_DEPTH = metrics.STREAM_QUEUE_DEPTH.labels("message")
+_TAG_QUEUE_DEPTH = metrics.STREAM_QUEUE_DEPTH.labels("tag")
+
 
 def extract_tag_content(text: str, tag_name: str) -> str | None:
     pattern = f"<{tag_name}>(.*?)</{tag_name}>"
@@ -21,65 +29,149 @@ def extract_json_tag_content(text: str, tag_name: str) -> dict | list | None:
 Callback = Callable[..., None]
 
 
+@dataclass(frozen=True)
+class StreamFlushPolicy:
+    # Chunks waiting in a stream are merged and handed to the callback at most once per `interval` seconds (one UI
+    # update per frame), or right away once `size` chars are waiting. Producers wait while `max_buffered` chars are.
+    interval: float = 0.03
+    size: int = 4096
+    max_buffered: int = 64 * 1024
+
+
+DEFAULT_FLUSH_POLICY = StreamFlushPolicy()
+
+
+class CoalescingStream:
+    def __init__(self, policy: StreamFlushPolicy = DEFAULT_FLUSH_POLICY) -> None:
+        self._policy = policy
+        self._chunks: list[str] = []
+        self._size = 0
+        self._closed = False
+        self._consumer_gone = False
+        # The first chunk goes out right away
+        self._last_flush_at = float("-inf")
+        self._readable = asyncio.Event()
+        self._flush_now = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def qsize(self) -> int:
+        return self._size
+
+    async def put(self, chunk: str) -> None:
+        while self._size >= self._policy.max_buffered and not self._consumer_gone:
+            # The consumer (e.g. a slow websocket client) is behind, slow the producer down instead of buffering.
+            metrics.STREAM_BACKPRESSURE_WAITS.inc()
+            self._writable.clear()
+            await self._writable.wait()
+        if self._consumer_gone:
+            return
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self._readable.set()
+        if self._size >= self._policy.size:
+            self._flush_now.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._readable.set()
+        self._flush_now.set()
+
+    async def _wait_for_frame(self) -> None:
+        delay = self._last_flush_at + self._policy.interval - time.monotonic()
+        if delay <= 0 or self._flush_now.is_set():
+            return
+        try:
+            async with asyncio.timeout(delay):
+                await self._flush_now.wait()
+        except TimeoutError:
+            pass
+
+    async def __aiter__(self) -> AsyncGenerator[str, None]:
+        try:
+            while True:
+                await self._readable.wait()
+                await self._wait_for_frame()
+                chunk = "".join(self._chunks)
+                self._chunks.clear()
+                self._size = 0
+                self._readable.clear()
+                self._flush_now.clear()
+                self._writable.set()
+                self._last_flush_at = time.monotonic()
+                if chunk:
+                    yield chunk
+                if self._closed and not self._chunks:
+                    return
+        finally:
+            # If the callback failed (e.g. the client went away), don't leave the producer waiting on it.
+            self._consumer_gone = True
+            self._writable.set()
+
+
 class StreamHandler:
-    def __init__(self, on_message_callback: Callback, on_tag_start_callback: Callback):
+    def __init__(
+        self,
+        on_message_callback: Callback,
+        on_tag_start_callback: Callback,
+        flush_policy: StreamFlushPolicy = DEFAULT_FLUSH_POLICY,
+    ):
         self._on_message_callback = on_message_callback
-        self._message_queue = None
+        self._message_queue: CoalescingStream | None = None
         self._on_tag_start_callback = on_tag_start_callback
-        self._tag_queue = None
+        self._tag_queue: CoalescingStream | None = None
+        self._flush_policy = flush_policy
         self._active_tasks: set[asyncio.Task] = set()
 
-    def _get_stream_handler(self, queue):
-        async def stream_handler() -> AsyncGenerator[str, None]:
-            while True:
-                chunk = await queue.get()
-                if chunk is None:  # None signals end of stream
-                    break
-                yield chunk
-
-        return stream_handler
-
     def _add_task(self, coro):
         task = asyncio.create_task(coro)
         self._active_tasks.add(task)
-        task.add_done_callback(self._active_tasks.discard)
+        metrics.STREAM_ACTIVE_TASKS.inc()
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._active_tasks.discard(task)
+        metrics.STREAM_ACTIVE_TASKS.dec()
+
+    @staticmethod
+    async def _put(queue: CoalescingStream, chunk: str, depth_histogram) -> None:
+        depth_histogram.observe(queue.qsize())
+        await queue.put(chunk)
 
-    async def _create_message_stream(self) -> asyncio.Queue:
-        queue = asyncio.Queue()
-        sh = self._get_stream_handler(queue)
-        self._add_task(self._on_message_callback(sh()))
+    async def _create_message_stream(self) -> CoalescingStream:
+        queue = CoalescingStream(self._flush_policy)
+        self._add_task(self._on_message_callback(aiter(queue)))
         return queue
 
-    async def _create_tag_stream(self, tag_name: str) -> asyncio.Queue:
-        queue = asyncio.Queue()
-        sh = self._get_stream_handler(queue)
-        self._add_task(self._on_tag_start_callback(tag_name, sh()))
+    async def _create_tag_stream(self, tag_name: str) -> CoalescingStream:
+        queue = CoalescingStream(self._flush_policy)
+        self._add_task(self._on_tag_start_callback(tag_name, aiter(queue)))
         return queue
 
     async def start_tag_stream(self, tag_name: str, tag_content: str) -> None:
         assert self._tag_queue is None
         self._tag_queue = await self._create_tag_stream(tag_name)
-        await self._tag_queue.put(tag_content)
+        await self._put(self._tag_queue, tag_content, _TAG_QUEUE_DEPTH)
 
     async def stream_tag(self, tag_content: str) -> None:
-        await self._tag_queue.put(tag_content)
+        await self._put(self._tag_queue, tag_content, _TAG_QUEUE_DEPTH)
 
     async def end_tag_stream(self) -> None:
-        await self._tag_queue.put(None)
+        self._tag_queue.close()
         self._tag_queue = None
 
     async def maybe_send_message(self, message_buffer: list[str], is_final: bool) -> None:
         if not message_buffer:
             if is_final and self._message_queue:
-                await self._message_queue.put(None)
+                self._message_queue.close()
                 self._message_queue = None
             return
         if not self._message_queue:
             self._message_queue = await self._create_message_stream()
         mb = "".join(message_buffer)
-        await self._message_queue.put(mb)
+        await self._put(self._message_queue, mb, _MESSAGE_QUEUE_DEPTH)
         if is_final:
-            await self._message_queue.put(None)
+            self._message_queue.close()
             self._message_queue = None
 
     async def wait_for_tasks(self) -> None:
@@ -101,16 +193,23 @@ class StreamTagExtractor:
         on_message_callback,
         on_tag_start_callback: Callback,
         on_tag_callback: Callback | None = None,
+        flush_policy: StreamFlushPolicy = DEFAULT_FLUSH_POLICY,
     ):
         self._mode = StreamMode.NORMAL
         self._current_tag_name = None
+        self._closing_tag = ""
+        # Last len(closing tag) - 1 chars of the tag content, so a closing tag split across tokens is still found.
+        self._closing_tag_tail = ""
         self._tag_chunk_buffer = []
+        self._tag_started_at = 0.0
         self._message_buffer = []
         self._on_tag_callback = on_tag_callback
-        self._stream_helper = StreamHandler(on_message_callback, on_tag_start_callback)
+        self._stream_helper = StreamHandler(on_message_callback, on_tag_start_callback, flush_policy)
 
     def reset_tags_tracker(self) -> None:
         self._current_tag_name = None
+        self._closing_tag = ""
+        self._closing_tag_tail = ""
         self._tag_chunk_buffer.clear()
         self._tag_chunk_buffer.append("<")
 
@@ -120,40 +219,76 @@ class StreamTagExtractor:
 
     async def _start_tag(self):
         self._mode = StreamMode.COLLECTING_TAG
+        self._tag_started_at = time.perf_counter()
         self.reset_tags_tracker()
         await self._maybe_send_message(is_final=False)
 
     async def _end_tag(self):
         tag_buffer = "".join(self._tag_chunk_buffer)
         self._current_tag_name = tag_buffer[1:-1]
+        self._closing_tag = f"</{self._current_tag_name}>"
         self._mode = StreamMode.IN_TAG
         await self._stream_helper.start_tag_stream(self._current_tag_name, tag_buffer)
 
-    async def _in_tag_content(self, char):
-        self._tag_chunk_buffer.append(char)
+    def _handle_normal(self, token: str, pos: int) -> int:
+        idx = token.find("<", pos)
+        end = len(token) if idx == -1 else idx
+        if end > pos:
+            self._message_buffer.append(token[pos:end])
+        return end
+
+    async def _collect_tag(self, token: str, pos: int) -> int:
+        idx = token.find(">", pos)
+        if idx == -1:
+            self._tag_chunk_buffer.append(token[pos:])
+            return len(token)
+        self._tag_chunk_buffer.append(token[pos : idx + 1])
+        await self._end_tag()
+        return idx + 1
+
+    async def _in_tag_content(self, token: str, pos: int) -> int:
         assert self._current_tag_name is not None
-        tag_chunk = "".join(self._tag_chunk_buffer)
-        await self._stream_helper.stream_tag(char)
-        if not tag_chunk.endswith(f"</{self._current_tag_name}>"):
-            return
+        tail = self._closing_tag_tail
+        window = tail + token[pos:]
+        idx = window.find(self._closing_tag)
+        if idx == -1:
+            chunk = token[pos:]
+            end = len(token)
+        else:
+            end = pos + idx + len(self._closing_tag) - len(tail)
+            chunk = token[pos:end]
+        self._tag_chunk_buffer.append(chunk)
+        await self._stream_helper.stream_tag(chunk)
+        if idx == -1:
+            self._closing_tag_tail = window[-(len(self._closing_tag) - 1) :]
+            return end
         self._mode = StreamMode.NORMAL
         await self._stream_helper.end_tag_stream()
+        tag_content = "".join(self._tag_chunk_buffer)
+        # From "<" to the closing tag, i.e. mostly how long the LLM took to stream the tag.
+        tracing.record_span(
+            "tag",
+            start=self._tag_started_at,
+            duration=time.perf_counter() - self._tag_started_at,
+            tag=self._current_tag_name,
+            chars=len(tag_content),
+        )
         if self._on_tag_callback is not None:
-            self._on_tag_callback(self._current_tag_name, tag_chunk)
+            self._on_tag_callback(self._current_tag_name, tag_content)
+        return end
 
     async def handle_token(self, token: str) -> None:
-        for char in token:
+        pos = 0
+        while pos < len(token):
             if self._mode == StreamMode.NORMAL:
-                if char == "<":
+                pos = self._handle_normal(token, pos)
+                if pos < len(token):
                     await self._start_tag()
-                else:
-                    self._message_buffer.append(char)
+                    pos += 1
             elif self._mode == StreamMode.COLLECTING_TAG:
-                self._tag_chunk_buffer.append(char)
-                if char == ">":
-                    await self._end_tag()
+                pos = await self._collect_tag(token, pos)
             elif self._mode == StreamMode.IN_TAG:
-                await self._in_tag_content(char)
+                pos = await self._in_tag_content(token, pos)
         await self._maybe_send_message(is_final=True)
 
     async def wait_for_tasks(self) -> None:
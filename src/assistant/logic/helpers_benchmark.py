@@ -0,0 +1,160 @@
+import asyncio
+import bisect
+import json
+import statistics
+import time
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+
+from .fake_llm import split_response
+from .helpers import StreamTagExtractor, extract_tag_content
+
+# Run with: PYTHONPATH=src python -m assistant.logic.helpers_benchmark
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    response: str
+    token_size: int
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:
+    scenario: str
+    tokens: int
+    chars: int
+    seconds: float
+    peak_alloc_bytes: int
+    callback_latency_p50_ms: float
+    callback_latency_p99_ms: float
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.tokens / self.seconds
+
+    @property
+    def chars_per_sec(self) -> float:
+        return self.chars / self.seconds
+
+
+def _many_tags_response(count: int) -> str:
+    return "".join(f"Step {i}: <scratchpad>thinking about metric_{i}</scratchpad> then " for i in range(count))
+
+
+def _long_tag_response(size: int) -> str:
+    series = [
+        {"metric": {"pod": f"pod-{i}", "namespace": "default"}, "value": [1700000000, str(i)]} for i in range(size)
+    ]
+    return f"Results: <function_results>{json.dumps(series)}</function_results> done."
+
+
+def _plain_text_response(size: int) -> str:
+    return ("The rate of 4xx errors is above the threshold for the ALB target group. " * size)[: size * 10]
+
+
+SCENARIOS = (
+    Scenario("many_tags_tiny_tokens", _many_tags_response(200), token_size=1),
+    Scenario("many_tags_small_tokens", _many_tags_response(1000), token_size=4),
+    Scenario("long_tag_tiny_tokens", _long_tag_response(200), token_size=1),
+    Scenario("long_tag_large_tokens", _long_tag_response(5000), token_size=4096),
+    Scenario("plain_text_large_tokens", _plain_text_response(20000), token_size=4096),
+)
+
+
+class _CallbackRecorder:
+    def __init__(self) -> None:
+        self.arrivals: list[float] = []
+
+    async def on_message(self, stream) -> None:
+        async for _ in stream:
+            self.arrivals.append(time.perf_counter())
+
+    async def on_tag_start(self, _tag_name: str, stream) -> None:
+        async for _ in stream:
+            self.arrivals.append(time.perf_counter())
+
+
+async def _stream_tokens(tokens: list[str]) -> tuple[float, list[float], list[float]]:
+    recorder = _CallbackRecorder()
+    extractor = StreamTagExtractor(
+        on_message_callback=recorder.on_message,
+        on_tag_start_callback=recorder.on_tag_start,
+        on_tag_callback=lambda _name, _content: None,
+    )
+    sent: list[float] = []
+    start = time.perf_counter()
+    for token in tokens:
+        sent.append(time.perf_counter())
+        await extractor.handle_token(token)
+    await extractor.wait_for_tasks()
+    return time.perf_counter() - start, sent, recorder.arrivals
+
+
+def _callback_latencies_ms(sent: list[float], arrivals: list[float]) -> list[float]:
+    # Each chunk is attributed to the latest token handed to the extractor before it reached the callback.
+    latencies = []
+    for arrival in arrivals:
+        idx = bisect.bisect_right(sent, arrival) - 1
+        if idx >= 0:
+            latencies.append((arrival - sent[idx]) * 1000)
+    return latencies or [0.0]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[round(q * 100) - 1]
+
+
+async def run_scenario(scenario: Scenario) -> BenchmarkResult:
+    tokens = split_response(scenario.response, token_size=scenario.token_size)
+    seconds, sent, arrivals = await _stream_tokens(tokens)
+    latencies = _callback_latencies_ms(sent, arrivals)
+
+    # Allocations are measured in a separate pass, tracemalloc slows everything down.
+    tracemalloc.start()
+    try:
+        await _stream_tokens(tokens)
+        _, peak_alloc_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return BenchmarkResult(
+        scenario=scenario.name,
+        tokens=len(tokens),
+        chars=len(scenario.response),
+        seconds=seconds,
+        peak_alloc_bytes=peak_alloc_bytes,
+        callback_latency_p50_ms=_percentile(latencies, 0.5),
+        callback_latency_p99_ms=_percentile(latencies, 0.99),
+    )
+
+
+def bench_extract_tag_content(text: str, tag_name: str, *, repeat: int = 20, rounds: int = 5) -> float:
+    # Best round, like timeit: the slower ones measure whatever else the machine was doing
+    return min(
+        timeit.timeit(lambda: extract_tag_content(text, tag_name), number=repeat) / repeat for _ in range(rounds)
+    )
+
+
+async def run_all() -> list[BenchmarkResult]:
+    return [await run_scenario(scenario) for scenario in SCENARIOS]
+
+
+def main() -> None:
+    header = f"{'scenario':<26} {'tokens':>8} {'tokens/s':>12} {'MB/s':>8} {'peak KiB':>10} {'p50 ms':>8} {'p99 ms':>8}"
+    print(header)  # noqa: T201
+    for r in asyncio.run(run_all()):
+        print(  # noqa: T201
+            f"{r.scenario:<26} {r.tokens:>8} {r.tokens_per_sec:>12,.0f} {r.chars_per_sec / 1e6:>8.2f} "
+            f"{r.peak_alloc_bytes / 1024:>10,.0f} {r.callback_latency_p50_ms:>8.3f} {r.callback_latency_p99_ms:>8.3f}",
+        )
+    long_tag = _long_tag_response(5000)
+    extract_ms = bench_extract_tag_content(long_tag, "function_results") * 1000
+    print(f"extract_tag_content on {len(long_tag):,} chars: {extract_ms:.3f} ms")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
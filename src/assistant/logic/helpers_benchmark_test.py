@@ -0,0 +1,41 @@
+import pytest
+
+from assistant.logic.helpers_benchmark import SCENARIOS, bench_extract_tag_content, run_scenario
+
+# Regression thresholds, roughly 10x below what a laptop does, so they only trip on real regressions.
+# Run with: make bench
+MIN_TOKENS_PER_SEC = {
+    "many_tags_tiny_tokens": 20_000,
+    "many_tags_small_tokens": 15_000,
+    "long_tag_tiny_tokens": 60_000,
+    "long_tag_large_tokens": 20_000,
+    "plain_text_large_tokens": 10_000,
+}
+MAX_CALLBACK_LATENCY_P99_MS = 150
+# About twice the measured peaks
+MAX_PEAK_ALLOC_BYTES = {
+    "many_tags_tiny_tokens": 32 * 1024 * 1024,
+    "many_tags_small_tokens": 48 * 1024 * 1024,
+    "long_tag_tiny_tokens": 2 * 1024 * 1024,
+    "long_tag_large_tokens": 1024 * 1024,
+    "plain_text_large_tokens": 512 * 1024,
+}
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=[s.name for s in SCENARIOS])
+@pytest.mark.asyncio
+async def test_stream_tag_extractor_throughput(scenario) -> None:
+    result = await run_scenario(scenario)
+    assert result.tokens_per_sec >= MIN_TOKENS_PER_SEC[scenario.name]
+    assert result.callback_latency_p99_ms <= MAX_CALLBACK_LATENCY_P99_MS
+    assert result.peak_alloc_bytes <= MAX_PEAK_ALLOC_BYTES[scenario.name]
+
+
+def test_extract_tag_content_is_linear() -> None:
+    small = "<function_results>" + "x" * 10_000 + "</function_results>"
+    large = "<function_results>" + "x" * 1_000_000 + "</function_results>"
+    ratio = bench_extract_tag_content(large, "function_results") / bench_extract_tag_content(small, "function_results")
+    # 100x the input, linear is about 100x the time
+    assert ratio < 150
@@ -1,9 +1,10 @@
+import asyncio
 from collections import defaultdict
 from collections.abc import AsyncGenerator
 
 import pytest
 
-from assistant.logic.helpers import StreamTagExtractor
+from assistant.logic.helpers import CoalescingStream, StreamFlushPolicy, StreamTagExtractor
 
 
 @pytest.fixture
@@ -87,7 +88,8 @@ class TestStreamTagExtractor:
     ) -> None:
         await stream_tag_extractor.handle_token("Hello <tag>content</tag> World")
         await stream_tag_extractor.wait_for_tasks()
-        assert on_message_callback.messages == ["Hello ", " World"]
+        # Both parts go to the message stream opened before the tag, and were waiting there together
+        assert on_message_callback.messages == ["Hello  World"]
         assert_tags([("tag", "<tag>content</tag>")], on_tag_callback.tags, on_tag_start_callback.tags)
 
     @pytest.mark.asyncio
@@ -194,3 +196,108 @@ class TestStreamTagExtractor:
         await stream_tag_extractor.wait_for_tasks()
         assert on_message_callback.messages == []
         assert_tags([], on_tag_callback.tags, on_tag_start_callback.tags)
+
+    @pytest.mark.parametrize("token_size", [1, 2, 3, 5, 7])
+    @pytest.mark.asyncio
+    async def test_handle_token_split_tokens(
+        self,
+        stream_tag_extractor,
+        on_message_callback,
+        on_tag_callback,
+        on_tag_start_callback,
+        token_size,
+    ) -> None:
+        text = "Hello <tag1>con</tag>tent1</tag1> between <tag2>content2</tag2> World"
+        for i in range(0, len(text), token_size):
+            await stream_tag_extractor.handle_token(text[i : i + token_size])
+        await stream_tag_extractor.wait_for_tasks()
+        assert "".join(on_message_callback.messages) == "Hello  between  World"
+        assert_tags(
+            [("tag1", "<tag1>con</tag>tent1</tag1>"), ("tag2", "<tag2>content2</tag2>")],
+            on_tag_callback.tags,
+            on_tag_start_callback.tags,
+        )
+
+    @pytest.mark.asyncio
+    async def test_handle_token_coalesces_waiting_chunks(
+        self,
+        stream_tag_extractor,
+        on_tag_start_callback,
+    ) -> None:
+        await stream_tag_extractor.handle_token("<tag>")
+        await stream_tag_extractor.handle_token("a long piece of content")
+        await stream_tag_extractor.handle_token(" and the end</tag>")
+        await stream_tag_extractor.wait_for_tasks()
+        assert on_tag_start_callback.tags["tag"] == ["<tag>a long piece of content and the end</tag>"]
+
+
+async def _collect(stream: CoalescingStream, chunks: list[str] | None = None) -> list[str]:
+    chunks = [] if chunks is None else chunks
+    async for chunk in stream:
+        chunks.append(chunk)
+    return chunks
+
+
+async def _run_pending_tasks() -> None:
+    # Lets the consumer handle what was just put, without waiting on any timer
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestCoalescingStream:
+    @pytest.mark.asyncio
+    async def test_flushes_once_per_frame(self) -> None:
+        # A frame far longer than the test, so nothing depends on how fast it runs
+        stream = CoalescingStream(StreamFlushPolicy(interval=60))
+        chunks: list[str] = []
+        consumer = asyncio.create_task(_collect(stream, chunks))
+        for i in range(10):
+            await stream.put(str(i))
+            await _run_pending_tasks()
+        # The first chunk goes out right away, the rest wait for the end of the frame
+        assert chunks == ["0"]
+        stream.close()
+        await consumer
+        assert chunks == ["0", "123456789"]
+
+    @pytest.mark.asyncio
+    async def test_flushes_when_the_frame_ends(self) -> None:
+        stream = CoalescingStream(StreamFlushPolicy(interval=0.01))
+        chunks = aiter(stream)
+        await stream.put("a")
+        assert await anext(chunks) == "a"
+        await stream.put("b")
+        # The stream isn't closed, the frame timer flushes it
+        assert await asyncio.wait_for(anext(chunks), 5) == "b"
+        stream.close()
+        await chunks.aclose()
+
+    @pytest.mark.asyncio
+    async def test_flushes_early_once_size_is_reached(self) -> None:
+        stream = CoalescingStream(StreamFlushPolicy(interval=60, size=4))
+        chunks: list[str] = []
+        consumer = asyncio.create_task(_collect(stream, chunks))
+        await stream.put("a")
+        await _run_pending_tasks()
+        await stream.put("bcd")
+        await _run_pending_tasks()
+        assert chunks == ["a"]
+        await stream.put("e")
+        await _run_pending_tasks()
+        assert chunks == ["a", "bcde"]
+        stream.close()
+        await consumer
+
+    @pytest.mark.asyncio
+    async def test_producer_waits_for_a_slow_consumer(self) -> None:
+        stream = CoalescingStream(StreamFlushPolicy(interval=0, size=1, max_buffered=8))
+        await stream.put("x" * 8)
+        blocked_put = asyncio.create_task(stream.put("y"))
+        await _run_pending_tasks()
+        assert not blocked_put.done()
+        assert stream.qsize() == 8
+
+        consumer = asyncio.create_task(_collect(stream))
+        await asyncio.wait_for(blocked_put, 5)
+        stream.close()
+        assert "".join(await consumer) == "x" * 8 + "y"
@@ -0,0 +1,174 @@
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Protocol
+
+_logger = logging.getLogger(__name__)
+
+MESSAGE_HISTORY_DIR = Path(".message_history")
+
+# Bump when the schema changes; version 1 also covers the one-off import of the legacy JSON files.
+_SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+class HistoryStore(Protocol):
+    # Blocking calls, sessions run them with asyncio.to_thread. An append is durable (committed) once it returns.
+    def append(self, *, session_id: str, role: str, content: str) -> None: ...
+
+    def get_latest_history(self, *, exclude_session_id: str | None = None) -> list[dict] | None: ...
+
+    def close(self) -> None: ...
+
+
+class JsonHistoryStore:
+    # The original storage format: one JSON file per session, rewritten on every message.
+    def __init__(self, path: Path = MESSAGE_HISTORY_DIR) -> None:
+        self._path = path
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._sessions: dict[str, list[dict]] = {}
+
+    def append(self, *, session_id: str, role: str, content: str) -> None:
+        messages = self._sessions.setdefault(session_id, [])
+        messages.append({"role": role, "content": content})
+        (self._path / f"{session_id}.json").write_text(json.dumps(messages, indent=2))
+
+    def get_latest_history(self, *, exclude_session_id: str | None = None) -> list[dict] | None:
+        history_files = sorted(self._path.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        history_files = [fn for fn in history_files if fn.stem != exclude_session_id]
+        if not history_files:
+            return None
+        fn = history_files[0]
+        messages = json.loads(fn.read_text())
+        _logger.info(f"Loaded {len(messages)} messages from {fn}")
+        return messages
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteHistoryStore:
+    # Every append is its own short transaction, so no write lock is held while a session waits on the LLM and other
+    # workers sharing the database can write. With WAL and synchronous=NORMAL a commit doesn't fsync, it's cheap.
+    def __init__(self, db_path: Path) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db_path = db_path
+        self._next_seq: dict[str, int] = {}
+        # One connection shared by the threads the sessions append from
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only syncs on checkpoints; a crash can lose the last batch but never corrupts the db.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    @property
+    def schema_version(self) -> int:
+        return self._conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _get_next_seq(self, session_id: str) -> int:
+        if session_id not in self._next_seq:
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            self._next_seq[session_id] = row[0]
+        return self._next_seq[session_id]
+
+    def append(self, *, session_id: str, role: str, content: str, timestamp: float | None = None) -> None:
+        with self._lock, self._conn:
+            self._insert(session_id=session_id, role=role, content=content, timestamp=timestamp)
+
+    def _insert(self, *, session_id: str, role: str, content: str, timestamp: float | None) -> None:
+        # Must be called with the lock held, within a transaction
+        now = time.time() if timestamp is None else timestamp
+        seq = self._get_next_seq(session_id)
+        self._conn.execute(
+            "INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, seq, role, content, now),
+        )
+        self._conn.execute(
+            "INSERT INTO sessions (session_id, created_at, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (session_id, now, now),
+        )
+        self._next_seq[session_id] = seq + 1
+
+    def get_latest_history(self, *, exclude_session_id: str | None = None) -> list[dict] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT session_id FROM sessions WHERE session_id IS NOT ? ORDER BY updated_at DESC LIMIT 1",
+                (exclude_session_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            session_id = row[0]
+            messages = [
+                {"role": role, "content": content}
+                for role, content in self._conn.execute(
+                    "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+                )
+            ]
+        _logger.info(f"Loaded {len(messages)} messages from session {session_id}")
+        return messages
+
+    def has_session(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def migrate_json_history(self, json_dir: Path) -> int:
+        if self.schema_version >= _SCHEMA_VERSION:
+            return 0
+        migrated = 0
+        for fn in sorted(json_dir.glob("*.json"), key=lambda p: p.stat().st_mtime):
+            session_id = fn.stem
+            if self.has_session(session_id):
+                continue
+            try:
+                messages = json.loads(fn.read_text())
+            except (OSError, json.JSONDecodeError):
+                _logger.exception(f"Skipping unreadable history file {fn}")
+                continue
+            mtime = fn.stat().st_mtime
+            # One transaction per file
+            with self._lock, self._conn:
+                for message in messages:
+                    self._insert(
+                        session_id=session_id, role=message["role"], content=message["content"], timestamp=mtime
+                    )
+            migrated += 1
+        with self._lock, self._conn:
+            self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        if migrated:
+            _logger.info(f"Migrated {migrated} JSON history files from {json_dir} into {self._db_path}")
+        return migrated
+
+
+@functools.cache
+def get_default_history_store() -> HistoryStore:
+    store = SQLiteHistoryStore(MESSAGE_HISTORY_DIR / "history.sqlite3")
+    store.migrate_json_history(MESSAGE_HISTORY_DIR)
+    return store
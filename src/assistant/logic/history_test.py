@@ -0,0 +1,52 @@
+import json
+import os
+
+from assistant.logic.history import SQLiteHistoryStore
+
+
+def test_append_and_resume_most_recent(tmp_path) -> None:
+    store = SQLiteHistoryStore(tmp_path / "history.sqlite3")
+    store.append(session_id="old", role="user", content="hi", timestamp=1)
+    store.append(session_id="new", role="user", content="hello", timestamp=2)
+    store.append(session_id="new", role="assistant", content="hey", timestamp=3)
+
+    assert store.get_latest_history() == [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hey"}]
+    assert store.get_latest_history(exclude_session_id="new") == [{"role": "user", "content": "hi"}]
+    store.close()
+
+
+def test_appends_are_committed_right_away(tmp_path) -> None:
+    db_path = tmp_path / "history.sqlite3"
+    store = SQLiteHistoryStore(db_path)
+    store.append(session_id="s1", role="user", content="one")
+    store.append(session_id="s1", role="assistant", content="two")
+
+    # Another worker sharing the database sees them, and can write while this store is open
+    other_worker = SQLiteHistoryStore(db_path)
+    assert [m["content"] for m in other_worker.get_latest_history()] == ["one", "two"]
+    other_worker.append(session_id="s2", role="user", content="three")
+    assert not store._conn.in_transaction
+    assert not other_worker._conn.in_transaction
+    store.close()
+
+    reopened = SQLiteHistoryStore(db_path)
+    assert [m["content"] for m in reopened.get_latest_history(exclude_session_id="s2")] == ["one", "two"]
+    assert [m["content"] for m in reopened.get_latest_history()] == ["three"]
+    reopened.close()
+    other_worker.close()
+
+
+def test_migrate_json_history(tmp_path) -> None:
+    older = tmp_path / "older.json"
+    older.write_text(json.dumps([{"role": "user", "content": "older"}]))
+    os.utime(older, (100, 100))
+    newer = tmp_path / "newer.json"
+    newer.write_text(json.dumps([{"role": "user", "content": "newer"}, {"role": "assistant", "content": "ok"}]))
+    os.utime(newer, (200, 200))
+
+    store = SQLiteHistoryStore(tmp_path / "history.sqlite3")
+    assert store.migrate_json_history(tmp_path) == 2
+    assert store.get_latest_history() == [{"role": "user", "content": "newer"}, {"role": "assistant", "content": "ok"}]
+    # The migration only runs once
+    assert store.migrate_json_history(tmp_path) == 0
+    store.close()
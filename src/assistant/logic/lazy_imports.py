@@ -0,0 +1,17 @@
+import functools
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# litellm takes most of the web worker's import time and a good part of its memory, so it's imported on first use
+# rather than when assistant.run.main is loaded. See run/startup_benchmark.py.
+
+
+@functools.cache
+def get_litellm():
+    _logger.info("Importing litellm")
+    import litellm
+
+    litellm.success_callback = ["langsmith"]
+    # litellm.set_verbose=True
+    return litellm
@@ -1,18 +1,39 @@
+import asyncio
 import json
 import logging
-from collections.abc import AsyncGenerator
+import os
+import time
+from collections.abc import AsyncGenerator, AsyncIterable
 from copy import deepcopy
 from pathlib import Path
 from typing import Callable
 
-import litellm
+from assistant.telemetry import metrics, tracing
 
 from . import prompts
+from .completion_cache import (
+    CompletionCache,
+    completion_cache_key,
+    get_default_completion_cache,
+    is_completion_cache_bypassed,
+)
+from .context import DEFAULT_CONTEXT_TOKEN_BUDGET, ContextCompactor
 from .helpers import StreamTagExtractor, extract_json_tag_content
-from .tools import PrometheusFunctions
+from .history import HistoryStore, get_default_history_store
+from .lazy_imports import get_litellm
+from .prompt_caching import PromptCacheUsage, apply_prompt_caching, supports_prompt_caching
+from .tools import (
+    PrometheusFunctions,
+    as_function_call_list,
+    format_function_results,
+    function_error,
+    get_function_call_name,
+)
 
 _logger = logging.getLogger(__name__)
 
+FUNCTION_CALLS_TAG = "function_calls"
+
 SYSTEM_ROLE = "system"
 USER_ROLE = "user"
 ASSISTANT_ROLE = "assistant"
@@ -20,12 +41,23 @@ ASSISTANT_ROLE = "assistant"
 Stream = AsyncGenerator[str, None]
 StreamCallback = Callable[[Stream], None]
 
-litellm.success_callback = ["langsmith"]
-# litellm.set_verbose=True
-
 
 DEFAULT_TEMPERATURE = 0.2
+MAX_TOKENS = 1000
 MAX_FUNCTION_CALLS_PER_MESSAGE = 30
+# Wall time for the function call rounds of one message. Once spent, the model gets one last round to answer with
+# what it has instead of calling more functions.
+MESSAGE_TIME_BUDGET_SECONDS = 180
+# An LLM stream that sends nothing for this long (no response, then no chunk) fails the message rather than hanging
+# the session. Time spent by the UI consuming the tokens doesn't count.
+LLM_STREAM_IDLE_TIMEOUT_SECONDS = 120
+_BUDGET_EXHAUSTED_MESSAGES = {
+    "time": "Not run, the time budget for this message is used up.",
+    "call_limit": f"Not run, the limit of {MAX_FUNCTION_CALLS_PER_MESSAGE} function call rounds per message is reached.",
+}
+_BUDGET_EXHAUSTED_INSTRUCTION = (
+    " Don't call more functions now: answer with what you found so far and tell the user what is left to check."
+)
 # Choose one of these model configurations by uncommenting it:
 
 # OpenAI GPT-4
@@ -40,20 +72,35 @@ FIREWORKS_MODEL = "fireworks_ai/accounts/fireworks/models/qwen2p5-coder-32b-inst
 CURRENT_MODEL = CLAUDE_MODEL  # Change this to the model you want to use
 # see: https://docs.anthropic.com/en/api/messages#body-messages
 SUPPORT_SYSTEM_MESSAGE = CURRENT_MODEL != CLAUDE_MODEL
+# Opt-in: mark the system prompt and the history prefix as cacheable for models that support prompt caching.
+ENABLE_PROMPT_CACHING = os.environ.get("ASSISTANT_PROMPT_CACHING", "").lower() in ("1", "true")
 
 Stream = AsyncGenerator[str, None]
 
 
-def _get_function_defs(name: str, validator: PrometheusFunctions):
-    defs_path = Path(__file__).parent / f"{name}-function-defs.json"
+_FUNCTION_DEFS_DIR = Path(__file__).parent
+# Rendered system prompts keyed by function defs name, along with the defs file mtime they were rendered from.
+_rendered_prompts: dict[str, tuple[int, str]] = {}
+
+
+def _parse_function_calls(llm_response_content: str) -> tuple[list, str | None]:
+    # (calls, error) of a response. Calls that aren't valid JSON are answered with an error so the model can fix them.
+    try:
+        fcs = extract_json_tag_content(llm_response_content, FUNCTION_CALLS_TAG)
+    except json.JSONDecodeError as err:
+        return [], f"The function calls aren't valid JSON: {err}"
+    return (as_function_call_list(fcs) if fcs else []), None
+
+
+def _get_function_defs(defs_path: Path) -> str:
     function_defs = json.loads(defs_path.read_text())
     for fn in function_defs:
-        validator.validate_function_def(fn)
+        PrometheusFunctions.validate_function_def(fn)
     return json.dumps(function_defs, indent=2)
 
 
-def get_promql_alerts_rules_assistant_prompt(pf: PrometheusFunctions):
-    function_defs = _get_function_defs("metrics", validator=pf)
+def _render_promql_alerts_rules_assistant_prompt(defs_path: Path) -> str:
+    function_defs = _get_function_defs(defs_path)
     return prompts.PROMQL_ALERTS_RULES_ASSISTANT_PROMPT.format(
         prometheus_functions=function_defs,
         example_function_call=json.dumps(
@@ -71,6 +118,32 @@ def get_promql_alerts_rules_assistant_prompt(pf: PrometheusFunctions):
     )
 
 
+def get_promql_alerts_rules_assistant_prompt() -> str:
+    # Rendered once and shared by all sessions; re-rendered only when the defs file changes on disk.
+    defs_path = _FUNCTION_DEFS_DIR / "metrics-function-defs.json"
+    mtime = defs_path.stat().st_mtime_ns
+    cached = _rendered_prompts.get(defs_path.name)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    _logger.info(f"Rendering system prompt from {defs_path}")
+    prompt = _render_promql_alerts_rules_assistant_prompt(defs_path)
+    _rendered_prompts[defs_path.name] = (mtime, prompt)
+    return prompt
+
+
+async def _with_idle_timeout(chunks: AsyncIterable, seconds: float) -> AsyncGenerator:
+    # Times out each wait for the next chunk, not the whole stream: the time the consumer takes between chunks
+    # (e.g. UI backpressure) doesn't count.
+    iterator = aiter(chunks)
+    while True:
+        try:
+            async with asyncio.timeout(seconds):
+                chunk = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        yield chunk
+
+
 def new_llm_session(*, session_id: str, start_from_recent: bool, on_message_start_cb, on_tag_start_cb: StreamCallback):
     _logger.info(f"Creating new LLM session for {session_id}")
     return LLMSession(
@@ -83,34 +156,68 @@ def new_llm_session(*, session_id: str, start_from_recent: bool, on_message_star
 
 class LLMSession:
     def __init__(
-        self, *, session_id: str, start_from_recent: bool, on_message_start_cb, on_tag_start_cb: StreamCallback
+        self,
+        *,
+        session_id: str,
+        start_from_recent: bool,
+        on_message_start_cb,
+        on_tag_start_cb: StreamCallback,
+        history_store: HistoryStore | None = None,
+        context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+        prompt_caching: bool = ENABLE_PROMPT_CACHING,
+        prometheus: PrometheusFunctions | None = None,
+        completion_fn: Callable | None = None,
+        message_time_budget: float = MESSAGE_TIME_BUDGET_SECONDS,
+        completion_cache: CompletionCache | None = None,
+        bypass_completion_cache: bool | None = None,
     ) -> None:
         self._session_id = session_id
+        self._prompt_caching = prompt_caching and supports_prompt_caching(CURRENT_MODEL)
+        self.prompt_cache_usage = PromptCacheUsage()
+        self._history_store = history_store or get_default_history_store()
+        self._context_compactor = ContextCompactor(model=CURRENT_MODEL, token_budget=context_token_budget)
         self._stream_extractor = StreamTagExtractor(
             on_message_callback=on_message_start_cb,
             on_tag_start_callback=on_tag_start_cb,
+            on_tag_callback=self._on_tag_complete,
+        )
+        self._prometheus = prometheus or PrometheusFunctions()
+        # litellm.acompletion when None, or a stand-in with the same streaming interface (see fake_llm.ScriptedCompletion)
+        self._completion_fn = completion_fn
+        self._message_time_budget = message_time_budget
+        # Completions replayed from disk for the exact same request, when configured (see completion_cache.py)
+        self._completion_cache = completion_cache if completion_cache is not None else get_default_completion_cache()
+        self._bypass_completion_cache = (
+            is_completion_cache_bypassed() if bypass_completion_cache is None else bypass_completion_cache
         )
-        self._prometheus = PrometheusFunctions()
-        self._prometheus.validate_prometheus_readiness()
+        # time.monotonic() deadline of the message being processed, function calls can't run past it
+        self._deadline: float | None = None
+        # Function calls dispatched as soon as their tag closed, while the rest of the response is still streaming.
+        self._speculative_calls: tuple[list[dict], asyncio.Task] | None = None
+        # Off while streaming responses whose function calls won't be run (see _wrap_up)
+        self._speculative_dispatch = True
         self._prepare_message_history(start_from_recent)
+        metrics.ACTIVE_SESSIONS.inc()
+
+    async def close(self) -> None:
+        metrics.ACTIVE_SESSIONS.dec()
+        await self._prometheus.aclose()
 
     def _prepare_message_history(self, start_from_recent: bool):
-        mh_path = Path(".message_history")
-        mh_path.mkdir(parents=True, exist_ok=True)
-        self._message_history_store = mh_path / f"{self._session_id}.json"
-        system_prompt = get_promql_alerts_rules_assistant_prompt(self._prometheus)
-        self._message_history = []
-        self._add_message(SYSTEM_ROLE, system_prompt)
+        system_prompt = get_promql_alerts_rules_assistant_prompt()
+        self._message_history = [{"role": SYSTEM_ROLE, "content": system_prompt}]
         if start_from_recent:
-            self._message_history.extend(self._get_latest_history(mh_path) or [])
-
-    def _get_latest_history(self, mh_path: Path) -> list[dict] | None:
-        history_files = sorted(mh_path.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
-        if not history_files:
-            return
-        fn = history_files[0]
-        messages = json.loads(fn.read_text())
-        _logger.info(f"Loaded {len(messages)} messages from {fn}")
+            # Runs once as the session is created, before any await
+            for message in self._get_latest_history() or []:
+                self._message_history.append({"role": message["role"], "content": message["content"]})
+                self._history_store.append(
+                    session_id=self._session_id, role=message["role"], content=message["content"]
+                )
+
+    def _get_latest_history(self) -> list[dict] | None:
+        messages = self._history_store.get_latest_history(exclude_session_id=self._session_id)
+        if not messages:
+            return None
         while messages and messages[-1]["role"] != USER_ROLE:
             messages.pop()
         return messages
@@ -118,7 +225,7 @@ class LLMSession:
     def get_welcome_message(self) -> str:
         return f"""
         PromeQL Alerts Assistant is ready to help you with your alerts rules.
-        Prometheus is ready at {self._prometheus.get_url()}
+        {self._prometheus.get_status()}
         """
 
     async def resume_from_recent(self):
@@ -132,64 +239,214 @@ class LLMSession:
         await self._process_messages(incoming_message=incoming_message)
 
     async def _process_messages(self, *, incoming_message: str | None) -> None:
-        llm_response_content_buffer = []
-        async for token in self._llm_stream_call(message_content=incoming_message):
-            await self._stream_extractor.handle_token(token)
-            llm_response_content_buffer.append(token)
+        with tracing.trace("process_message", session_id=self._session_id, resumed=incoming_message is None):
+            await self._run_tool_loop(incoming_message=incoming_message)
 
-        llm_response_content = "".join(llm_response_content_buffer)
+    async def _run_tool_loop(self, *, incoming_message: str | None) -> None:
+        self._deadline = time.monotonic() + self._message_time_budget
         remaining_calls = MAX_FUNCTION_CALLS_PER_MESSAGE
-        while remaining_calls > 0:
-            fcs = extract_json_tag_content(llm_response_content, "function_calls")
-            if not fcs:
-                _logger.info(f"No function calls found in the response: {llm_response_content}")
-                break
-            api_responses = self.call_apis(fcs)
-            _logger.info(
-                f"API {fcs} - {api_responses[:50]}... ({len(api_responses)}) - remaining calls: {remaining_calls}",
-            )
-            if not api_responses:
-                break
-            remaining_calls -= 1
-            llm_response_content_buffer.clear()
-            async for token in self._llm_stream_call(message_content=api_responses):
+        try:
+            llm_response_content = await self._stream_llm_response(message_content=incoming_message)
+            while True:
+                fcs, parse_error = _parse_function_calls(llm_response_content)
+                if not fcs and parse_error is None:
+                    self._cancel_speculative_calls()
+                    _logger.info(f"No function calls found in the response: {llm_response_content}")
+                    break
+                if remaining_calls == 0 or time.monotonic() >= self._deadline:
+                    await self._wrap_up(fcs, reason="call_limit" if remaining_calls == 0 else "time")
+                    break
+                if parse_error is not None:
+                    self._cancel_speculative_calls()
+                    _logger.warning(f"Invalid function calls in the response: {parse_error}")
+                    api_responses = format_function_results([function_error(None, "invalid_json", parse_error)])
+                else:
+                    api_responses = await self._get_api_responses(fcs)
+                _logger.info(
+                    f"API {fcs} - {api_responses[:50]}... ({len(api_responses)}) - remaining calls: {remaining_calls}",
+                )
+                if not api_responses:
+                    break
+                remaining_calls -= 1
+                # Once the limit is reached, the calls of the next response won't be run, see _wrap_up
+                self._speculative_dispatch = remaining_calls > 0
+                llm_response_content = await self._stream_llm_response(message_content=api_responses)
+        finally:
+            # Also for messages that failed or were cancelled midway
+            metrics.TOOL_ROUNDS_PER_MESSAGE.observe(MAX_FUNCTION_CALLS_PER_MESSAGE - remaining_calls)
+            self._deadline = None
+            self._speculative_dispatch = True
+
+    async def _wrap_up(self, fcs: list, *, reason: str) -> None:
+        # The calls of the last response are answered with an error asking for a final answer. Whatever that answer
+        # calls isn't run.
+        self._cancel_speculative_calls()
+        _logger.warning(f"Not running function calls {fcs}: {_BUDGET_EXHAUSTED_MESSAGES[reason]}")
+        metrics.TOOL_LOOP_BUDGET_EXHAUSTED.labels(reason).inc()
+        message = _BUDGET_EXHAUSTED_MESSAGES[reason] + _BUDGET_EXHAUSTED_INSTRUCTION
+        # Calls that couldn't be parsed still get an answer
+        errors = [function_error(get_function_call_name(fc), "budget_exhausted", message) for fc in fcs] or [
+            function_error(None, "budget_exhausted", message)
+        ]
+        self._speculative_dispatch = False
+        await self._stream_llm_response(message_content=format_function_results(errors))
+        self._cancel_speculative_calls()
+
+    async def _stream_llm_response(self, *, message_content: str | None) -> str:
+        llm_response_content_buffer = []
+        started_at = time.perf_counter()
+        extraction_seconds = 0.0
+        try:
+            async for token in self._llm_stream_call(message_content=message_content):
+                extraction_started_at = time.perf_counter()
                 await self._stream_extractor.handle_token(token)
+                extraction_seconds += time.perf_counter() - extraction_started_at
                 llm_response_content_buffer.append(token)
-            llm_response_content = "".join(llm_response_content_buffer)
-        if remaining_calls == 0:
-            raise Exception("Exceeded maximum function calls per message")
+        except BaseException:
+            self._cancel_speculative_calls()
+            raise
+        # Spread over the whole response, so it's recorded as one span covering all of its tokens.
+        tracing.record_span(
+            "tag_extraction", start=started_at, duration=extraction_seconds, tokens=len(llm_response_content_buffer)
+        )
+        return "".join(llm_response_content_buffer)
+
+    def _on_tag_complete(self, tag_name: str, tag_content: str) -> None:
+        # Only the first function_calls tag of a response is executed, same as extract_json_tag_content.
+        if tag_name != FUNCTION_CALLS_TAG or self._speculative_calls is not None or not self._speculative_dispatch:
+            return
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            # These calls won't be run, see _wrap_up
+            return
+        fcs, _ = _parse_function_calls(tag_content)
+        if not fcs:
+            return
+        _logger.debug(f"Dispatching function calls before the response is complete: {fcs}")
+        task = asyncio.create_task(self.call_apis(fcs))
+        # The result may never be awaited if the calls get cancelled; don't let a failure go unretrieved.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._speculative_calls = (fcs, task)
+
+    def _cancel_speculative_calls(self) -> None:
+        if self._speculative_calls is None:
+            return
+        _, task = self._speculative_calls
+        task.cancel()
+        self._speculative_calls = None
+
+    async def _get_api_responses(self, fcs: list[dict]) -> str:
+        speculative_calls, self._speculative_calls = self._speculative_calls, None
+        with tracing.span("tool_round", calls=len(fcs)) as attributes:
+            if speculative_calls is not None:
+                speculative_fcs, task = speculative_calls
+                if speculative_fcs == fcs:
+                    attributes["speculative"] = True
+                    return await task
+                _logger.warning(f"Speculative function calls {speculative_fcs} don't match the response, discarding")
+                task.cancel()
+            return await self.call_apis(fcs)
 
     async def _llm_stream_call(self, message_content: str) -> Stream:
         if message_content:
             _logger.info(f"LLM call: {message_content[:400]}")
-            self._add_message(role=USER_ROLE, content=message_content)
-        response = await litellm.acompletion(
-            model=CURRENT_MODEL,
-            supports_system_message=SUPPORT_SYSTEM_MESSAGE,
-            messages=deepcopy(self._message_history),  # litellm will modify this list, so we need to pass a copy
-            stream=True,
-            temperature=DEFAULT_TEMPERATURE,
-            max_tokens=1000,
-        )
+            await self._add_message(role=USER_ROLE, content=message_content)
+        metrics.SESSION_HISTORY_MESSAGES.observe(len(self._message_history))
+        messages = self._context_compactor.compact(self._message_history)
+        if self._prompt_caching:
+            messages = apply_prompt_caching(messages, merge_system_message=not SUPPORT_SYSTEM_MESSAGE)
+        cache_key = cached_tokens = None
+        if self._completion_cache is not None:
+            cache_key = completion_cache_key(
+                model=CURRENT_MODEL, temperature=DEFAULT_TEMPERATURE, max_tokens=MAX_TOKENS, messages=messages
+            )
+            if not self._bypass_completion_cache:
+                cached_tokens = self._completion_cache.get(cache_key)
+        if cached_tokens is not None:
+            tokens = self._replay_completion(cached_tokens)
+        else:
+            tokens = self._stream_completion(messages)
         response_buffer: list[str] = []
-        async for chunk in response:
-            if token := chunk.choices[0].delta.content or "":
-                response_buffer.append(token)
-                yield token
+        async for token in tokens:
+            response_buffer.append(token)
+            yield token
+        if cache_key is not None and cached_tokens is None and response_buffer:
+            self._completion_cache.put(cache_key, response_buffer, model=CURRENT_MODEL)
 
         response_content = "".join(response_buffer)
         _logger.debug(f"LLM response: {response_content}")
-        self._add_message(role=ASSISTANT_ROLE, content=response_content)
+        await self._add_message(role=ASSISTANT_ROLE, content=response_content)
+
+    async def _replay_completion(self, tokens: list[str]) -> Stream:
+        # Same tokens as the original stream, without the wait
+        started_at = time.perf_counter()
+        for token in tokens:
+            yield token
+            await asyncio.sleep(0)
+        tracing.record_span(
+            "llm.cache_hit", start=started_at, duration=time.perf_counter() - started_at, tokens=len(tokens)
+        )
+
+    async def _stream_completion(self, messages: list[dict]) -> Stream:
+        started_at = time.perf_counter()
+        first_token_at = None
+        token_count = 0
+        completion_fn = self._completion_fn or get_litellm().acompletion
+        async with asyncio.timeout(LLM_STREAM_IDLE_TIMEOUT_SECONDS):
+            response = await completion_fn(
+                model=CURRENT_MODEL,
+                supports_system_message=SUPPORT_SYSTEM_MESSAGE,
+                # litellm will modify this list, so we need to pass a copy
+                messages=deepcopy(messages),
+                stream=True,
+                stream_options={"include_usage": True},
+                temperature=DEFAULT_TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+            )
+        async for chunk in _with_idle_timeout(response, LLM_STREAM_IDLE_TIMEOUT_SECONDS):
+            if usage := getattr(chunk, "usage", None):
+                self._record_usage(usage)
+            if not chunk.choices:
+                continue
+            if token := chunk.choices[0].delta.content or "":
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    metrics.LLM_TIME_TO_FIRST_TOKEN.labels(CURRENT_MODEL).observe(first_token_at - started_at)
+                token_count += 1
+                yield token
+        self._record_stream_timings(started_at, first_token_at, token_count)
+
+    def _record_stream_timings(self, started_at: float, first_token_at: float | None, token_count: int) -> None:
+        finished_at = time.perf_counter()
+        metrics.LLM_STREAM_DURATION.labels(CURRENT_MODEL).observe(finished_at - started_at)
+        tracing.record_span(
+            "llm.stream",
+            start=started_at,
+            duration=finished_at - started_at,
+            model=CURRENT_MODEL,
+            tokens=token_count,
+            ttft_ms=None if first_token_at is None else round((first_token_at - started_at) * 1000, 3),
+        )
+        # Chunks are counted as tokens, providers stream about one token per chunk.
+        if first_token_at is not None and token_count > 1 and finished_at > first_token_at:
+            metrics.LLM_TOKENS_PER_SECOND.labels(CURRENT_MODEL).observe(
+                (token_count - 1) / (finished_at - first_token_at)
+            )
+
+    def _record_usage(self, usage) -> None:
+        call_usage = PromptCacheUsage.from_usage(usage)
+        self.prompt_cache_usage.add(call_usage)
+        _logger.info(
+            f"LLM usage: {call_usage.input_tokens} input tokens, {call_usage.cache_read_tokens} read from cache, "
+            f"{call_usage.cache_write_tokens} written to cache",
+        )
 
-    def call_apis(self, fcs: list[dict]) -> str:
+    async def call_apis(self, fcs: list[dict]) -> str:
         # TODO: based on the session type (promql/alerts), using the right tool call
-        # TODO: all of this needs to be async, probably.
-        # TODO: handle errors
-        return self._prometheus.call_prometheus_functions(fcs)
+        # Failed calls come back as error entries in the results, see PrometheusFunctions.call_prometheus_functions
+        return await self._prometheus.call_prometheus_functions(fcs, deadline=self._deadline)
 
-    def _add_message(self, role: str, content: str):
+    async def _add_message(self, role: str, content: str):
         self._message_history.append({"role": role, "content": content})
-        # Don't store the system prompt in the message history
-        msgs_to_save = self._message_history[1:]
-        if msgs_to_save:
-            self._message_history_store.write_text(json.dumps(msgs_to_save, indent=2))
+        with tracing.span("history.append", role=role):
+            # Blocking sqlite write, off the event loop
+            await asyncio.to_thread(self._history_store.append, session_id=self._session_id, role=role, content=content)
@@ -0,0 +1,261 @@
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from assistant.logic import llm
+from assistant.logic.completion_cache import CompletionCache
+from assistant.logic.fake_llm import ScriptedCompletion, _completion_chunk
+from assistant.logic.helpers import extract_json_tag_content
+from assistant.logic.history import SQLiteHistoryStore
+
+
+class CountingCompletion(ScriptedCompletion):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(metric_names=["http_requests_total"], time_to_first_token=0, tokens_per_sec=10000, **kwargs)
+        self.calls = 0
+
+    async def __call__(self, **kwargs):
+        self.calls += 1
+        return await super().__call__(**kwargs)
+
+
+@pytest.fixture
+def prometheus_requests() -> list[httpx.Request]:
+    return []
+
+
+@pytest.fixture
+def recording_prometheus(prometheus_requests):
+    def handler(request: httpx.Request) -> httpx.Response:
+        prometheus_requests.append(request)
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+
+    return handler
+
+
+@pytest_asyncio.fixture
+async def prometheus_functions(mock_prometheus_functions, recording_prometheus):
+    return await mock_prometheus_functions(recording_prometheus, health_checks=False)
+
+
+@pytest_asyncio.fixture
+async def uncached_prometheus_functions(mock_prometheus_functions, recording_prometheus):
+    # Without the shared response cache and single flight, every call the session makes reaches Prometheus
+    return await mock_prometheus_functions(recording_prometheus, health_checks=False, cache=None, single_flight=None)
+
+
+async def _drain(*args) -> None:
+    async for _ in args[-1]:
+        pass
+
+
+def _session(tmp_path, prometheus_functions, completion, **kwargs) -> llm.LLMSession:
+    return llm.LLMSession(
+        session_id="s1",
+        start_from_recent=False,
+        on_message_start_cb=_drain,
+        on_tag_start_cb=_drain,
+        history_store=SQLiteHistoryStore(tmp_path / "history.sqlite3"),
+        prometheus=prometheus_functions,
+        completion_fn=completion,
+        **kwargs,
+    )
+
+
+def _last_function_results(session: llm.LLMSession) -> list[dict]:
+    user_messages = [m["content"] for m in session._message_history if m["role"] == llm.USER_ROLE]
+    return extract_json_tag_content(user_messages[-1], "function_results")
+
+
+@pytest.mark.asyncio
+async def test_call_limit_ends_with_a_final_answer_round(prometheus_functions, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(llm, "MAX_FUNCTION_CALLS_PER_MESSAGE", 2)
+    completion = CountingCompletion(tool_rounds=10)
+    session = _session(tmp_path, prometheus_functions, completion)
+    dispatched = 0
+    call_apis = session.call_apis
+
+    async def counting_call_apis(fcs: list[dict]) -> str:
+        nonlocal dispatched
+        dispatched += 1
+        return await call_apis(fcs)
+
+    monkeypatch.setattr(session, "call_apis", counting_call_apis)
+
+    await session.process_message(incoming_message="alert on errors")
+    await session._stream_extractor.wait_for_tasks()
+    await session.close()
+
+    # The first response, 2 rounds of function results, then the calls that weren't run
+    assert completion.calls == 4
+    # The final answer round still calls functions, they aren't dispatched while it streams either
+    assert dispatched == 2
+    errors = _last_function_results(session)
+    assert {e["error"]["type"] for e in errors} == {"budget_exhausted"}
+    assert "function call rounds" in errors[0]["error"]["message"]
+
+
+@pytest.mark.asyncio
+async def test_time_budget_skips_function_calls(prometheus_functions, prometheus_requests, tmp_path) -> None:
+    completion = CountingCompletion(tool_rounds=10)
+    session = _session(tmp_path, prometheus_functions, completion, message_time_budget=0)
+
+    await session.process_message(incoming_message="alert on errors")
+    await session._stream_extractor.wait_for_tasks()
+    await session.close()
+
+    assert completion.calls == 2
+    errors = _last_function_results(session)
+    assert "time budget" in errors[0]["error"]["message"]
+    assert not [r for r in prometheus_requests if r.url.path != "/api/v1/query"]
+
+
+@pytest.mark.asyncio
+async def test_completion_cache_replays_identical_requests(prometheus_functions, tmp_path) -> None:
+    cache = CompletionCache(tmp_path / "completions")
+    completion = CountingCompletion(tool_rounds=1)
+
+    async def run(**kwargs) -> llm.LLMSession:
+        session = _session(tmp_path, prometheus_functions, completion, completion_cache=cache, **kwargs)
+        await session.process_message(incoming_message="alert on errors")
+        await session._stream_extractor.wait_for_tasks()
+        await session.close()
+        return session
+
+    first = await run()
+    assert completion.calls == 2
+    assert cache.stats.writes == 2
+
+    replayed = await run()
+    assert completion.calls == 2
+    assert cache.stats.hits == 2
+    assert replayed._message_history == first._message_history
+
+    await run(bypass_completion_cache=True)
+    assert completion.calls == 4
+
+
+async def _chunks(gaps: list[float]):
+    for i, gap in enumerate(gaps):
+        await asyncio.sleep(gap)
+        yield i
+
+
+@pytest.mark.asyncio
+async def test_idle_timeout_is_per_chunk() -> None:
+    # A slow consumer doesn't count against the timeout, only waiting for the next chunk does
+    received = []
+    async for chunk in llm._with_idle_timeout(_chunks([0.01] * 5), 0.05):
+        received.append(chunk)
+        await asyncio.sleep(0.03)
+    assert received == [0, 1, 2, 3, 4]
+
+    with pytest.raises(TimeoutError):
+        async for _ in llm._with_idle_timeout(_chunks([0.01, 0.2]), 0.05):
+            pass
+
+
+def _queries(requests: list[httpx.Request]) -> list[str]:
+    return [r.url.params["query"] for r in requests if r.url.path == "/api/v1/query"]
+
+
+@pytest.mark.asyncio
+async def test_speculative_results_are_reused(uncached_prometheus_functions, prometheus_requests, tmp_path) -> None:
+    completion = CountingCompletion(tool_rounds=1)
+    session = _session(tmp_path, uncached_prometheus_functions, completion)
+
+    await session.process_message(incoming_message="alert on errors")
+    await session._stream_extractor.wait_for_tasks()
+    await session.close()
+
+    # Dispatched while the response streamed, then used as the round's results instead of calling again
+    assert prometheus_requests
+    assert len({str(r.url) for r in prometheus_requests}) == len(prometheus_requests)
+    assert _queries(prometheus_requests) == ["sum by (job) (rate(http_requests_total[5m]))"]
+
+
+@pytest.mark.asyncio
+async def test_mismatched_speculative_calls_are_discarded(
+    uncached_prometheus_functions, prometheus_requests, tmp_path
+) -> None:
+    session = _session(tmp_path, uncached_prometheus_functions, CountingCompletion(tool_rounds=0))
+    session._on_tag_complete(
+        llm.FUNCTION_CALLS_TAG, '<function_calls>[{"name": "query", "arguments": {"query": "up"}}]</function_calls>'
+    )
+    _, speculative_task = session._speculative_calls
+
+    results = await session._get_api_responses([{"name": "query", "arguments": {"query": "down"}}])
+    await session.close()
+
+    assert speculative_task.cancelled()
+    assert _queries(prometheus_requests) == ["down"]
+    assert extract_json_tag_content(results, "function_results")[0]["status"] == "success"
+
+
+@pytest.mark.asyncio
+async def test_failed_stream_cancels_speculative_calls(mock_prometheus_functions, tmp_path) -> None:
+    requests: list[httpx.Request] = []
+    cancelled: list[httpx.Request] = []
+
+    async def hanging_prometheus(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(request)
+            raise
+
+    async def failing_completion(**_kwargs):
+        async def stream():
+            calls = '[{"name": "query", "arguments": {"query": "up"}}]'
+            yield _completion_chunk(f"<function_calls>{calls}</function_calls>")
+            # Long enough for the speculative calls to reach Prometheus
+            await asyncio.sleep(0.05)
+            raise ConnectionError("stream interrupted")
+
+        return stream()
+
+    prometheus_functions = await mock_prometheus_functions(
+        hanging_prometheus, health_checks=False, cache=None, single_flight=None
+    )
+    session = _session(tmp_path, prometheus_functions, failing_completion)
+
+    with pytest.raises(ConnectionError):
+        await session.process_message(incoming_message="alert on errors")
+    await asyncio.sleep(0)
+    await session.close()
+
+    assert _queries(requests) == ["up"]
+    assert cancelled == requests
+    assert session._speculative_calls is None
+
+
+@pytest.mark.asyncio
+async def test_invalid_function_calls_json_is_answered_with_an_error(prometheus_functions, tmp_path) -> None:
+    responses = iter(['<function_calls>[{"name": "query",</function_calls>', "Fixed, no calls needed."])
+    calls = 0
+
+    async def completion(**_kwargs):
+        nonlocal calls
+        calls += 1
+        content = next(responses)
+
+        async def stream():
+            yield _completion_chunk(content)
+
+        return stream()
+
+    session = _session(tmp_path, prometheus_functions, completion)
+
+    await session.process_message(incoming_message="alert on errors")
+    await session._stream_extractor.wait_for_tasks()
+    await session.close()
+
+    # The model is told about the bad JSON, and its next answer ends the turn
+    assert calls == 2
+    [error] = _last_function_results(session)
+    assert error["error"]["function"] is None
+    assert error["error"]["type"] == "invalid_json"
+    assert session._message_history[-1]["content"] == "Fixed, no calls needed."
@@ -0,0 +1,74 @@
+import logging
+from dataclasses import dataclass
+
+from .lazy_imports import get_litellm
+
+_logger = logging.getLogger(__name__)
+
+# https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+CACHE_CONTROL = {"type": "ephemeral"}
+# Anthropic allows 4 breakpoints per request: one goes to the system prompt, and the last two user messages mark the
+# history prefix written by the previous round (read now) and the one this round writes (read by the next round).
+HISTORY_BREAKPOINTS = 2
+
+
+def supports_prompt_caching(model: str) -> bool:
+    try:
+        return get_litellm().utils.supports_prompt_caching(model=model)
+    except Exception:
+        _logger.debug(f"Unknown prompt caching support for {model}", exc_info=True)
+        return False
+
+
+def _text_block(text: str, *, cache: bool = False) -> dict:
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = CACHE_CONTROL
+    return block
+
+
+def _as_blocks(content: str | list[dict]) -> list[dict]:
+    if isinstance(content, list):
+        return [dict(block) for block in content]
+    return [_text_block(content)]
+
+
+def apply_prompt_caching(messages: list[dict], *, merge_system_message: bool) -> list[dict]:
+    marked = [dict(m) for m in messages]
+    if merge_system_message and len(marked) > 1 and marked[0]["role"] == "system":
+        # Same merge litellm does for supports_system_message=False, but keeping the system prompt as its own block
+        # so it can carry a breakpoint.
+        system = marked.pop(0)
+        marked[0]["content"] = [_text_block(system["content"], cache=True), *_as_blocks(marked[0]["content"])]
+    elif marked and marked[0]["role"] == "system":
+        marked[0]["content"] = [_text_block(marked[0]["content"], cache=True)]
+
+    user_indices = [i for i, m in enumerate(marked) if m["role"] == "user"]
+    for i in user_indices[-HISTORY_BREAKPOINTS:]:
+        blocks = _as_blocks(marked[i]["content"])
+        blocks[-1]["cache_control"] = CACHE_CONTROL
+        marked[i]["content"] = blocks
+    return marked
+
+
+@dataclass
+class PromptCacheUsage:
+    input_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+
+    @classmethod
+    def from_usage(cls, usage) -> "PromptCacheUsage":
+        cache_read = usage.get("cache_read_input_tokens")
+        if cache_read is None and (details := usage.get("prompt_tokens_details")) is not None:
+            cache_read = details.cached_tokens
+        return cls(
+            input_tokens=usage.get("prompt_tokens") or 0,
+            cache_read_tokens=cache_read or 0,
+            cache_write_tokens=usage.get("cache_creation_input_tokens") or 0,
+        )
+
+    def add(self, other: "PromptCacheUsage") -> None:
+        self.input_tokens += other.input_tokens
+        self.cache_read_tokens += other.cache_read_tokens
+        self.cache_write_tokens += other.cache_write_tokens
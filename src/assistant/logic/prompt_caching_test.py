@@ -0,0 +1,135 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+
+import httpx
+import pytest
+
+from assistant.logic import llm
+from assistant.logic.history import SQLiteHistoryStore
+from assistant.logic.lazy_imports import get_litellm
+from assistant.logic.prompt_caching import CACHE_CONTROL, apply_prompt_caching
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class StubAnthropicHandler(BaseHTTPRequestHandler):
+    requests: ClassVar[list[dict]] = []
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.requests.append(json.loads(body))
+        usage = {"input_tokens": 20, "cache_creation_input_tokens": 1500, "cache_read_input_tokens": 3000}
+        events = [
+            _sse(
+                "message_start",
+                {
+                    "type": "message_start",
+                    "message": {
+                        "id": "msg_stub",
+                        "type": "message",
+                        "role": "assistant",
+                        "content": [],
+                        "model": llm.CLAUDE_MODEL,
+                        "stop_reason": None,
+                        "stop_sequence": None,
+                        "usage": {**usage, "output_tokens": 1},
+                    },
+                },
+            ),
+            _sse(
+                "content_block_start",
+                {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+            ),
+            _sse(
+                "content_block_delta",
+                {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Hello"}},
+            ),
+            _sse("content_block_stop", {"type": "content_block_stop", "index": 0}),
+            _sse(
+                "message_delta",
+                {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 2}},
+            ),
+            _sse("message_stop", {"type": "message_stop"}),
+        ]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for event in events:
+            self.wfile.write(event)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_anthropic(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAnthropicHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubAnthropicHandler.requests = []
+    monkeypatch.setenv("ANTHROPIC_API_BASE", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "stub-key")
+    monkeypatch.setattr(get_litellm(), "success_callback", [])
+    yield StubAnthropicHandler.requests
+    server.shutdown()
+
+
+def _cached_blocks(content) -> list[str]:
+    return [block["text"] for block in content if block.get("cache_control") == CACHE_CONTROL]
+
+
+def test_apply_prompt_caching_marks_system_prompt_and_last_user_messages() -> None:
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "u1"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "u2"},
+        {"role": "assistant", "content": "a2"},
+        {"role": "user", "content": "u3"},
+    ]
+    marked = apply_prompt_caching(messages, merge_system_message=True)
+
+    assert [m["role"] for m in marked] == ["user", "assistant", "user", "assistant", "user"]
+    assert _cached_blocks(marked[0]["content"]) == ["system"]
+    assert _cached_blocks(marked[2]["content"]) == ["u2"]
+    assert _cached_blocks(marked[4]["content"]) == ["u3"]
+    assert marked[1]["content"] == "a1"
+    assert messages[1]["content"] == "u1"
+
+
+@pytest.mark.asyncio
+async def test_llm_session_sends_cache_markers_to_the_model(
+    stub_anthropic, mock_prometheus_functions, tmp_path
+) -> None:
+    async def ignore(*_args) -> None:
+        pass
+
+    def prometheus(_request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+
+    session = llm.LLMSession(
+        session_id="s1",
+        start_from_recent=False,
+        on_message_start_cb=ignore,
+        on_tag_start_cb=ignore,
+        history_store=SQLiteHistoryStore(tmp_path / "history.sqlite3"),
+        prometheus=await mock_prometheus_functions(prometheus),
+        prompt_caching=True,
+    )
+    tokens = [token async for token in session._llm_stream_call(message_content="first question")]
+    tokens += [token async for token in session._llm_stream_call(message_content="second question")]
+    await session.close()
+
+    assert tokens == ["Hello", "Hello"]
+    request = stub_anthropic[-1]
+    first_user_content = request["messages"][0]["content"]
+    assert first_user_content[0]["text"] == llm.get_promql_alerts_rules_assistant_prompt()
+    assert first_user_content[0]["cache_control"] == CACHE_CONTROL
+    assert _cached_blocks(first_user_content)[-1] == "first question"
+    assert _cached_blocks(request["messages"][-1]["content"]) == ["second question"]
+    assert session.prompt_cache_usage.cache_read_tokens == 6000
+    assert session.prompt_cache_usage.cache_write_tokens == 3000
@@ -0,0 +1,126 @@
+from datetime import UTC, datetime
+
+import numpy as np
+
+from .shaping import FUNCTION_LIMITS, SUMMARY_QUANTILES, ShapingLimits
+
+COMPARISONS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+# Samples further apart than this many steps have missing samples (or NaNs) between them, runs don't span the gap
+MAX_CONTIGUOUS_STEPS = 1.5
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _round(value: float) -> float | None:
+    # 6 significant digits is plenty for the model and keeps the JSON short
+    if not np.isfinite(value):
+        return None
+    return float(f"{value:.6g}")
+
+
+def decode_series(values: list) -> tuple[np.ndarray, np.ndarray]:
+    # Prometheus sends [[<unix time>, "<value>"], ...], values are strings ("NaN" and "+Inf" included).
+    timestamps = np.fromiter((t for t, _ in values), dtype=np.float64, count=len(values))
+    samples = np.fromiter((v for _, v in values), dtype=np.float64, count=len(values))
+    return timestamps, samples
+
+
+def _runs(timestamps: np.ndarray, mask: np.ndarray, step: float) -> tuple[np.ndarray, np.ndarray]:
+    # Indices of the first and last sample of each run of matching samples. A gap in the samples ends a run.
+    continued = mask[1:] & mask[:-1] & (np.diff(timestamps) <= step * MAX_CONTIGUOUS_STEPS)
+    starts = mask.copy()
+    starts[1:] &= ~continued
+    ends = mask.copy()
+    ends[:-1] &= ~continued
+    return np.flatnonzero(starts), np.flatnonzero(ends)
+
+
+def _longest_run_seconds(timestamps: np.ndarray, starts: np.ndarray, ends: np.ndarray, step: float) -> float:
+    # Each run of matching samples covers from its first sample to one step after its last one
+    if not len(starts):
+        return 0.0
+    return float(np.max(timestamps[ends] - timestamps[starts]) + step)
+
+
+def summarize_series(
+    timestamps: np.ndarray,
+    samples: np.ndarray,
+    *,
+    step: float,
+    threshold: float | None = None,
+    comparison: str = ">",
+) -> dict:
+    finite = np.isfinite(samples)
+    t, v = timestamps[finite], samples[finite]
+    summary: dict = {"points": len(samples)}
+    if not len(v):
+        return summary
+    summary |= {
+        "min": _round(v.min()),
+        "max": _round(v.max()),
+        "mean": _round(v.mean()),
+        "last": _round(v[-1]),
+    }
+    for q, value in zip(SUMMARY_QUANTILES, np.quantile(v, SUMMARY_QUANTILES), strict=True):
+        summary[f"p{round(q * 100)}"] = _round(value)
+    if len(v) > 1 and t[-1] > t[0]:
+        # Least-squares slope, less sensitive to a single spike than last - first
+        slope = np.polyfit(t - t[0], v, 1)[0]
+        summary["change"] = _round(v[-1] - v[0])
+        summary["trend_per_minute"] = _round(slope * 60)
+    if threshold is not None:
+        mask = COMPARISONS[comparison](v, threshold)
+        starts, ends = _runs(t, mask, step)
+        summary["threshold"] = {
+            "condition": f"{comparison} {threshold}",
+            "points_matching": int(np.count_nonzero(mask)),
+            "fraction_matching": _round(np.count_nonzero(mask) / len(mask)),
+            # How many times the condition went from false (or no data) to true, or started true
+            "times_started": len(starts),
+            "longest_run_seconds": _longest_run_seconds(t, starts, ends, step),
+            "matching_now": bool(mask[-1]),
+        }
+    return summary
+
+
+def summarize_matrix(
+    result: list[dict],
+    *,
+    step: float,
+    threshold: float | None = None,
+    comparison: str = ">",
+    limits: ShapingLimits = FUNCTION_LIMITS["query_range"],
+) -> dict:
+    summaries = []
+    for series in result:
+        timestamps, samples = decode_series(series.get("values", []))
+        summary = summarize_series(timestamps, samples, step=step, threshold=threshold, comparison=comparison)
+        summaries.append({"metric": series.get("metric", {}), **summary})
+    return cap_summaries(summaries, limits)
+
+
+def cap_summaries(summaries: list[dict], limits: ShapingLimits = FUNCTION_LIMITS["query_range"]) -> dict:
+    def rank(summary: dict) -> tuple:
+        # Series that match the threshold the longest first, then by peak value
+        run = summary.get("threshold", {}).get("longest_run_seconds", 0)
+        peak = summary.get("max")
+        return (run, peak if peak is not None else -np.inf)
+
+    summaries = sorted(summaries, key=rank, reverse=True)
+    shaped = {"series": summaries[: limits.max_series]}
+    if len(summaries) > limits.max_series:
+        shaped["truncated"] = {
+            "total_series": len(summaries),
+            "returned_series": limits.max_series,
+            "note": "Only the top series are returned. Narrow the query with label matchers or aggregate it.",
+        }
+    return shaped
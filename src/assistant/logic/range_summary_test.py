@@ -0,0 +1,92 @@
+import pytest
+
+from assistant.integrations.prometheus.client import choose_step, parse_duration
+from assistant.logic.range_summary import decode_series, summarize_matrix, summarize_series
+
+_START = 1700000000
+_STEP = 60
+
+
+def _series(values: list[float | str], pod: str = "pod-0") -> dict:
+    return {"metric": {"pod": pod}, "values": [[_START + i * _STEP, str(v)] for i, v in enumerate(values)]}
+
+
+def test_summary_statistics() -> None:
+    timestamps, samples = decode_series(_series([1, 2, 3, 4, "NaN", 5])["values"])
+
+    summary = summarize_series(timestamps, samples, step=_STEP)
+
+    assert summary["points"] == 6
+    assert summary["min"] == 1.0
+    assert summary["max"] == 5.0
+    assert summary["mean"] == 3.0
+    assert summary["last"] == 5.0
+    assert summary["p50"] == 3.0
+    assert summary["change"] == 4.0
+    assert summary["trend_per_minute"] == pytest.approx(0.81, rel=0.01)
+    assert "threshold" not in summary
+
+
+def test_threshold_runs() -> None:
+    values = [0, 5, 5, 0, 5, 5, 5, 0, 5]
+    timestamps, samples = decode_series(_series(values)["values"])
+
+    condition = summarize_series(timestamps, samples, step=_STEP, threshold=1, comparison=">")["threshold"]
+
+    assert condition == {
+        "condition": "> 1",
+        "points_matching": 6,
+        "fraction_matching": 0.666667,
+        "times_started": 3,
+        "longest_run_seconds": 3 * _STEP,
+        "matching_now": True,
+    }
+
+
+def test_threshold_runs_split_at_gaps() -> None:
+    # Two runs of 3 samples, with 2 samples missing and a NaN between them: not one run of 7 steps
+    values = [[_START + i * _STEP, "5"] for i in (0, 1, 2, 5, 6, 7)]
+    values.insert(3, [_START + 4 * _STEP, "NaN"])
+    timestamps, samples = decode_series(values)
+
+    condition = summarize_series(timestamps, samples, step=_STEP, threshold=1)["threshold"]
+
+    assert condition["times_started"] == 2
+    assert condition["longest_run_seconds"] == 3 * _STEP
+    assert condition["points_matching"] == 6
+
+
+def test_series_without_finite_values() -> None:
+    timestamps, samples = decode_series(_series(["NaN", "NaN"])["values"])
+    assert summarize_series(timestamps, samples, step=_STEP, threshold=1) == {"points": 2}
+
+
+def test_matrix_is_ranked_and_capped() -> None:
+    result = [_series([i, i], pod=f"pod-{i}") for i in range(40)]
+
+    shaped = summarize_matrix(result, step=_STEP)
+
+    assert len(shaped["series"]) == 30
+    assert shaped["series"][0]["metric"] == {"pod": "pod-39"}
+    assert shaped["truncated"]["total_series"] == 40
+
+
+@pytest.mark.parametrize(
+    ("duration", "expected"),
+    [("90s", 90), ("5m", 300), ("1h30m", 5400), ("2d", 172800), ("1w", 604800)],
+)
+def test_parse_duration(duration: str, expected: float) -> None:
+    assert parse_duration(duration) == expected
+
+
+@pytest.mark.parametrize("duration", ["", "1x", "h", "5m ago", "-5m"])
+def test_parse_duration_rejects_invalid(duration: str) -> None:
+    with pytest.raises(ValueError, match="Invalid duration"):
+        parse_duration(duration)
+
+
+def test_choose_step_caps_points() -> None:
+    assert choose_step(3600) == 15
+    assert choose_step(24 * 3600) == 600
+    assert choose_step(7 * 24 * 3600) == 3600
+    assert choose_step(10 * 365 * 86400) == 86400
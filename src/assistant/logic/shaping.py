@@ -0,0 +1,169 @@
+import math
+from dataclasses import dataclass
+
+# Quantiles reported in the summary of a truncated result
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+
+@dataclass(frozen=True)
+class ShapingLimits:
+    max_series: int = 50
+    max_points_per_series: int = 60
+    max_items: int = 200
+
+
+DEFAULT_LIMITS = ShapingLimits()
+FUNCTION_LIMITS = {
+    "query": ShapingLimits(max_series=50),
+    "get_metric_labels": ShapingLimits(max_items=300),
+    "get_metric_label_values": ShapingLimits(max_items=200),
+    "get_metric_metadata": ShapingLimits(max_items=20),
+    # Series are summarized rather than sent as samples, see range_summary.py
+    "query_range": ShapingLimits(max_series=30),
+}
+
+_TRUNCATION_NOTE = (
+    "The result was truncated. Narrow the query with label matchers, aggregate it (e.g. sum by (...)) "
+    "or use topk() to see the rest."
+)
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _quantile(sorted_values: list[float], q: float) -> float:
+    # Nearest-rank quantile, good enough to describe the distribution to the model.
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+def summarize_values(values: list[float]) -> dict:
+    finite = sorted(v for v in values if math.isfinite(v))
+    if not finite:
+        return {"count": len(values)}
+    summary = {
+        "count": len(values),
+        "min": finite[0],
+        "max": finite[-1],
+        "mean": sum(finite) / len(finite),
+    }
+    for q in SUMMARY_QUANTILES:
+        summary[f"p{round(q * 100)}"] = _quantile(finite, q)
+    return summary
+
+
+def _dedupe_series(series: list[dict]) -> list[dict]:
+    seen = set()
+    unique = []
+    for s in series:
+        key = frozenset(s.get("metric", {}).items())
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(s)
+    return unique
+
+
+def _sort_key(value: float) -> float:
+    # NaN sorts last when ordering by value descending
+    return value if not math.isnan(value) else -math.inf
+
+
+def _downsample(values: list, max_points: int) -> list:
+    if len(values) <= max_points:
+        return values
+    stride = len(values) / max_points
+    sampled = [values[int(i * stride)] for i in range(max_points - 1)]
+    sampled.append(values[-1])
+    return sampled
+
+
+def _shape_vector(result: list[dict], limits: ShapingLimits) -> tuple[list[dict], dict | None]:
+    series = _dedupe_series(result)
+    if len(series) <= limits.max_series and len(series) == len(result):
+        return result, None
+    values = [_to_float(s["value"][1]) for s in series]
+    ranked = sorted(zip(series, values, strict=True), key=lambda sv: _sort_key(sv[1]), reverse=True)
+    kept = [s for s, _ in ranked[: limits.max_series]]
+    return kept, {
+        "total_series": len(result),
+        "distinct_label_sets": len(series),
+        "returned_series": len(kept),
+        "order": f"top {len(kept)} by value",
+        "stats": summarize_values(values),
+    }
+
+
+def _shape_matrix(result: list[dict], limits: ShapingLimits) -> tuple[list[dict], dict | None]:
+    series = _dedupe_series(result)
+    too_many_points = any(len(s.get("values", [])) > limits.max_points_per_series for s in series)
+    if len(series) <= limits.max_series and len(series) == len(result) and not too_many_points:
+        return result, None
+    peaks = [max((_to_float(v) for _, v in s.get("values", [])), default=math.nan, key=_sort_key) for s in series]
+    ranked = sorted(zip(series, peaks, strict=True), key=lambda sp: _sort_key(sp[1]), reverse=True)
+    kept = [
+        {**s, "values": _downsample(s.get("values", []), limits.max_points_per_series)}
+        for s, _ in ranked[: limits.max_series]
+    ]
+    return kept, {
+        "total_series": len(result),
+        "distinct_label_sets": len(series),
+        "returned_series": len(kept),
+        "order": f"top {len(kept)} by peak value",
+        "max_points_per_series": limits.max_points_per_series,
+        "stats": summarize_values([_to_float(v) for s in series for _, v in s.get("values", [])]),
+    }
+
+
+def _shape_query_response(response: dict, limits: ShapingLimits) -> dict:
+    data = response.get("data")
+    if not isinstance(data, dict) or not isinstance(data.get("result"), list):
+        return response
+    if data.get("resultType") == "vector":
+        kept, truncation = _shape_vector(data["result"], limits)
+    elif data.get("resultType") == "matrix":
+        kept, truncation = _shape_matrix(data["result"], limits)
+    else:
+        return response
+    if truncation is None:
+        return response
+    return {**response, "data": {**data, "result": kept}, "truncated": {**truncation, "note": _TRUNCATION_NOTE}}
+
+
+def _shape_list(items: list, limits: ShapingLimits) -> list | dict:
+    if len(items) <= limits.max_items:
+        return items
+    return {
+        "values": items[: limits.max_items],
+        "truncated": {"total_items": len(items), "returned_items": limits.max_items, "note": _TRUNCATION_NOTE},
+    }
+
+
+def _shape_metadata(metadata: dict, limits: ShapingLimits) -> dict:
+    # Every target exporting a metric reports its metadata, so the same entry is usually repeated many times.
+    shaped = {}
+    for metric, entries in list(metadata.items())[: limits.max_items]:
+        unique = []
+        for entry in entries:
+            if entry not in unique:
+                unique.append(entry)
+        shaped[metric] = unique
+    if len(metadata) > limits.max_items:
+        shaped["truncated"] = {"total_metrics": len(metadata), "note": _TRUNCATION_NOTE}
+    return shaped
+
+
+def shape_function_result(function_name: str, result):
+    # Never mutates `result`, responses may be shared through the Prometheus response cache.
+    limits = FUNCTION_LIMITS.get(function_name, DEFAULT_LIMITS)
+    if isinstance(result, list):
+        return _shape_list(result, limits)
+    if isinstance(result, dict) and "data" in result:
+        return _shape_query_response(result, limits)
+    if function_name == "get_metric_metadata" and isinstance(result, dict):
+        return _shape_metadata(result, limits)
+    return result
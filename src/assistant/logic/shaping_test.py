@@ -0,0 +1,57 @@
+import copy
+
+from assistant.logic.shaping import FUNCTION_LIMITS, shape_function_result
+
+
+def _vector_response(values: list[float], duplicates: int = 0) -> dict:
+    result = [{"metric": {"pod": f"pod-{i}"}, "value": [1700000000, str(v)]} for i, v in enumerate(values)]
+    result += copy.deepcopy(result[:duplicates])
+    return {"status": "success", "data": {"resultType": "vector", "result": result}}
+
+
+def test_small_results_are_returned_unchanged() -> None:
+    response = _vector_response([1, 2, 3])
+    assert shape_function_result("query", response) is response
+    labels = ["job", "instance"]
+    assert shape_function_result("get_metric_labels", labels) is labels
+
+
+def test_large_vector_is_truncated_to_top_k_with_stats() -> None:
+    max_series = FUNCTION_LIMITS["query"].max_series
+    response = _vector_response([float(v) for v in range(1000)], duplicates=10)
+    original = copy.deepcopy(response)
+
+    shaped = shape_function_result("query", response)
+
+    assert response == original
+    result = shaped["data"]["result"]
+    assert len(result) == max_series
+    assert [float(s["value"][1]) for s in result[:3]] == [999.0, 998.0, 997.0]
+    truncated = shaped["truncated"]
+    assert truncated["total_series"] == 1010
+    assert truncated["distinct_label_sets"] == 1000
+    assert truncated["stats"]["min"] == 0.0
+    assert truncated["stats"]["max"] == 999.0
+    assert truncated["stats"]["mean"] == 499.5
+    assert truncated["stats"]["p50"] == 499.0
+    assert "Narrow the query" in truncated["note"]
+
+
+def test_matrix_series_are_downsampled() -> None:
+    max_points = FUNCTION_LIMITS["query"].max_points_per_series
+    values = [[1700000000 + i, str(i)] for i in range(1000)]
+    response = {"status": "success", "data": {"resultType": "matrix", "result": [{"metric": {}, "values": values}]}}
+
+    shaped = shape_function_result("query", response)
+
+    kept = shaped["data"]["result"][0]["values"]
+    assert len(kept) == max_points
+    assert kept[0] == values[0]
+    assert kept[-1] == values[-1]
+
+
+def test_long_label_values_list_is_truncated() -> None:
+    max_items = FUNCTION_LIMITS["get_metric_label_values"].max_items
+    shaped = shape_function_result("get_metric_label_values", [f"v{i}" for i in range(max_items + 5)])
+    assert len(shaped["values"]) == max_items
+    assert shaped["truncated"]["total_items"] == max_items + 5
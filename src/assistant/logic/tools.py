@@ -1,45 +1,432 @@
+import asyncio
+import functools
 import json
 import logging
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import ClassVar
 
+import httpx
 from httpx import HTTPError
 
-from assistant.integrations.prometheus import PrometheusClient
+from assistant.integrations.prometheus import (
+    PROMETHEUS_RESPONSE_CACHE,
+    PROMETHEUS_SINGLE_FLIGHT,
+    PrometheusClient,
+    ResponseCache,
+    SingleFlight,
+)
+from assistant.integrations.prometheus.backends import get_backend_registry
+from assistant.integrations.prometheus.client import choose_step, parse_duration, range_bounds
+from assistant.integrations.prometheus.health import (
+    PrometheusHealthChecker,
+    PrometheusUnavailableError,
+    close_health_checkers,
+    get_health_checker,
+    is_unavailability_error,
+)
+from assistant.telemetry import metrics, tracing
+
+from .backtest import backtest
+from .fanout import merge_backend_results
+from .range_summary import COMPARISONS, format_time, summarize_matrix
+from .shaping import shape_function_result
 
 _logger = logging.getLogger(__name__)
 
+DEFAULT_PROMETHEUS_PORT = 9095
+# Per call, and per backend when a call fans out to several so a slow one only loses its own part of the result.
+DEFAULT_FUNCTION_TIMEOUT_SECONDS = 20
+FUNCTION_TIMEOUTS = {
+    "query": 30,
+    "query_range": 60,
+    "backtest_alert": 60,
+    # The first search loads the whole metric catalog
+    "search_metrics": 30,
+}
+# Metrics label of calls to functions that don't exist, the names come from the model
+UNKNOWN_FUNCTION_LABEL = "unknown"
+# Function call argument naming the backends to call, "all" for every one of them
+BACKENDS_ARGUMENT = "backends"
+ALL_BACKENDS = "all"
+# Backtests evaluate at a finer step than query_range summaries, so `for:` durations of a few minutes are honored.
+BACKTEST_MAX_POINTS = 1500
+MAX_BACKTEST_THRESHOLDS = 10
+
+
+def _get_base_url(port: int) -> str:
+    return f"http://localhost:{port}"
+
+
+def function_error(function_name: str | None, error_type: str, message: str) -> dict:
+    # What a failed call returns in <function_results>, so the model can fix its call or work around it
+    return {"error": {"function": function_name, "type": error_type, "message": message}}
+
+
+def as_function_call_list(function_calls) -> list:
+    # <function_calls> holds a list of calls, but models sometimes send a single call object
+    return function_calls if isinstance(function_calls, list) else [function_calls]
+
+
+def get_function_call_name(function_call) -> str | None:
+    # Calls come from the model, they may not even be objects
+    name = function_call.get("name") if isinstance(function_call, dict) else None
+    return name if isinstance(name, str) else None
+
+
+def format_function_results(responses: list) -> str:
+    return f"<function_results>{json.dumps(responses)}</function_results>"
+
+
+def _describe_error(err: Exception) -> tuple[str, str]:
+    # (type, message) of a failed call
+    if isinstance(err, TimeoutError):
+        return "timeout", str(err) or "Timed out"
+    if isinstance(err, PrometheusUnavailableError):
+        return "unavailable", str(err)
+    if isinstance(err, httpx.HTTPStatusError) and err.response.status_code < 500:
+        # Prometheus explains bad queries, e.g. {"status": "error", "errorType": "bad_data", "error": "parse error..."}
+        try:
+            message = err.response.json().get("error") or err.response.text
+        except ValueError:
+            message = err.response.text
+        return "bad_request", message
+    if isinstance(err, HTTPError):
+        return "unavailable", f"{type(err).__name__}: {err}"
+    if isinstance(err, (TypeError, ValueError, KeyError, AttributeError)):
+        return "invalid_arguments", f"{type(err).__name__}: {err}"
+    return "internal", f"{type(err).__name__}: {err}"
+
+
+def start_health_checks() -> None:
+    for base_url in get_backend_registry().backends.values():
+        get_health_checker(base_url).ensure_started()
+
+
+async def stop_health_checks() -> None:
+    await close_health_checkers()
+
+
+async def retry_unavailable_backends() -> None:
+    # Port forwards that failed are tried again as sessions start (at most once per retry interval), so a cluster
+    # that was unreachable at startup becomes usable for the sessions that follow.
+    registry = get_backend_registry()
+    if not registry.unavailable:
+        return
+    await registry.retry_unavailable()
+    start_health_checks()
+
+
+@dataclass
+class _Backend:
+    name: str
+    base_url: str
+    client: PrometheusClient
+    health_checker: PrometheusHealthChecker
+
 
 class PrometheusFunctions:
-    def __init__(self, port: int = 9095) -> None:
-        self._base_url = f"http://localhost:{port}"
-        self._client = PrometheusClient(base_url=self._base_url)
-
-    def get_url(self) -> str:
-        return self._base_url
-
-    def validate_function_def(self, function_name: str) -> None:
-        # Will raise an error if the function is not found
-        getattr(self._client, function_name)
-
-    def call_prometheus_functions(self, function_calls: list[dict]) -> str:
-        responses = []
-        for function_call in function_calls:
-            response = self._call_prometheus_function(function_call)
-            responses.append(response)
-        return f"<function_results>{json.dumps(responses)}</function_results>"
-
-    def _call_prometheus_function(self, function_call: dict) -> dict | list:
-        function_name = function_call["name"]
-        arguments = function_call["arguments"]
-        func = getattr(self._client, function_name)
-        _logger.debug(f"Calling prometheus'{function_name}' w/ {arguments}")
-        response = func(**arguments)
-        _logger.debug(f"Prometheus function {function_name} returned {response}")
-        return response
+    # Functions implemented here on top of the client rather than passed through to it
+    _TOOLS: ClassVar[frozenset[str]] = frozenset({"query_range", "backtest_alert", "list_backends"})
+    # Client methods the model may call. Anything else on the client (aclose, ...) isn't a function.
+    _CLIENT_FUNCTIONS: ClassVar[frozenset[str]] = frozenset(
+        {
+            "query",
+            "get_metric_labels",
+            "get_metric_label_values",
+            "get_metric_metadata",
+            "search_metrics",
+            "get_alerts",
+            "get_alert_query",
+            "get_alert_queries",
+        }
+    )
+
+    def __init__(
+        self,
+        port: int | None = None,
+        *,
+        backends: Mapping[str, str] | None = None,
+        unavailable_backends: Mapping[str, str] | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+        health_checker: PrometheusHealthChecker | None = None,
+        function_timeouts: Mapping[str, float] = FUNCTION_TIMEOUTS,
+        cache: ResponseCache | None = PROMETHEUS_RESPONSE_CACHE,
+        single_flight: SingleFlight | None = PROMETHEUS_SINGLE_FLIGHT,
+    ) -> None:
+        self._function_timeouts = function_timeouts
+        # Backends by name -> base URL. Without them, a single one on `port`, or the configured backend registry.
+        # Unavailable backends (name -> reason) can't be queried, calls naming them get an error.
+        if backends is None and port is not None:
+            backends = {"default": _get_base_url(port)}
+        elif backends is None:
+            registry = get_backend_registry()
+            backends, unavailable_backends = registry.backends, registry.unavailable
+        self._unavailable_backends = dict(unavailable_backends or {})
+        self._backends = {
+            name: _Backend(
+                name=name,
+                base_url=base_url,
+                client=PrometheusClient(
+                    base_url=base_url, transport=transport, cache=cache, single_flight=single_flight
+                ),
+                health_checker=health_checker or get_health_checker(base_url),
+            )
+            for name, base_url in backends.items()
+        }
+        # None when no backend can be reached, e.g. every port forward failed: calls then fail one by one
+        self._default_backend = next(iter(self._backends.values()), None)
+        for backend in self._backends.values():
+            backend.health_checker.ensure_started()
+
+    def get_url(self) -> str | None:
+        return self._default_backend.base_url if self._default_backend is not None else None
+
+    def _unavailable_error(self, names: list[str]) -> PrometheusUnavailableError:
+        reasons = "; ".join(f"{n}: {self._unavailable_backends[n]}" for n in names)
+        return PrometheusUnavailableError(f"Prometheus backends unavailable ({reasons})")
+
+    @staticmethod
+    def _get_backend_status(backend: _Backend) -> str:
+        checker = backend.health_checker
+        if checker.last_checked_at is None:
+            return f"Prometheus at {backend.base_url} is being checked"
+        if checker.is_healthy:
+            return f"Prometheus is ready at {backend.base_url}"
+        return f"Prometheus at {backend.base_url} is not reachable: {checker.last_error}"
+
+    def get_status(self) -> str:
+        if len(self._backends) == 1 and not self._unavailable_backends:
+            return self._get_backend_status(self._default_backend)
+        return "\n".join(
+            [f"{b.name}: {self._get_backend_status(b)}" for b in self._backends.values()]
+            + [f"{name}: Prometheus is unavailable: {reason}" for name, reason in self._unavailable_backends.items()]
+        )
+
+    @classmethod
+    def is_function(cls, function_name) -> bool:
+        # Names come from the model, they may be anything
+        return isinstance(function_name, str) and (
+            function_name in cls._TOOLS or function_name in cls._CLIENT_FUNCTIONS
+        )
+
+    @classmethod
+    def validate_function_def(cls, function_name: str) -> None:
+        if not cls.is_function(function_name):
+            raise ValueError(f"Unknown Prometheus function {function_name!r}")
+
+    async def call_prometheus_functions(
+        self, function_calls: list[dict] | dict, *, deadline: float | None = None
+    ) -> str:
+        # Calls in a batch are independent, so run them concurrently. gather() keeps the results in call order.
+        # A call that fails or runs past its timeout (or the time.monotonic() `deadline`), or isn't a valid call,
+        # returns an error entry, the other results are still returned.
+        responses = await asyncio.gather(
+            *(self._call_prometheus_function(fc, deadline) for fc in as_function_call_list(function_calls))
+        )
+        return format_function_results(responses)
+
+    def _get_function_timeout(self, function_name: str) -> float:
+        return self._function_timeouts.get(function_name, DEFAULT_FUNCTION_TIMEOUT_SECONDS)
+
+    def _get_timeout(self, function_name: str, deadline: float | None) -> float:
+        timeout = self._get_function_timeout(function_name)
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+        return timeout
+
+    def _resolve_backends(self, names: str | list[str] | None) -> tuple[list[_Backend], list[str]] | None:
+        # (backends to call, unavailable ones), None when the call doesn't name any backend: it then goes to the
+        # default one and isn't fanned out
+        if names is None:
+            return None
+        names = [names] if isinstance(names, str) else names
+        if ALL_BACKENDS in names:
+            return list(self._backends.values()), list(self._unavailable_backends)
+        unknown = [n for n in names if n not in self._backends and n not in self._unavailable_backends]
+        if unknown:
+            known = [*self._backends, *self._unavailable_backends]
+            raise ValueError(f"Unknown Prometheus backends {unknown}, available: {', '.join(known)}")
+        names = list(dict.fromkeys(names))
+        return (
+            [self._backends[n] for n in names if n in self._backends],
+            [n for n in names if n in self._unavailable_backends],
+        )
 
-    def validate_prometheus_readiness(self) -> None:
+    def _get_function(self, backend: _Backend, function_name: str):
+        if function_name in self._TOOLS:
+            return functools.partial(getattr(self, function_name), backend)
+        return getattr(backend.client, function_name)
+
+    async def _call_prometheus_function(self, function_call: dict, deadline: float | None = None) -> dict | list:
+        function_name = get_function_call_name(function_call)
+        label = function_name if self.is_function(function_name) else UNKNOWN_FUNCTION_LABEL
+        # The whole call is measured, including the calls that fail before reaching Prometheus
+        with tracing.span(f"prometheus.{label}"), metrics.PROMETHEUS_FUNCTION_DURATION.labels(label).time():
+            try:
+                if not isinstance(function_call, dict):
+                    raise TypeError(f"A function call is an object with a name and arguments, got {function_call!r}")
+                if label == UNKNOWN_FUNCTION_LABEL:
+                    raise ValueError(f"Unknown function {function_call.get('name')!r}")
+                arguments = function_call.get("arguments") or {}
+                if not isinstance(arguments, dict):
+                    raise TypeError(f"Function arguments are an object, got {arguments!r}")
+                arguments = dict(arguments)
+                targets = self._resolve_backends(arguments.pop(BACKENDS_ARGUMENT, None))
+                time_limit = self._get_timeout(function_name, deadline)
+                if time_limit <= 0:
+                    raise TimeoutError("Not run, no time left for this message")
+                if targets is None:
+                    if self._default_backend is None:
+                        raise self._unavailable_error(list(self._unavailable_backends))
+                    response = await self._call_backend(self._default_backend, function_name, arguments, time_limit)
+                    return shape_function_result(function_name, response)
+                return await self._fan_out(*targets, function_name, arguments, time_limit)
+            except Exception as err:
+                metrics.PROMETHEUS_FUNCTION_ERRORS.labels(label).inc()
+                error_type, message = _describe_error(err)
+                _logger.warning(f"Prometheus function {function_name} failed ({error_type}): {message}")
+                return function_error(function_name, error_type, message)
+
+    async def _call_backend(self, backend: _Backend, function_name: str, arguments: dict, time_limit: float):
+        func = self._get_function(backend, function_name)
+        try:
+            async with asyncio.timeout(time_limit):
+                return await self._call_with_breaker(backend, function_name, func, arguments)
+        except TimeoutError:
+            # A backend that hangs for the function's whole timeout counts as unavailable, so the breaker can trip.
+            # A call cut short by the message deadline says nothing about the backend.
+            if time_limit >= self._get_function_timeout(function_name):
+                backend.health_checker.breaker.record_failure()
+            raise TimeoutError(f"Timed out after {round(time_limit, 2):g}s") from None
+
+    async def _fan_out(
+        self, targets: list[_Backend], unavailable: list[str], function_name: str, arguments: dict, time_limit: float
+    ) -> dict:
+        if not targets:
+            raise self._unavailable_error(unavailable)
+        outcomes = await asyncio.gather(
+            *(self._call_backend(b, function_name, arguments, time_limit) for b in targets), return_exceptions=True
+        )
+        results = {}
+        errors = {name: f"Prometheus is unavailable: {self._unavailable_backends[name]}" for name in unavailable}
+        for backend, outcome in zip(targets, outcomes, strict=True):
+            if isinstance(outcome, Exception):
+                errors[backend.name] = _describe_error(outcome)[1]
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results[backend.name] = shape_function_result(function_name, outcome)
+        if errors:
+            _logger.warning(f"Prometheus '{function_name}' failed on some backends: {errors}")
+        if not results:
+            # Nothing to answer with, fail like a single backend call would
+            raise PrometheusUnavailableError(f"'{function_name}' failed on every backend: {errors}")
+        return merge_backend_results(function_name, results, errors)
+
+    async def _call_with_breaker(self, backend: _Backend, function_name: str, func, arguments: dict) -> dict | list:
+        health_checker = backend.health_checker
+        breaker = health_checker.breaker
+        if not breaker.allow_request():
+            raise PrometheusUnavailableError(f"Prometheus {backend.name} is unavailable: {health_checker.last_error}")
+        _logger.debug(f"Calling prometheus'{function_name}' on {backend.name} w/ {arguments}")
         try:
-            self._client.query(query="up")
-            _logger.info(f"Prometheus is ready: {self._client}")
+            response = await func(**arguments)
         except HTTPError as err:
-            _logger.exception(f"Error validating Prometheus readiness: {err!r}")
-            raise ValueError(f"Prometheus is not ready: {err}") from err
+            # A bad PromQL query (4xx) says nothing about Prometheus' health
+            if is_unavailability_error(err):
+                breaker.record_failure()
+            raise
+        breaker.record_success()
+        _logger.debug(f"Prometheus function {function_name} returned {response}")
+        return response
+
+    async def list_backends(self, _backend: _Backend) -> list[dict]:
+        return [
+            {"name": b.name, "url": b.base_url, "healthy": b.health_checker.is_healthy} for b in self._backends.values()
+        ] + [
+            {"name": name, "url": None, "healthy": False, "error": reason}
+            for name, reason in self._unavailable_backends.items()
+        ]
+
+    async def query_range(
+        self,
+        backend: _Backend,
+        *,
+        query: str,
+        lookback: str = "1h",
+        threshold: float | None = None,
+        comparison: str = ">",
+    ) -> dict:
+        # The model gets per-series statistics instead of raw samples, a day at 15s resolution is 5760 points per
+        # series. The step grows with the lookback so Prometheus never returns more than MAX_RANGE_POINTS per series.
+        if comparison not in COMPARISONS:
+            raise ValueError(f"Unsupported comparison {comparison!r}, use one of {', '.join(COMPARISONS)}")
+        duration = parse_duration(lookback)
+        step = choose_step(duration)
+        start, end = range_bounds(duration, step)
+        response = await backend.client.query_range(query=query, start=start, end=end, step=step)
+        data = response.get("data", {})
+        if data.get("resultType") != "matrix":
+            return response
+        summary = summarize_matrix(data["result"], step=step, threshold=threshold, comparison=comparison)
+        return {
+            "resultType": "matrix_summary",
+            "query": query,
+            "lookback": lookback,
+            "step_seconds": step,
+            # Time of the last point, what "last" and "matching_now" are as of
+            "end": format_time(end),
+            **summary,
+        }
+
+    async def backtest_alert(
+        self,
+        backend: _Backend,
+        *,
+        query: str,
+        thresholds: list[float] | None = None,
+        comparison: str = ">",
+        for_duration: str = "0s",
+        lookback: str = "6h",
+    ) -> dict:
+        # One range query, then the rule is evaluated locally for every candidate threshold. Answers "would this rule
+        # have fired, when, and how often" without waiting for the target to misbehave.
+        if comparison not in COMPARISONS:
+            raise ValueError(f"Unsupported comparison {comparison!r}, use one of {', '.join(COMPARISONS)}")
+        if thresholds is not None and len(thresholds) > MAX_BACKTEST_THRESHOLDS:
+            raise ValueError(f"At most {MAX_BACKTEST_THRESHOLDS} thresholds can be compared in one backtest")
+        duration = parse_duration(lookback)
+        for_seconds = parse_duration(for_duration)
+        step = choose_step(duration, BACKTEST_MAX_POINTS)
+        start, end = range_bounds(duration, step)
+        response = await backend.client.query_range(query=query, start=start, end=end, step=step)
+        data = response.get("data", {})
+        if data.get("resultType") != "matrix":
+            return response
+        results = backtest(
+            data["result"],
+            start=start,
+            step=step,
+            points=round((end - start) / step) + 1,
+            for_seconds=for_seconds,
+            thresholds=thresholds,
+            comparison=comparison,
+        )
+        backtested = {
+            "query": query,
+            "condition": f"{comparison} threshold" if thresholds is not None else "query returns a value",
+            "for": for_duration,
+            "lookback": lookback,
+            "end": format_time(end),
+            "evaluation_interval_seconds": step,
+            "series": len(data["result"]),
+            "results": results,
+        }
+        if for_seconds and step > for_seconds:
+            backtested["note"] = f"Evaluated every {step}s, so the `for` duration is rounded up to {step}s"
+        return backtested
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(b.client.aclose() for b in self._backends.values()))
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from assistant.integrations.prometheus import health
+from assistant.integrations.prometheus.health import PrometheusHealthChecker
+from assistant.logic.helpers import extract_json_tag_content
+from assistant.logic.shaping import FUNCTION_LIMITS
+from assistant.logic.tools import PrometheusFunctions, stop_health_checks
+
+_DELAY = 0.2
+
+
+async def _slow_prometheus(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(_DELAY)
+    return httpx.Response(200, json={"status": "success", "data": [request.url.params.get("match[]")]})
+
+
+@pytest_asyncio.fixture
+async def prometheus_functions(mock_prometheus_functions):
+    return await mock_prometheus_functions(_slow_prometheus)
+
+
+@pytest.mark.asyncio
+async def test_call_prometheus_functions_runs_concurrently_and_keeps_order(prometheus_functions) -> None:
+    metrics = [f"metric_{i}" for i in range(6)]
+    function_calls = [{"name": "get_metric_labels", "arguments": {"metric_name": m}} for m in metrics]
+
+    start = time.monotonic()
+    results = await prometheus_functions.call_prometheus_functions(function_calls)
+    elapsed = time.monotonic() - start
+
+    assert extract_json_tag_content(results, "function_results") == [[m] for m in metrics]
+    assert elapsed < _DELAY * 3
+
+
+@pytest.mark.asyncio
+async def test_call_prometheus_functions_empty_batch(prometheus_functions) -> None:
+    results = await prometheus_functions.call_prometheus_functions([])
+    assert results == f"<function_results>{json.dumps([])}</function_results>"
+
+
+@pytest.mark.asyncio
+async def test_call_prometheus_functions_fails_fast_when_circuit_is_open(mock_prometheus_functions) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("connection refused", request=request)
+
+    pf = await mock_prometheus_functions(handler, health_checks=False)
+    health_checker = pf._default_backend.health_checker
+    for _ in range(3):
+        await health_checker.check_once()
+
+    results = await pf.call_prometheus_functions([{"name": "get_metric_labels", "arguments": {"metric_name": "up"}}])
+
+    [error] = extract_json_tag_content(results, "function_results")
+    assert error["error"]["type"] == "unavailable"
+    assert "not reachable" in pf.get_status()
+
+
+@pytest.mark.asyncio
+async def test_query_range_returns_a_summary(mock_prometheus_functions) -> None:
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path != "/api/v1/query_range":
+            # Health checks
+            return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+        requests.append(request)
+        start, step = float(request.url.params["start"]), float(request.url.params["step"])
+        values = [[start + i * step, str(v)] for i, v in enumerate([1, 10, 10, 1])]
+        result = [{"metric": {"pod": "api-0"}, "values": values}]
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "matrix", "result": result}})
+
+    pf = await mock_prometheus_functions(handler)
+
+    results = await pf.call_prometheus_functions(
+        [{"name": "query_range", "arguments": {"query": "up", "lookback": "6h", "threshold": 5}}]
+    )
+
+    [summary] = extract_json_tag_content(results, "function_results")
+    assert len(requests) == 1
+    start, end = float(requests[0].url.params["start"]), float(requests[0].url.params["end"])
+    # The last point is at most an instant query step old, whatever the range step
+    assert time.time() - end < 15
+    assert (end - start) % 120 == 0
+    assert summary["end"] == time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(end))
+    assert summary["resultType"] == "matrix_summary"
+    assert summary["step_seconds"] == 120
+    [series] = summary["series"]
+    assert series["max"] == 10.0
+    assert series["threshold"]["longest_run_seconds"] == 240
+    PrometheusFunctions.validate_function_def("query_range")
+
+
+@pytest.mark.asyncio
+async def test_fan_out_merges_results_by_source_and_degrades_per_backend(mock_prometheus_functions) -> None:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host == "slow":
+            await asyncio.sleep(1)
+        result = [{"metric": {"alertname": "HighErrorRate"}, "value": [1700000000, "1"]}]
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": result}})
+
+    backends = {"prod": "http://prod", "staging": "http://staging", "dev": "http://slow"}
+    pf = await mock_prometheus_functions(
+        handler, health_checks=False, backends=backends, function_timeouts={"query": 0.1}
+    )
+
+    results = await pf.call_prometheus_functions(
+        [
+            {"name": "query", "arguments": {"query": "ALERTS", "backends": ["all"]}},
+            {"name": "query", "arguments": {"query": "ALERTS"}},
+            {"name": "list_backends", "arguments": {}},
+        ]
+    )
+
+    merged, default, listed = extract_json_tag_content(results, "function_results")
+    assert [s["metric"]["source"] for s in merged["data"]["result"]] == ["prod", "staging"]
+    assert merged["sources"] == ["prod", "staging"]
+    assert merged["errors"] == {"dev": "Timed out after 0.1s"}
+    assert default["data"]["result"] == [{"metric": {"alertname": "HighErrorRate"}, "value": [1700000000, "1"]}]
+    assert [b["name"] for b in listed] == ["prod", "staging", "dev"]
+
+    results = await pf.call_prometheus_functions([{"name": "query", "arguments": {"query": "up", "backends": ["qa"]}}])
+    [error] = extract_json_tag_content(results, "function_results")
+    assert error["error"]["type"] == "invalid_arguments"
+    assert "Unknown Prometheus backends" in error["error"]["message"]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_stays_within_the_single_backend_limits(mock_prometheus_functions) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/v1/query":
+            result = [{"metric": {"pod": f"api-{i}"}, "value": [1700000000, str(i)]} for i in range(5000)]
+            return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": result}})
+        if request.url.path == "/api/v1/query_range":
+            start, step = float(request.url.params["start"]), float(request.url.params["step"])
+            result = [
+                {"metric": {"pod": f"api-{i}"}, "values": [[start, str(i)], [start + step, "1"]]} for i in range(500)
+            ]
+            return httpx.Response(200, json={"status": "success", "data": {"resultType": "matrix", "result": result}})
+        return httpx.Response(200, json={"status": "success", "data": [f"api-{i}" for i in range(5000)]})
+
+    backends = {"prod": "http://prod", "staging": "http://staging", "dev": "http://dev"}
+    pf = await mock_prometheus_functions(handler, health_checks=False, backends=backends)
+    function_calls = []
+    for name, arguments in [
+        ("query", {"query": "up"}),
+        ("query_range", {"query": "up"}),
+        ("get_metric_label_values", {"metric_name": "up", "label_name": "pod"}),
+    ]:
+        function_calls.append({"name": name, "arguments": arguments})
+        function_calls.append({"name": name, "arguments": {**arguments, "backends": ["all"]}})
+
+    results = await pf.call_prometheus_functions(function_calls)
+
+    query, all_query, summary, all_summary, values, all_values = extract_json_tag_content(results, "function_results")
+    assert len(query["data"]["result"]) == len(all_query["data"]["result"]) == FUNCTION_LIMITS["query"].max_series
+    assert all_query["truncated"]["total_series"] == 3 * FUNCTION_LIMITS["query"].max_series
+    assert {s["total_series"] for s in all_query["truncated"]["by_source"].values()} == {5000}
+    assert len(json.dumps(all_query)) < 2 * len(json.dumps(query))
+    assert len(summary["series"]) == len(all_summary["series"]) == FUNCTION_LIMITS["query_range"].max_series
+    assert set(all_summary["truncated"]["by_source"]) == set(backends)
+    max_items = FUNCTION_LIMITS["get_metric_label_values"].max_items
+    assert len(values["values"]) == max_items
+    assert [len(v["values"]) for v in all_values["results"].values()] == [max_items] * 3
+
+
+@pytest.mark.asyncio
+async def test_backtest_alert_fetches_once_for_all_thresholds(mock_prometheus_functions) -> None:
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path != "/api/v1/query_range":
+            return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+        requests.append(request)
+        start, step = float(request.url.params["start"]), float(request.url.params["step"])
+        values = [[start + i * step, str(i % 100)] for i in range(int(6 * 3600 / step) + 1)]
+        result = [{"metric": {"pod": "api-0"}, "values": values}]
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "matrix", "result": result}})
+
+    pf = await mock_prometheus_functions(handler)
+
+    arguments = {"query": "rate(errors[5m])", "thresholds": [3, 8, 100], "for_duration": "2m"}
+    results = await pf.call_prometheus_functions([{"name": "backtest_alert", "arguments": arguments}])
+
+    [backtested] = extract_json_tag_content(results, "function_results")
+    assert len(requests) == 1
+    assert backtested["evaluation_interval_seconds"] == 15
+    assert [r["would_have_fired"] for r in backtested["results"]] == [True, True, False]
+
+
+@pytest.mark.asyncio
+async def test_failed_calls_return_errors_without_failing_the_batch(mock_prometheus_functions) -> None:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        query = request.url.params.get("query", "")
+        if query == "hang":
+            await asyncio.sleep(10)
+        if query == "bad(":
+            return httpx.Response(400, json={"status": "error", "errorType": "bad_data", "error": "parse error"})
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+
+    pf = await mock_prometheus_functions(handler, function_timeouts={"query": 0.1})
+
+    start = time.monotonic()
+    results = await pf.call_prometheus_functions(
+        [
+            {"name": "query", "arguments": {"query": "hang"}},
+            {"name": "query", "arguments": {"query": "bad("}},
+            {"name": "query", "arguments": {"query": "up"}},
+            {"name": "query", "arguments": {"metric": "up"}},
+        ],
+        deadline=time.monotonic() + 0.05,
+    )
+
+    assert time.monotonic() - start < 1
+    hung, bad, ok, wrong_arguments = extract_json_tag_content(results, "function_results")
+    assert hung == {"error": {"function": "query", "type": "timeout", "message": "Timed out after 0.05s"}}
+    assert bad["error"] == {"function": "query", "type": "bad_request", "message": "parse error"}
+    assert ok["data"]["result"] == []
+    assert wrong_arguments["error"]["type"] == "invalid_arguments"
+
+
+@pytest.mark.asyncio
+async def test_malformed_function_calls_return_errors(prometheus_functions) -> None:
+    results = await prometheus_functions.call_prometheus_functions(
+        ["query", {"name": ["query"], "arguments": {}}, {"name": "query", "arguments": "up"}, {"arguments": {}}]
+    )
+
+    errors = [e["error"] for e in extract_json_tag_content(results, "function_results")]
+    assert [(e["function"], e["type"]) for e in errors] == [
+        (None, "invalid_arguments"),
+        (None, "invalid_arguments"),
+        ("query", "invalid_arguments"),
+        (None, "invalid_arguments"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_a_single_function_call_is_a_batch_of_one(prometheus_functions) -> None:
+    results = await prometheus_functions.call_prometheus_functions(
+        {"name": "get_metric_labels", "arguments": {"metric_name": "up"}}
+    )
+
+    assert extract_json_tag_content(results, "function_results") == [["up"]]
+
+
+@pytest.mark.asyncio
+async def test_client_internals_are_not_functions(prometheus_functions) -> None:
+    results = await prometheus_functions.call_prometheus_functions(
+        [{"name": "aclose", "arguments": {}}, {"name": "_get", "arguments": {"path": "/api/v1/query"}}]
+    )
+
+    assert [e["error"]["type"] for e in extract_json_tag_content(results, "function_results")] == [
+        "invalid_arguments",
+        "invalid_arguments",
+    ]
+    # The session's client is still open
+    results = await prometheus_functions.call_prometheus_functions([{"name": "query", "arguments": {"query": "up"}}])
+    assert "error" not in extract_json_tag_content(results, "function_results")[0]
+
+
+@pytest.mark.asyncio
+async def test_backend_timeouts_trip_the_circuit(mock_prometheus_functions) -> None:
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        await asyncio.sleep(10)
+
+    pf = await mock_prometheus_functions(
+        handler, health_checks=False, function_timeouts={"query": 0.05}, cache=None, single_flight=None
+    )
+    calls = [{"name": "query", "arguments": {"query": f"up{i}"}} for i in range(3)]
+
+    # Cut short by the message deadline, not the backend's fault
+    await pf.call_prometheus_functions(calls, deadline=time.monotonic() + 0.02)
+    assert pf._default_backend.health_checker.breaker.allow_request()
+
+    await pf.call_prometheus_functions(calls)
+    results = await pf.call_prometheus_functions([{"name": "query", "arguments": {"query": "down"}}])
+
+    [error] = extract_json_tag_content(results, "function_results")
+    assert error["error"]["type"] == "unavailable"
+    # Failed fast, without waiting on the backend again
+    assert len(requests) == 6
+
+
+@pytest.mark.asyncio
+async def test_unavailable_backends_fail_per_call(mock_prometheus_functions) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+
+    unavailable = {"staging": "Port forward failed: ConnectionError: no route to cluster"}
+    # Every port forward failed: the session is still built, each call gets an error
+    nothing_reachable = await mock_prometheus_functions(handler, backends={}, unavailable_backends=unavailable)
+    results = await nothing_reachable.call_prometheus_functions([{"name": "query", "arguments": {"query": "up"}}])
+
+    [error] = extract_json_tag_content(results, "function_results")
+    assert error["error"]["type"] == "unavailable"
+    assert "staging: Port forward failed" in error["error"]["message"]
+    assert "staging: Prometheus is unavailable" in nothing_reachable.get_status()
+
+    pf = await mock_prometheus_functions(
+        handler, health_checks=False, backends={"prod": "http://prod"}, unavailable_backends=unavailable
+    )
+    results = await pf.call_prometheus_functions(
+        [
+            {"name": "query", "arguments": {"query": "up", "backends": ["all"]}},
+            {"name": "query", "arguments": {"query": "up", "backends": "staging"}},
+            {"name": "list_backends", "arguments": {}},
+        ]
+    )
+
+    fanned_out, staging_only, backends = extract_json_tag_content(results, "function_results")
+    assert fanned_out["sources"] == ["prod"]
+    assert fanned_out["errors"] == {"staging": f"Prometheus is unavailable: {unavailable['staging']}"}
+    assert staging_only["error"]["type"] == "unavailable"
+    assert [b["name"] for b in backends] == ["prod", "staging"]
+    assert backends[1] == {"name": "staging", "url": None, "healthy": False, "error": unavailable["staging"]}
+
+
+@pytest.mark.asyncio
+async def test_stop_health_checks_closes_the_shared_checkers(monkeypatch) -> None:
+    checker = PrometheusHealthChecker(base_url="http://localhost", transport=httpx.MockTransport(_slow_prometheus))
+    monkeypatch.setattr(health, "_health_checkers", {"http://localhost": checker})
+    checker.ensure_started()
+
+    await stop_health_checks()
+
+    assert checker._task is None
+    assert checker._client._client.is_closed
+    assert health.get_health_checker("http://localhost") is not checker
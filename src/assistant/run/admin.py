@@ -0,0 +1,54 @@
+import asyncio
+import os
+import secrets
+import threading
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from assistant.telemetry.profiler import MAX_PROFILE_SECONDS, format_collapsed, sample_stacks
+from assistant.telemetry.tracing import TRACE_BUFFER
+
+# The admin endpoints are served only when a token is configured, and only to requests with
+# `Authorization: Bearer <token>`: traces hold session content and a profile keeps a thread busy.
+ADMIN_TOKEN_ENV_VAR = "ASSISTANT_ADMIN_TOKEN"
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+def require_admin_token(credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(_bearer)]) -> None:
+    token = os.environ.get(ADMIN_TOKEN_ENV_VAR)
+    if not token:
+        # Not advertised when disabled
+        raise HTTPException(status_code=404)
+    if credentials is None or not secrets.compare_digest(credentials.credentials.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin_token)])
+
+# One profile at a time, each one keeps a thread busy polling the event loop's stack.
+_profile_lock = asyncio.Lock()
+
+
+@router.get("/traces")
+async def get_traces(limit: Annotated[int, Query(ge=1)] = 50):
+    return {"traces": TRACE_BUFFER.recent(limit)}
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def get_profile(
+    seconds: Annotated[float, Query(gt=0, le=MAX_PROFILE_SECONDS)] = 5,
+    interval_ms: Annotated[float, Query(ge=1, le=1000)] = 5,
+):
+    # Samples the event loop thread (the one serving this request) while it keeps handling chats, and returns
+    # collapsed stacks, e.g. for https://www.speedscope.app or flamegraph.pl.
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already being taken")
+    async with _profile_lock:
+        samples = await asyncio.to_thread(
+            sample_stacks, thread_id=threading.get_ident(), duration=seconds, interval=interval_ms / 1000
+        )
+    return format_collapsed(samples)
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from assistant.run.admin import ADMIN_TOKEN_ENV_VAR, router
+from assistant.telemetry import tracing
+
+_TOKEN = "s3cret"
+_AUTH = {"Authorization": f"Bearer {_TOKEN}"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv(ADMIN_TOKEN_ENV_VAR, _TOKEN)
+    app = FastAPI()
+    app.include_router(router)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_admin_endpoints_are_disabled_without_a_token(client, monkeypatch) -> None:
+    monkeypatch.delenv(ADMIN_TOKEN_ENV_VAR)
+
+    assert client.get("/admin/traces", headers=_AUTH).status_code == 404
+    assert client.get("/admin/profile", params={"seconds": 0.01}, headers=_AUTH).status_code == 404
+
+
+def test_admin_endpoints_require_the_token(client) -> None:
+    assert client.get("/admin/traces").status_code == 401
+    response = client.get("/admin/profile", params={"seconds": 0.01}, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+
+
+def test_traces_returns_recent_traces(client) -> None:
+    with tracing.trace("llm.message", session_id="s1"), tracing.span("prometheus.query"):
+        pass
+
+    response = client.get("/admin/traces", params={"limit": 1}, headers=_AUTH)
+
+    assert response.status_code == 200
+    [trace] = response.json()["traces"]
+    assert trace["name"] == "llm.message"
+    assert [s["name"] for s in trace["spans"]] == ["prometheus.query"]
+
+
+def test_profile_returns_collapsed_stacks_one_profile_at_a_time(client) -> None:
+    responses = {}
+
+    def profile(name: str, seconds: float) -> None:
+        responses[name] = client.get("/admin/profile", params={"seconds": seconds, "interval_ms": 5}, headers=_AUTH)
+
+    first = threading.Thread(target=profile, args=("first", 0.5))
+    first.start()
+    # Let the first profile start before asking for another one
+    time.sleep(0.2)
+    profile("second", 0.01)
+    first.join()
+
+    assert responses["first"].status_code == 200
+    assert responses["first"].headers["content-type"].startswith("text/plain")
+    assert responses["second"].status_code == 409
@@ -6,6 +6,8 @@ from dotenv import load_dotenv
 from langsmith import traceable
 
 from assistant.logic.llm import LLMSession, Stream, new_llm_session
+from assistant.logic.tools import retry_unavailable_backends
+from assistant.telemetry import tracing
 
 load_dotenv()
 
@@ -46,34 +48,39 @@ def get_user_msg(msg: str) -> str:
 
 
 async def on_message_start(stream: Stream):
-    message = cl.Message(content="")
-    msg_buffer = []
-    async for token in stream:
-        msg_buffer.append(token)
-        await message.stream_token(token)
-    msg_Content = "".join(msg_buffer).strip()
-    if not msg_Content:
-        await message.remove()
-        return
-    # _logger.info(f"Message: {''.join(msg_buffer)}")
-    await message.update()
+    with tracing.span("chainlit.message_stream") as span_attributes:
+        message = cl.Message(content="")
+        msg_buffer = []
+        async for token in stream:
+            msg_buffer.append(token)
+            await message.stream_token(token)
+        span_attributes["chunks"] = len(msg_buffer)
+        msg_Content = "".join(msg_buffer).strip()
+        if not msg_Content:
+            await message.remove()
+            return
+        # _logger.info(f"Message: {''.join(msg_buffer)}")
+        await message.update()
 
 
 async def on_tag_start(tag_name: str, stream: Stream):
-    message = cl.Message(content="")
-    step = cl.Step(name=tag_name, parent_id=message.id)
-    tag_buffer = []
-    async for token in stream:
-        tag_buffer.append(token)
-        await step.stream_token(token)
-    _logger.info(f"Tag: {''.join(tag_buffer)}")
-    await step.update()
+    with tracing.span("chainlit.tag_stream", tag=tag_name) as span_attributes:
+        message = cl.Message(content="")
+        step = cl.Step(name=tag_name, parent_id=message.id)
+        tag_buffer = []
+        async for token in stream:
+            tag_buffer.append(token)
+            await step.stream_token(token)
+        span_attributes["chunks"] = len(tag_buffer)
+        _logger.info(f"Tag: {''.join(tag_buffer)}")
+        await step.update()
 
 
 @traceable
 @cl.on_chat_start
 async def on_chat_start() -> None:
     use_recent = False
+    await retry_unavailable_backends()
     session: LLMSession = new_llm_session(
         session_id=cl_context.session.id,
         start_from_recent=use_recent,
@@ -87,6 +94,13 @@ async def on_chat_start() -> None:
         await session.resume_from_recent()
 
 
+@cl.on_chat_end
+async def on_chat_end() -> None:
+    llm_session: LLMSession | None = cl.user_session.get("llm_session")
+    if llm_session is not None:
+        await llm_session.close()
+
+
 @cl.on_message
 async def on_message(message: str) -> None:
     llm_session: LLMSession = cl.user_session.get("llm_session")
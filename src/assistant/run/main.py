@@ -1,15 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+
 import uvicorn
 from chainlit.utils import mount_chainlit
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from assistant.integrations.prometheus.backends import get_backend_registry
+from assistant.logic.lazy_imports import get_litellm
+from assistant.logic.llm import get_promql_alerts_rules_assistant_prompt
+from assistant.logic.tools import start_health_checks, stop_health_checks
+from assistant.run.admin import router as admin_router
+
 
-from assistant.run import core as assistant_core
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Render the system prompt and start probing Prometheus before the first chat, so new chats don't wait on either.
+    get_promql_alerts_rules_assistant_prompt()
+    await get_backend_registry().start()
+    start_health_checks()
+    # Import litellm off the event loop once the server is up, the worker boots without it but the first chat
+    # shouldn't have to wait for it either.
+    litellm_warmup = asyncio.create_task(asyncio.to_thread(get_litellm))
+    yield
+    litellm_warmup.cancel()
+    # Before the port forwards close, so the last probes don't fail against them
+    await stop_health_checks()
+    await get_backend_registry().stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(admin_router)
 
 
 _CHAINLIT_PATH = "/cl"
+# Chainlit loads the target file itself, importing it here as well would run it twice.
+_CHAINLIT_TARGET = str(Path(__file__).parent / "core.py")
 
 
 @app.get("/app")
@@ -17,13 +46,18 @@ def read_main():
     return {"message": "Hello World from main app"}
 
 
+@app.get("/metrics")
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/")
 def redirect_to_cl():
     return RedirectResponse(url=_CHAINLIT_PATH)
 
 
 app.mount("/icons", StaticFiles(directory="assets/public/icons"), name="icons")
-mount_chainlit(app=app, target=assistant_core.__file__, path=_CHAINLIT_PATH)
+mount_chainlit(app=app, target=_CHAINLIT_TARGET, path=_CHAINLIT_PATH)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8080)
@@ -0,0 +1,88 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+# Measures what it costs a fresh worker to import the web entry point, each run in a new interpreter.
+# Run with: PYTHONPATH=src python -m assistant.run.startup_benchmark
+
+ENTRY_POINT = "assistant.run.main"
+# Only needed once a chat starts, or never on the web path
+DEFERRED_MODULES = ("litellm", "kubernetes")
+
+# Peak RSS is read from VmHWM, which starts over with the new address space at exec. ru_maxrss doesn't: the child
+# reports the peak of whatever process spawned it (e.g. pytest) when that is higher. macOS has no /proc, but reports
+# ru_maxrss per process, in bytes.
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+
+def max_rss_bytes():
+    if sys.platform == "darwin":
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmHWM missing from /proc/self/status")
+
+print(json.dumps({{
+    "seconds": seconds,
+    "max_rss_bytes": max_rss_bytes(),
+    "loaded": [m for m in {deferred!r} if m in sys.modules],
+}}))
+"""
+
+_REPO_ROOT = Path(__file__).resolve().parents[3]
+
+
+@dataclass(frozen=True)
+class StartupResult:
+    import_seconds: float
+    max_rss_bytes: int
+    loaded_deferred_modules: tuple[str, ...]
+
+
+def measure_import(module: str = ENTRY_POINT) -> StartupResult:
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(_REPO_ROOT / "src"), os.getenv("PYTHONPATH")])),
+    }
+    # main.py mounts the static assets and Chainlit relative to the repo root
+    completed = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module, deferred=DEFERRED_MODULES)],
+        cwd=_REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    probe = json.loads(completed.stdout.strip().splitlines()[-1])
+    return StartupResult(
+        import_seconds=probe["seconds"],
+        max_rss_bytes=probe["max_rss_bytes"],
+        loaded_deferred_modules=tuple(probe["loaded"]),
+    )
+
+
+def run(*, repeat: int = 5, module: str = ENTRY_POINT) -> list[StartupResult]:
+    return [measure_import(module) for _ in range(repeat)]
+
+
+def main() -> None:
+    results = run()
+    seconds = [r.import_seconds for r in results]
+    rss = [r.max_rss_bytes / 2**20 for r in results]
+    print(f"import {ENTRY_POINT} x{len(results)}")  # noqa: T201
+    print(f"  import time  median={statistics.median(seconds):.3f}s  max={max(seconds):.3f}s")  # noqa: T201
+    print(f"  max RSS      median={statistics.median(rss):.1f} MiB  max={max(rss):.1f} MiB")  # noqa: T201
+    print(f"  deferred modules loaded: {list(results[-1].loaded_deferred_modules) or 'none'}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import statistics
+
+import pytest
+
+from assistant.run.startup_benchmark import measure_import, run
+
+# Budgets for importing the web entry point in a fresh interpreter. Importing litellm alone takes ~0.7s and ~90MiB,
+# these trip if it (or something as heavy) is back on the import path.
+MAX_IMPORT_SECONDS = 1.5
+MAX_RSS_BYTES = 160 * 1024 * 1024
+
+
+def test_web_entry_point_defers_heavy_imports() -> None:
+    assert measure_import().loaded_deferred_modules == ()
+
+
+@pytest.mark.benchmark
+def test_web_entry_point_startup_budget() -> None:
+    results = run(repeat=3)
+    assert statistics.median(r.import_seconds for r in results) <= MAX_IMPORT_SECONDS
+    assert max(r.max_rss_bytes for r in results) <= MAX_RSS_BYTES
+
+
+@pytest.mark.benchmark
+def test_peak_rss_is_measured_in_the_child_only() -> None:
+    # A parent with a higher peak (the pytest process after other benchmarks) doesn't leak into the measurement
+    ballast = bytearray(2 * MAX_RSS_BYTES)
+    ballast[::4096] = b"x" * len(range(0, len(ballast), 4096))
+    assert measure_import().max_rss_bytes <= MAX_RSS_BYTES
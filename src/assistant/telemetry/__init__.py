@@ -0,0 +1 @@
+# This file makes the src directory a Python package
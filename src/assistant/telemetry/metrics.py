@@ -0,0 +1,78 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Exposed on /metrics by run/main.py, see also: https://prometheus.github.io/client_python/
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+_FUNCTION_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+_QUEUE_DEPTH_BUCKETS = (0, 16, 64, 256, 1024, 4096, 16384, 65536)
+_HISTORY_MESSAGES_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "assistant_llm_time_to_first_token_seconds",
+    "Time from sending a completion request to receiving the first content token",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "assistant_llm_tokens_per_second",
+    "Streamed content tokens per second, measured after the first token",
+    ["model"],
+    buckets=_TOKENS_PER_SECOND_BUCKETS,
+)
+LLM_STREAM_DURATION = Histogram(
+    "assistant_llm_stream_duration_seconds",
+    "Total duration of a streamed LLM completion",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+PROMETHEUS_FUNCTION_DURATION = Histogram(
+    "assistant_prometheus_function_duration_seconds",
+    "Latency of the Prometheus functions called by the LLM",
+    ["function"],
+    buckets=_FUNCTION_LATENCY_BUCKETS,
+)
+PROMETHEUS_FUNCTION_ERRORS = Counter(
+    "assistant_prometheus_function_errors_total",
+    "Prometheus function calls that raised an error",
+    ["function"],
+)
+PROMETHEUS_MERGED_REQUESTS = Counter(
+    "assistant_prometheus_merged_requests_total",
+    "Prometheus API requests that joined an identical request already in flight instead of being sent",
+    ["path"],
+)
+
+TOOL_ROUNDS_PER_MESSAGE = Histogram(
+    "assistant_tool_rounds_per_message",
+    "Function call rounds the LLM needed to answer a message",
+    buckets=(0, 1, 2, 3, 4, 5, 8, 12, 20, 30),
+)
+TOOL_LOOP_BUDGET_EXHAUSTED = Counter(
+    "assistant_tool_loop_budget_exhausted_total",
+    "Messages whose function calls were cut short by the time budget or the function call limit",
+    ["reason"],
+)
+
+STREAM_ACTIVE_TASKS = Gauge(
+    "assistant_stream_active_tasks",
+    "Stream callback tasks currently running in StreamHandler",
+)
+STREAM_QUEUE_DEPTH = Histogram(
+    "assistant_stream_queue_depth",
+    "Chars waiting in a StreamHandler queue, observed when a chunk is enqueued",
+    ["stream"],
+    buckets=_QUEUE_DEPTH_BUCKETS,
+)
+STREAM_BACKPRESSURE_WAITS = Counter(
+    "assistant_stream_backpressure_waits_total",
+    "Times a producer waited because a StreamHandler queue was full",
+)
+
+ACTIVE_SESSIONS = Gauge("assistant_active_sessions", "LLM sessions currently open")
+SESSION_HISTORY_MESSAGES = Histogram(
+    "assistant_session_history_messages",
+    "Messages in the session history, observed on each LLM call",
+    buckets=_HISTORY_MESSAGES_BUCKETS,
+)
@@ -0,0 +1,110 @@
+import httpx
+import pytest
+import pytest_asyncio
+from prometheus_client import REGISTRY, generate_latest
+
+from assistant.logic import llm
+from assistant.logic.fake_llm import ScriptedCompletion
+from assistant.logic.history import SQLiteHistoryStore
+
+
+def _sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+async def _prometheus(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/api/v1/query":
+        if "bad" in request.url.params["query"]:
+            return httpx.Response(400, json={"status": "error", "error": "parse error"})
+        return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": []}})
+    if request.url.path == "/api/v1/metadata":
+        return httpx.Response(200, json={"status": "success", "data": {}})
+    return httpx.Response(200, json={"status": "success", "data": ["job"]})
+
+
+@pytest_asyncio.fixture
+async def prometheus_functions(mock_prometheus_functions):
+    return await mock_prometheus_functions(_prometheus)
+
+
+@pytest.mark.asyncio
+async def test_llm_session_records_hot_path_metrics(prometheus_functions, tmp_path) -> None:
+    async def drain(*args) -> None:
+        async for _ in args[-1]:
+            pass
+
+    model = {"model": llm.CURRENT_MODEL}
+    before = {
+        "ttft": _sample("assistant_llm_time_to_first_token_seconds_count", **model),
+        "tokens_per_sec": _sample("assistant_llm_tokens_per_second_count", **model),
+        "streams": _sample("assistant_llm_stream_duration_seconds_count", **model),
+        "labels_calls": _sample("assistant_prometheus_function_duration_seconds_count", function="get_metric_labels"),
+        "rounds": _sample("assistant_tool_rounds_per_message_sum"),
+        "sessions": _sample("assistant_active_sessions"),
+        "message_chunks": _sample("assistant_stream_queue_depth_count", stream="message"),
+    }
+
+    session = llm.LLMSession(
+        session_id="s1",
+        start_from_recent=False,
+        on_message_start_cb=drain,
+        on_tag_start_cb=drain,
+        history_store=SQLiteHistoryStore(tmp_path / "history.sqlite3"),
+        prometheus=prometheus_functions,
+        completion_fn=ScriptedCompletion(
+            metric_names=["http_requests_total"], tool_rounds=2, time_to_first_token=0.01, tokens_per_sec=1000
+        ),
+    )
+    assert _sample("assistant_active_sessions") == before["sessions"] + 1
+    await session.process_message(incoming_message="alert on errors")
+    await session._stream_extractor.wait_for_tasks()
+    await session.close()
+
+    assert _sample("assistant_llm_time_to_first_token_seconds_count", **model) == before["ttft"] + 3
+    assert _sample("assistant_llm_tokens_per_second_count", **model) == before["tokens_per_sec"] + 3
+    assert _sample("assistant_llm_stream_duration_seconds_count", **model) == before["streams"] + 3
+    assert (
+        _sample("assistant_prometheus_function_duration_seconds_count", function="get_metric_labels")
+        == before["labels_calls"] + 2
+    )
+    assert _sample("assistant_tool_rounds_per_message_sum") == before["rounds"] + 2
+    assert _sample("assistant_stream_queue_depth_count", stream="message") > before["message_chunks"]
+    assert _sample("assistant_active_sessions") == before["sessions"]
+    assert _sample("assistant_stream_active_tasks") == 0
+    assert b"assistant_llm_time_to_first_token_seconds_bucket" in generate_latest()
+
+
+@pytest.mark.asyncio
+async def test_prometheus_function_errors_are_counted(prometheus_functions) -> None:
+    before = _sample("assistant_prometheus_function_errors_total", function="query")
+
+    results = await prometheus_functions.call_prometheus_functions([{"name": "query", "arguments": {"query": "bad("}}])
+
+    assert '"type": "bad_request", "message": "parse error"' in results
+
+    assert _sample("assistant_prometheus_function_errors_total", function="query") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_functions_share_one_label(prometheus_functions) -> None:
+    before = _sample("assistant_prometheus_function_errors_total", function="unknown")
+
+    await prometheus_functions.call_prometheus_functions(
+        [{"name": "get_everything", "arguments": {}}, {"name": "__init__", "arguments": {}}]
+    )
+
+    assert _sample("assistant_prometheus_function_errors_total", function="unknown") == before + 2
+    assert (
+        REGISTRY.get_sample_value("assistant_prometheus_function_errors_total", {"function": "get_everything"}) is None
+    )
+
+
+@pytest.mark.asyncio
+async def test_calls_failing_before_prometheus_are_counted(prometheus_functions) -> None:
+    before = _sample("assistant_prometheus_function_errors_total", function="query")
+
+    await prometheus_functions.call_prometheus_functions(
+        [{"name": "query", "arguments": {"query": "up", "backends": ["nope"]}}]
+    )
+
+    assert _sample("assistant_prometheus_function_errors_total", function="query") == before + 1
@@ -0,0 +1,44 @@
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+MAX_PROFILE_SECONDS = 60
+MAX_STACK_DEPTH = 64
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+def _collapse_stack(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def sample_stacks(*, thread_id: int, duration: float, interval: float = 0.005) -> Counter[str]:
+    # Polls the target thread's stack from the calling thread, the target keeps running unmodified. Must not be
+    # called from the target thread itself, e.g. run it with asyncio.to_thread() to profile the event loop.
+    if thread_id == threading.get_ident():
+        raise ValueError("Cannot sample the stack of the calling thread")
+    duration = min(duration, MAX_PROFILE_SECONDS)
+    samples: Counter[str] = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        samples[_collapse_stack(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return samples
+
+
+def format_collapsed(samples: Counter[str]) -> str:
+    # One "frame;frame;frame count" line per stack, the input format of flamegraph.pl and speedscope.
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
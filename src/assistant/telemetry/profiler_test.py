@@ -0,0 +1,34 @@
+import threading
+import time
+
+import pytest
+
+from assistant.telemetry.profiler import format_collapsed, sample_stacks
+
+
+def _busy_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_stacks_of_another_thread() -> None:
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_loop, args=(stop,))
+    worker.start()
+    try:
+        samples = sample_stacks(thread_id=worker.ident, duration=0.2, interval=0.005)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert sum(samples.values()) > 5
+    assert all("_busy_loop (profiler_test.py:" in stack for stack in samples)
+    top_stack, count = samples.most_common(1)[0]
+    assert format_collapsed(samples).splitlines()[0] == f"{top_stack} {count}"
+
+
+def test_sample_stacks_refuses_the_calling_thread() -> None:
+    start = time.monotonic()
+    with pytest.raises(ValueError, match="calling thread"):
+        sample_stacks(thread_id=threading.get_ident(), duration=1)
+    assert time.monotonic() - start < 0.5
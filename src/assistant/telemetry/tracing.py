@@ -0,0 +1,117 @@
+import itertools
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+# Traces kept in memory for /admin/traces, oldest are dropped first.
+TRACE_BUFFER_SIZE = 200
+# Bounds a single trace, e.g. a tool loop that runs away.
+MAX_SPANS_PER_TRACE = 500
+
+_trace_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: float
+    attributes: dict
+
+    def as_dict(self, trace_start: float) -> dict:
+        return {
+            "name": self.name,
+            "offset_ms": round((self.start - trace_start) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            **({"attributes": self.attributes} if self.attributes else {}),
+        }
+
+
+@dataclass
+class Trace:
+    trace_id: int
+    name: str
+    attributes: dict
+    started_at: float = field(default_factory=time.time)
+    start: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    spans: list[Span] = field(default_factory=list)
+    dropped_spans: int = 0
+
+    def add_span(self, span: Span) -> None:
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped_spans += 1
+            return
+        self.spans.append(span)
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            # None while the trace is still in progress
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "spans": [s.as_dict(self.start) for s in sorted(self.spans, key=lambda s: s.start)],
+            "dropped_spans": self.dropped_spans,
+        }
+
+
+class TraceBuffer:
+    def __init__(self, max_traces: int = TRACE_BUFFER_SIZE) -> None:
+        self._traces: deque[Trace] = deque(maxlen=max_traces)
+
+    def add(self, trace: Trace) -> None:
+        self._traces.append(trace)
+
+    def recent(self, limit: int | None = None) -> list[dict]:
+        traces = list(self._traces)[-limit:] if limit else list(self._traces)
+        return [t.as_dict() for t in reversed(traces)]
+
+    def clear(self) -> None:
+        self._traces.clear()
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+
+TRACE_BUFFER = TraceBuffer()
+
+# Tasks copy the context they are created in, so stream callbacks and speculative calls land in the same trace.
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def trace(name: str, *, buffer: TraceBuffer = TRACE_BUFFER, **attributes) -> Iterator[Trace]:
+    current = Trace(trace_id=next(_trace_ids), name=name, attributes=attributes)
+    buffer.add(current)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    # Yields the span attributes, so callers can add what they only know at the end. Outside a trace it's a no-op.
+    current = _current_trace.get()
+    if current is None:
+        yield attributes
+        return
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        current.add_span(Span(name=name, start=start, duration=time.perf_counter() - start, attributes=attributes))
+
+
+def record_span(name: str, *, start: float, duration: float, **attributes) -> None:
+    # For stages measured piecemeal, e.g. the time spent in tag extraction across all tokens of a response.
+    current = _current_trace.get()
+    if current is not None:
+        current.add_span(Span(name=name, start=start, duration=duration, attributes=attributes))
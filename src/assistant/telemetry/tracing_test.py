@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from assistant.telemetry.tracing import TraceBuffer, record_span, span, trace
+
+
+def test_spans_outside_a_trace_are_dropped() -> None:
+    buffer = TraceBuffer()
+    with span("orphan") as attributes:
+        attributes["ignored"] = True
+    record_span("orphan", start=0.0, duration=1.0)
+    with trace("traced", buffer=buffer), span("kept"):
+        pass
+
+    assert [s["name"] for s in buffer.recent()[0]["spans"]] == ["kept"]
+
+
+def test_trace_buffer_keeps_the_most_recent_traces() -> None:
+    buffer = TraceBuffer(max_traces=2)
+    for name in ("first", "second", "third"):
+        with trace(name, buffer=buffer):
+            pass
+
+    assert [t["name"] for t in buffer.recent()] == ["third", "second"]
+    assert [t["name"] for t in buffer.recent(1)] == ["third"]
+
+
+@pytest.mark.asyncio
+async def test_spans_from_tasks_land_in_the_trace_they_were_created_in() -> None:
+    buffer = TraceBuffer()
+
+    async def stage(name: str) -> None:
+        with span(name, stage=name):
+            await asyncio.sleep(0.01)
+
+    with trace("process_message", buffer=buffer, session_id="s1") as current:
+        await asyncio.gather(asyncio.create_task(stage("llm")), asyncio.create_task(stage("prometheus")))
+        with span("history") as attributes:
+            attributes["messages"] = 3
+
+    (dumped,) = buffer.recent()
+    assert dumped["trace_id"] == current.trace_id
+    assert dumped["attributes"] == {"session_id": "s1"}
+    assert sorted(s["name"] for s in dumped["spans"]) == ["history", "llm", "prometheus"]
+    assert next(s for s in dumped["spans"] if s["name"] == "history")["attributes"] == {"messages": 3}
+    assert all(s["duration_ms"] >= 10 for s in dumped["spans"] if s["name"] != "history")
+    assert dumped["duration_ms"] >= max(s["offset_ms"] + s["duration_ms"] for s in dumped["spans"])